@@ -45,6 +45,30 @@ def create_app():
     # Initialize CSRF protection
     csrf = CSRFProtect(app)
 
+    # Realtime push (SSE) untuk chat
+    from realtime import init_realtime
+    init_realtime(app)
+
+    # Cache data referensi (kategori), dihapus otomatis saat ada perubahan
+    from cache import init_cache
+    init_cache(app)
+
+    # File upload ditulis langsung ke disk saat body request dibaca
+    from uploads import init_uploads
+    init_uploads(app)
+
+    # Resize foto produk di background, bukan di dalam request upload
+    from images import init_images
+    init_images(app)
+
+    # Graf barter multi-pihak dibangun di background per worker
+    from cycles import init_cycles
+    init_cycles(app)
+
+    # Daftar produk serupa diperbarui di background setelah produk berubah
+    from similar import init_similar
+    init_similar(app)
+
     # User loader for Flask-Login
     @login_manager.user_loader
     def load_user(user_id):
@@ -69,6 +93,10 @@ def create_app():
     app.register_blueprint(transactions, url_prefix='/transactions')
     app.register_blueprint(admin, url_prefix='/admin')
 
+    # Thumbnail on-demand: /img/products/<filename>?w=...
+    from resize import img
+    app.register_blueprint(img)
+
     # Initialize default data within the app context
     with app.app_context():
         init_db()
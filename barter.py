@@ -0,0 +1,119 @@
+"""
+Saran barter: produk mana yang paling cocok ditukar dengan produk lain
+
+Skor kecocokan (sama dengan /products/suggest_barter sebelumnya):
+- kategori sama: +CATEGORY_SCORE;
+- selisih poin <= 10 / 20 / 30: +30 / +20 / +10 (POINT_BANDS);
+- kondisi sama: +CONDITION_SCORE.
+
+Dulu semua produk user dimuat ke Python dan diberi skor satu per satu
+(ditambah lazy load kategori dan gambar per produk). Sekarang skor adalah
+satu ekspresi SQL, database yang mengurutkan, dan hanya SUGGESTION_LIMIT
+produk teratas yang dimuat.
+
+Dua arah:
+- suggest_offers(): produk milik user yang paling cocok ditawarkan untuk
+  produk orang lain (tombol Quick Barter);
+- suggest_matches(): produk user lain yang paling cocok dengan produk
+  milik user. Kandidatnya seluruh katalog, jadi skor dicari per level dari
+  yang tertinggi; setiap level adalah filter kategori / rentang poin /
+  kondisi yang bisa memakai index (category_id, total_points), dan
+  pencarian berhenti begitu SUGGESTION_LIMIT produk terkumpul.
+"""
+
+from itertools import groupby
+from sqlalchemy import and_, case, func, or_
+from models import db, Product
+from loaders import PRODUCT_CARD
+
+CATEGORY_SCORE = 50
+CONDITION_SCORE = 20
+# (selisih poin maksimum, skor), dari pita tersempit
+POINT_BANDS = ((10, 30), (20, 20), (30, 10))
+GOOD_MATCH_SCORE = 50
+SUGGESTION_LIMIT = 6
+
+
+def point_difference(points):
+    return func.abs(Product.total_points - points)
+
+
+def match_score(target):
+    """SQL expression scoring Product rows against `target`"""
+    difference = point_difference(target.total_points)
+    return (
+        case((Product.category_id == target.category_id, CATEGORY_SCORE), else_=0)
+        + case(*[(difference <= max_difference, score) for max_difference, score in POINT_BANDS], else_=0)
+        + case((Product.condition == target.condition, CONDITION_SCORE), else_=0)
+    )
+
+
+def suggest_offers(target, user_id, limit=SUGGESTION_LIMIT):
+    """The user's available products best suited to offer for `target`
+
+    Returns ([(product, match_score), ...] best first, number of available
+    products the user has). Ties keep the oldest product first.
+    """
+    score = match_score(target).label('match_score')
+    rows = db.session.query(Product, score, func.count().over()).options(*PRODUCT_CARD).filter(
+        Product.user_id == user_id, Product.is_available == True
+    ).order_by(score.desc(), Product.id).limit(limit).all()
+    Product.preload_main_images([product for product, _, _ in rows])
+    return [(product, score) for product, score, _ in rows], rows[0][2] if rows else 0
+
+
+def _points_band(points, low, high):
+    """Products whose point difference to `points` is in (low, high]; high=None means unbounded"""
+    if low is None:
+        return Product.total_points.between(points - high, points + high)
+    below = Product.total_points < points - low
+    above = Product.total_points > points + low
+    if high is not None:
+        below = and_(below, Product.total_points >= points - high)
+        above = and_(above, Product.total_points <= points + high)
+    return or_(below, above)
+
+
+def score_levels(target):
+    """[(score, predicate), ...] from the best score down, one predicate per score
+
+    Every combination of category / point band / condition becomes a
+    filter, so each level can be searched on its own.
+    """
+    points = target.total_points or 0
+    bands, low = [], None
+    for max_difference, score in POINT_BANDS:
+        bands.append((score, _points_band(points, low, max_difference)))
+        low = max_difference
+    bands.append((0, _points_band(points, low, None)))
+
+    combinations = sorted((
+        (category_score + band_score + condition_score, and_(category, band, condition))
+        for category_score, category in ((CATEGORY_SCORE, Product.category_id == target.category_id),
+                                         (0, Product.category_id != target.category_id))
+        for band_score, band in bands
+        for condition_score, condition in ((CONDITION_SCORE, Product.condition == target.condition),
+                                           (0, Product.condition != target.condition))
+    ), key=lambda combination: -combination[0])
+    return [(score, or_(*[predicate for _, predicate in group]))
+            for score, group in groupby(combinations, key=lambda combination: combination[0])
+            if score > 0]
+
+
+def suggest_matches(product, limit=SUGGESTION_LIMIT):
+    """Other users' available products that best match `product`
+
+    Returns [(product, match_score), ...] best first; products scoring 0
+    are never suggested.
+    """
+    candidates = Product.query.options(*PRODUCT_CARD).filter(
+        Product.user_id != product.user_id, Product.is_available == True
+    )
+    found = []
+    for score, predicate in score_levels(product):
+        rows = candidates.filter(predicate).order_by(Product.id).limit(limit - len(found)).all()
+        found += [(match, score) for match in rows]
+        if len(found) >= limit:
+            break
+    Product.preload_main_images([match for match, _ in found])
+    return found
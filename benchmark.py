@@ -0,0 +1,1218 @@
+#!/usr/bin/env python3
+"""
+Benchmark script for BarterHub hot paths
+Runs against a throwaway SQLite database so it needs no running PostgreSQL.
+
+Usage:
+    python benchmark.py inbox
+    python benchmark.py listings          # exit 1 when a listing has N+1 queries
+    python benchmark.py avatar --sizes 512 16   # JPEG target in KB
+    python benchmark.py search --sizes 100000
+    python benchmark.py pagination
+    python benchmark.py uploads --sizes 10   # images per request
+    python benchmark.py catalog --sizes 1000000
+"""
+
+import argparse
+import os
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from flask import Flask, current_app
+from sqlalchemy import event, and_, or_
+from models import db, User, Category, Product, ChatRoom, ChatMessage
+
+
+def create_benchmark_app(database_url='sqlite://'):
+    """App bound to a scratch database (blueprints registered, no init_db)"""
+    from flask_login import LoginManager
+    from flask_wtf.csrf import CSRFProtect
+    from realtime import init_realtime
+    from images import init_images
+    from resize import img
+    from cache import init_cache
+    from similar import init_similar
+    from routes import main, auth, products, chat, transactions, admin
+
+    app = Flask(__name__)
+    app.secret_key = 'benchmark'
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['UPLOAD_FOLDER'] = 'static/uploads'
+    app.config['WTF_CSRF_ENABLED'] = False
+    db.init_app(app)
+
+    login_manager = LoginManager(app)
+
+    @login_manager.user_loader
+    def load_user(user_id):
+        return db.session.get(User, int(user_id))
+
+    CSRFProtect(app)
+    init_realtime(app)
+    init_images(app)
+    init_cache(app)
+    init_similar(app, refresher=DeferredSimilarRefresher())
+    app.register_blueprint(main)
+    app.register_blueprint(auth, url_prefix='/auth')
+    app.register_blueprint(products, url_prefix='/products')
+    app.register_blueprint(chat, url_prefix='/chat')
+    app.register_blueprint(transactions, url_prefix='/transactions')
+    app.register_blueprint(admin, url_prefix='/admin')
+    app.register_blueprint(img)
+    return app
+
+
+class DeferredSimilarRefresher:
+    """Collects similar.py refresh jobs so a benchmark runs and times them itself
+
+    The default thread pool would share the in-memory SQLite connection.
+    """
+
+    def __init__(self):
+        self.pending = set()
+
+    def submit(self, product_ids):
+        self.pending |= set(product_ids)
+
+    def run(self):
+        from similar import refresh
+
+        product_ids, self.pending = self.pending, set()
+        count = refresh(product_ids) if product_ids else 0
+        db.session.commit()
+        return count
+
+
+@contextmanager
+def count_queries():
+    """Count SQL statements executed on the engine inside the block"""
+    counter = {'count': 0}
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        counter['count'] += 1
+
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def timed(fn, repeat=5):
+    """Return (best wall time in ms, last result) over several runs"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def report(label, rows, count_label='queries'):
+    width = max([18] + [len(variant) for _, variant, _, _ in rows])
+    print(f"\n{label}")
+    print(f"{'size':>10} | {'variant':<{width}} | {count_label:>8} | {'best ms':>10}")
+    print('-' * (38 + width))
+    for size, variant, queries, ms in rows:
+        print(f"{size:>10} | {variant:<{width}} | {str(queries):>8} | {ms:>10.2f}")
+
+
+# ---------------------------------------------------------------------------
+# Inbox (/chat/rooms)
+# ---------------------------------------------------------------------------
+
+def seed_inbox(room_count, messages_per_room=5):
+    """One user chatting with room_count partners about room_count products"""
+    db.drop_all()
+    db.create_all()
+
+    category = Category(name='Elektronik')
+    me = User(username='me', email='me@example.com', full_name='Me', password_hash='x')
+    db.session.add_all([category, me])
+    db.session.flush()
+
+    partners = [User(username=f'u{i}', email=f'u{i}@example.com', full_name=f'Partner {i}', password_hash='x')
+                for i in range(room_count)]
+    db.session.add_all(partners)
+    db.session.flush()
+
+    products = [Product(user_id=partner.id, category_id=category.id, title=f'Produk {i}',
+                        description='Deskripsi produk', condition='Good', desired_items='Apa saja')
+                for i, partner in enumerate(partners)]
+    db.session.add_all(products)
+    db.session.flush()
+
+    rooms = [ChatRoom(user1_id=me.id, user2_id=partner.id, product_id=product.id)
+             for partner, product in zip(partners, products)]
+    db.session.add_all(rooms)
+    db.session.flush()
+
+    now = datetime.utcnow()
+    db.session.add_all([
+        ChatMessage(room_id=room.id,
+                    sender_id=room.user2_id if n % 2 else room.user1_id,
+                    message=f'Pesan {n} untuk room {room.id}',
+                    is_read=n < messages_per_room - 2,
+                    created_at=now - timedelta(minutes=messages_per_room - n))
+        for room in rooms for n in range(messages_per_room)
+    ])
+    db.session.flush()
+
+    # Watermark yang setara dengan is_read di atas
+    for room in rooms:
+        read_ids = [m.id for m in room.messages if m.is_read and m.sender_id != me.id]
+        room.user1_last_read_id = max(read_ids, default=0)
+    db.session.commit()
+    return me.id
+
+
+def legacy_inbox(user_id):
+    """The previous get_rooms loop: three queries per room plus lazy loads"""
+    rooms = ChatRoom.query.filter(
+        (ChatRoom.user1_id == user_id) | (ChatRoom.user2_id == user_id)
+    ).join(Product).filter(Product.is_available == True).order_by(ChatRoom.created_at.desc()).all()
+
+    rooms_data = []
+    for room in rooms:
+        other = room.user2 if room.user1_id == user_id else room.user1
+        unread_count = ChatMessage.query.filter(and_(
+            ChatMessage.room_id == room.id, ChatMessage.sender_id != user_id, ChatMessage.is_read == False
+        )).count()
+        recent = ChatMessage.query.filter(and_(
+            ChatMessage.room_id == room.id, ChatMessage.sender_id != user_id,
+            ChatMessage.created_at >= datetime.utcnow() - timedelta(minutes=5)
+        )).count()
+        last_message = ChatMessage.query.filter_by(room_id=room.id).order_by(ChatMessage.created_at.desc()).first()
+        rooms_data.append((room.id, room.product.title, other.full_name, unread_count, recent,
+                           last_message.message if last_message else None))
+    return rooms_data
+
+
+def bench_inbox(sizes):
+    from inbox import get_inbox
+
+    rows = []
+    for size in sizes:
+        user_id = seed_inbox(size)
+        for variant, fn in (('legacy', lambda: legacy_inbox(user_id)),
+                            ('aggregated', lambda: get_inbox(user_id))):
+            db.session.expire_all()
+            with count_queries() as counter:
+                fn()
+            ms, _ = timed(lambda: (db.session.expire_all(), fn()))
+            rows.append((size, variant, counter['count'], ms))
+    report('Inbox /chat/rooms', rows)
+
+
+# ---------------------------------------------------------------------------
+# Product search (/products/?search=)
+# ---------------------------------------------------------------------------
+
+COMMON_WORDS = ['laptop', 'gaming', 'sepeda', 'motor', 'kamera', 'iphone', 'samsung', 'buku', 'novel',
+                'gitar', 'akustik', 'sepatu', 'lari', 'jam', 'tangan', 'meja', 'kursi', 'lemari', 'tas',
+                'ransel', 'konsol', 'playstation', 'raket', 'badminton', 'helm', 'jaket', 'kulit', 'lensa']
+SYLLABLES = ['ka', 'ri', 'mo', 'tu', 'ne', 'sa', 'lo', 'pi', 'de', 'ga', 'ru', 'bi', 'co', 'ya', 'we', 'zu']
+# Kata umum, kata jarang, awalan (mengetik) dan kata yang tidak ada (worst case ILIKE)
+SEARCH_QUERIES = ['laptop gaming', 'sepeda', 'kam', 'jaket kulit', 'karimo', 'tidakada']
+
+
+def _vocabulary(rng, size=5000):
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return COMMON_WORDS + sorted(words)
+
+
+def _zipf_words(rng, vocabulary, count):
+    # Distribusi kira-kira Zipf: kata di awal vocabulary jauh lebih sering muncul
+    return [vocabulary[min(int(rng.paretovariate(1.0)) - 1, len(vocabulary) - 1)] for _ in range(count)]
+
+
+def seed_products(product_count, batch_size=5000):
+    """Bulk insert synthetic products with Zipf-distributed words"""
+    import random
+    from sqlalchemy import insert
+
+    db.drop_all()
+    db.create_all()
+    rng = random.Random(42)
+    vocabulary = _vocabulary(rng)
+    rng.shuffle(vocabulary)
+
+    category = Category(name='Elektronik')
+    owner = User(username='seller', email='seller@example.com', full_name='Seller', password_hash='x')
+    db.session.add_all([category, owner])
+    db.session.commit()
+
+    now = datetime.utcnow()
+    for start in range(0, product_count, batch_size):
+        rows = []
+        for i in range(start, min(start + batch_size, product_count)):
+            rows.append({
+                'user_id': owner.id,
+                'category_id': category.id,
+                'title': ' '.join(_zipf_words(rng, vocabulary, 4)).title() + f' #{i}',
+                'description': 'Kondisi mulus, ' + ' '.join(_zipf_words(rng, vocabulary, 12)),
+                'desired_items': ' '.join(_zipf_words(rng, vocabulary, 3)),
+                'condition': rng.choice(['New', 'Like New', 'Good', 'Fair', 'Poor']),
+                'total_points': rng.randint(10, 100),
+                'is_available': True,
+                'created_at': now - timedelta(minutes=i),
+            })
+        db.session.execute(insert(Product), rows)
+    db.session.commit()
+
+
+def bench_search(sizes):
+    from search import apply_search, product_index
+
+    rows = []
+    for size in sizes:
+        seed_products(size)
+        base = Product.query.filter_by(is_available=True)
+
+        def ilike_search():
+            for term in SEARCH_QUERIES:
+                base.filter((Product.title.ilike(f'%{term}%')) | (Product.description.ilike(f'%{term}%'))) \
+                    .order_by(Product.created_at.desc()).limit(12).all()
+
+        def fulltext_search():
+            for term in SEARCH_QUERIES:
+                apply_search(base, term).limit(12).all()
+
+        product_index.reset()
+        start = time.perf_counter()
+        product_index.ensure_fresh()
+        rows.append((size, 'index build', 1, (time.perf_counter() - start) * 1000))
+
+        for variant, fn in (('ilike', ilike_search), ('fulltext', fulltext_search)):
+            with count_queries() as counter:
+                fn()
+            ms, _ = timed(fn, repeat=3)
+            rows.append((size, variant, counter['count'], ms / len(SEARCH_QUERIES)))
+    report(f'Product search, per query ({db.engine.dialect.name})', rows)
+
+
+# ---------------------------------------------------------------------------
+# Admin product list pagination (/admin/products)
+# ---------------------------------------------------------------------------
+
+def bench_pagination(sizes, per_page=20):
+    from pagination import keyset_paginate, encode_cursor
+
+    rows = []
+    for size in sizes:
+        seed_products(size)
+        last_page = max(size // per_page, 1)
+        # Baris terakhir halaman sebelumnya = cursor untuk halaman terdalam
+        boundary = Product.query.order_by(Product.created_at.desc(), Product.id.desc()) \
+            .offset((last_page - 1) * per_page - 1).first() if last_page > 1 else None
+        after = encode_cursor(boundary.created_at, boundary.id) if boundary else None
+
+        for page_label, page, cursor in (('page 1', 1, None), (f'page {last_page}', last_page, after)):
+            variants = (
+                ('offset', lambda: Product.query.order_by(Product.created_at.desc())
+                 .paginate(page=page, per_page=per_page, error_out=False).items),
+                ('keyset', lambda: keyset_paginate(Product.query, Product, per_page, after=cursor,
+                                                   count='approximate').items),
+            )
+            for variant, fn in variants:
+                with count_queries() as counter:
+                    fn()
+                ms, _ = timed(fn)
+                rows.append((size, f'{variant} {page_label}', counter['count'], ms))
+    report(f'Admin product pagination ({db.engine.dialect.name})', rows)
+
+
+# ---------------------------------------------------------------------------
+# Listing pages: SQL statements per request
+# ---------------------------------------------------------------------------
+
+def seed_listings(row_count):
+    """row_count sellers, each with one product sold to and wishlisted by the admin"""
+    from models import Transaction, Wishlist
+    from routes import init_db
+
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    init_db()
+    admin_user = User.query.filter_by(role='admin').first()
+    categories = Category.query.all()
+
+    sellers = [User(username=f'seller{i}', email=f'seller{i}@example.com', full_name=f'Seller {i}',
+                    password_hash='x', role='penjual') for i in range(row_count)]
+    db.session.add_all(sellers)
+    db.session.flush()
+
+    # Semua produk satu kategori supaya halaman detail punya produk serupa
+    products = [Product(user_id=seller.id, category_id=categories[0].id, title=f'Produk {i}',
+                        description='Deskripsi produk', condition='Good', desired_items='Apa saja',
+                        total_points=50 + i % 10)
+                for i, seller in enumerate(sellers)]
+    db.session.add_all(products)
+    db.session.flush()
+
+    db.session.add_all([Transaction(seller_id=product.user_id, buyer_id=admin_user.id, product_id=product.id)
+                        for product in products])
+    db.session.add_all([Wishlist(user_id=admin_user.id, product_id=product.id) for product in products])
+    db.session.commit()
+    return admin_user.id, products[0].id
+
+
+def listing_urls(product_id):
+    return [
+        '/',
+        '/profile',
+        '/products/',
+        '/products/?search=produk',
+        f'/products/{product_id}',
+        f'/products/related/{product_id}',
+        '/transactions/',
+        '/wishlist',
+        '/admin/products',
+        '/admin/transactions',
+        '/admin/users',
+    ]
+
+
+def bench_listings(sizes):
+    """Statement count per listing must not grow with the number of rows
+
+    Every listing is rendered at each dataset size (logged in as admin,
+    who sees every listing non-empty). A count that grows with the size
+    means a relation is lazy loaded per row. Returns the failing URLs.
+    """
+    import contextvars
+    from flask import current_app
+    from cache import get_cache, FRAGMENTS_GENERATION_KEY
+
+    counts = {}
+    rows = []
+    client = current_app.test_client()
+
+    def get(url):
+        # Fragment cache dibuang supaya yang diukur tetap query render-nya
+        get_cache().delete(FRAGMENTS_GENERATION_KEY)
+        # Context kosong: request mendapat app context (g, db.session) sendiri
+        # seperti di server, bukan memakai app context benchmark ini
+        return contextvars.Context().run(client.get, url)
+    for size in sizes:
+        user_id, product_id = seed_listings(size)
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+
+        for url in listing_urls(product_id):
+            path = url.replace(f'/{product_id}', '/<id>')
+            get(url)  # warm-up: sekali per proses (mis. build index pencarian)
+            with count_queries() as counter:
+                response = get(url)
+            if response.status_code != 200:
+                raise RuntimeError(f"{url} returned {response.status_code}")
+            ms, _ = timed(lambda: get(url), repeat=3)
+            counts.setdefault(path, []).append(counter['count'])
+            rows.append((size, path, counter['count'], ms))
+
+    report('Listing pages, SQL statements per request', rows)
+    failures = [path for path, per_size in counts.items() if max(per_size) > min(per_size)]
+    for path in failures:
+        print(f"FAIL  {path}: statements grow with rows {counts[path]}")
+    return failures
+
+
+# ---------------------------------------------------------------------------
+# Profile picture encoding (save_profile_picture)
+# ---------------------------------------------------------------------------
+
+@contextmanager
+def count_encodes():
+    """Count JPEG encodes (Image.save calls) inside the block"""
+    from PIL import Image
+
+    counter = {'count': 0}
+    original_save = Image.Image.save
+
+    def save(self, fp, format=None, **params):
+        counter['count'] += 1
+        return original_save(self, fp, format, **params)
+
+    Image.Image.save = save
+    try:
+        yield counter
+    finally:
+        Image.Image.save = original_save
+
+
+def phone_photo(seed, size=(4032, 3024)):
+    """Synthetic 12MP phone photo (~3MB JPEG): gradients plus upscaled texture"""
+    import io
+    from PIL import Image
+
+    gradient = Image.linear_gradient('L').resize(size)
+    # Tekstur kasar yang di-upscale: detail seperti foto asli, bukan noise per piksel
+    texture = Image.effect_noise((size[0] // 3, size[1] // 3), 60 + seed * 10).resize(size, Image.Resampling.BICUBIC)
+    image = Image.merge('RGB', (gradient, texture, gradient.transpose(Image.Transpose.ROTATE_180)))
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def legacy_profile_picture(data, file_path, max_size):
+    """The previous save_profile_picture loop: re-encode to disk, step quality by 5"""
+    import io
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(data))
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGB')
+    image.thumbnail((400, 400), Image.Resampling.LANCZOS)
+
+    quality = 85
+    image.save(file_path, 'JPEG', quality=quality, optimize=True)
+    file_size = os.path.getsize(file_path)
+    while file_size > max_size and quality > 20:
+        quality -= 5
+        image.save(file_path, 'JPEG', quality=quality, optimize=True)
+        file_size = os.path.getsize(file_path)
+
+
+def bench_avatar(sizes):
+    """sizes are JPEG size targets in KB (the app uses 512)"""
+    import io
+    import tempfile
+    import utils
+
+    photos = [phone_photo(seed) for seed in range(3)]
+    file_path = os.path.join(tempfile.mkdtemp(), 'avatar.jpg')
+
+    def bisect_encode(max_size, clear_cache):
+        for data in photos:
+            if clear_cache:
+                utils._jpeg_quality_cache.clear()
+            with open(file_path, 'wb') as f:
+                f.write(utils.encode_profile_picture(io.BytesIO(data), max_size))
+
+    rows = []
+    for target_kb in sizes:
+        max_size = target_kb * 1024
+        variants = (
+            ('legacy loop', lambda: [legacy_profile_picture(data, file_path, max_size) for data in photos]),
+            ('bisect', lambda: bisect_encode(max_size, clear_cache=True)),
+            ('bisect cached', lambda: bisect_encode(max_size, clear_cache=False)),
+        )
+        for variant, fn in variants:
+            fn()  # warm-up (dan isi cache untuk 'bisect cached')
+            with count_encodes() as counter:
+                fn()
+            ms, _ = timed(fn, repeat=3)
+            rows.append((f"{target_kb}KB", variant, round(counter["count"] / len(photos), 1), ms / len(photos)))
+    report('Profile picture from 12MP phone photo, per photo', rows, count_label='encodes')
+
+
+def bench_fragments(sizes):
+    """Anonymous home page and product list with and without the fragment cache"""
+    import contextvars
+    from flask import current_app
+    from cache import get_cache, FRAGMENTS_GENERATION_KEY
+
+    client = current_app.test_client()
+    rows = []
+    for size in sizes:
+        _, product_id = seed_listings(size)
+        category_id = db.session.get(Product, product_id).category_id
+        for url in ('/', '/products/', f'/products/?category={category_id}'):
+            for variant in ('miss', 'hit'):
+                def get():
+                    if variant == 'miss':
+                        get_cache().delete(FRAGMENTS_GENERATION_KEY)
+                    return contextvars.Context().run(client.get, url)
+                get()
+                with count_queries() as counter:
+                    response = get()
+                if response.status_code != 200:
+                    raise RuntimeError(f"{url} returned {response.status_code}")
+                ms, _ = timed(get)
+                rows.append((size, f"{url} {variant}", counter['count'], ms))
+    report('Anonymous pages, SQL statements per request', rows)
+
+
+# ---------------------------------------------------------------------------
+# Similar products (products.detail, /products/related)
+# ---------------------------------------------------------------------------
+
+def legacy_similar(product):
+    """The previous per-view queries: detail (same category) and related (CASE over three predicates)"""
+    detail = Product.query.filter(
+        Product.category_id == product.category_id, Product.id != product.id, Product.is_available == True
+    ).order_by(
+        db.func.abs(Product.total_points - product.total_points).asc(), Product.created_at.desc()
+    ).limit(8).all()
+    related = Product.query.filter(
+        Product.id != product.id, Product.is_available == True,
+        or_(Product.category_id == product.category_id,
+            Product.total_points.between(product.total_points - 20, product.total_points + 20),
+            Product.condition == product.condition)
+    ).order_by(
+        db.case((Product.category_id == product.category_id, 1), (Product.condition == product.condition, 2), else_=3),
+        db.func.abs(Product.total_points - product.total_points).asc(),
+        Product.created_at.desc()
+    ).limit(12).all()
+    Product.preload_main_images(detail + related)
+    return detail, related
+
+
+def bench_similar(sizes, sample=20):
+    import random
+    from similar import get_similar_products, refresh, DETAIL_LIMIT
+
+    rows = []
+    for size in sizes:
+        seed_products(size)
+        rng = random.Random(size)
+        product_ids = rng.sample(range(1, size + 1), sample)
+        # seed_products memakai bulk insert (tanpa event ORM), jadi daftar sampel dibuat manual
+        refresh(product_ids)
+        db.session.commit()
+        products = Product.query.filter(Product.id.in_(product_ids)).all()
+
+        def precomputed():
+            for product in products:
+                get_similar_products(product, limit=DETAIL_LIMIT, same_category=True)
+                get_similar_products(product)
+
+        def legacy():
+            for product in products:
+                legacy_similar(product)
+
+        for variant, fn in (('legacy', legacy), ('precomputed', precomputed)):
+            with count_queries() as counter:
+                fn()
+            ms, _ = timed(fn, repeat=3)
+            rows.append((size, f"{variant} detail+related", counter['count'] // sample, ms / sample))
+
+        refresher = current_app.extensions['similar']
+        refresher.run()
+
+        def edit():
+            product = products[rng.randrange(sample)]
+            product.total_points = rng.randint(10, 100)
+            db.session.commit()
+
+        def add():
+            # Produk baru adalah yang terbaru di level poinnya: masuk daftar semua produk selevel
+            db.session.add(Product(user_id=products[0].user_id, category_id=products[0].category_id,
+                                   title='Produk baru', description='Deskripsi', desired_items='Apa saja',
+                                   condition='Good', total_points=rng.randint(10, 100)))
+            db.session.commit()
+
+        # Commit di request, lalu job refresh yang jalan di background setelahnya
+        for label, fn in (('product edit', edit), ('new product', add)):
+            commit_ms = refresh_ms = 0.0
+            commit_queries = refresh_queries = 0
+            for _ in range(3):
+                with count_queries() as counter:
+                    commit_ms += timed(fn, repeat=1)[0]
+                commit_queries = counter['count']
+                with count_queries() as counter:
+                    refresh_ms += timed(refresher.run, repeat=1)[0]
+                refresh_queries = counter['count']
+            rows.append((size, f'{label}: commit', commit_queries, commit_ms / 3))
+            rows.append((size, f'{label}: background refresh', refresh_queries, refresh_ms / 3))
+    report('Similar products, per product', rows)
+
+
+# ---------------------------------------------------------------------------
+# Nearest-points lookups (nearest.py)
+# ---------------------------------------------------------------------------
+
+def seed_points(product_count, category_count=8, batch_size=20000):
+    """Bulk insert minimal products spread over category_count categories"""
+    import random
+    from sqlalchemy import insert
+
+    db.drop_all()
+    db.create_all()
+    rng = random.Random(7)
+    categories = [Category(name=f'Kategori {i}') for i in range(category_count)]
+    owner = User(username='seller', email='seller@example.com', full_name='Seller', password_hash='x')
+    db.session.add_all(categories + [owner])
+    db.session.commit()
+
+    now = datetime.utcnow()
+    conditions = ['New', 'Like New', 'Good', 'Fair', 'Poor']
+    for start in range(0, product_count, batch_size):
+        db.session.execute(insert(Product), [{
+            'user_id': owner.id,
+            'category_id': categories[rng.randrange(category_count)].id,
+            'title': f'Produk {i}',
+            'description': 'Deskripsi',
+            'desired_items': 'Apa saja',
+            'condition': rng.choice(conditions),
+            'total_points': rng.randint(10, 100),
+            'is_available': rng.random() < 0.9,
+            'created_at': now - timedelta(seconds=i),
+        } for i in range(start, min(start + batch_size, product_count))])
+    db.session.commit()
+
+
+def bench_nearest(sizes, sample=20, limit=12):
+    """Nearest-points lookup vs sorting the category by abs()"""
+    import random
+    from sqlalchemy import func
+    from nearest import nearest
+
+    rows = []
+    for size in sizes:
+        seed_points(size)
+        rng = random.Random(size)
+        targets = Product.query.filter(Product.id.in_(rng.sample(range(1, size + 1), sample))).all()
+
+        def candidates(target):
+            return db.session.query(Product.id, Product.total_points, Product.created_at).filter(
+                Product.category_id == target.category_id, Product.is_available == True, Product.id != target.id
+            )
+
+        def abs_sort():
+            return [[row.id for row in candidates(target).order_by(
+                func.abs(Product.total_points - target.total_points), Product.created_at.desc()
+            ).limit(limit)] for target in targets]
+
+        def outward():
+            return [[row.id for row in nearest(candidates(target), target.total_points, limit)]
+                    for target in targets]
+
+        if outward() != abs_sort():
+            raise RuntimeError("abs() sort and nearest() disagree")
+        for label, fn in (('abs() sort', abs_sort), ('nearest', outward)):
+            with count_queries() as counter:
+                fn()
+            ms, _ = timed(fn, repeat=3)
+            rows.append((size, label, counter['count'] // sample, ms / sample))
+    report(f'Nearest-points lookups, per target ({db.engine.dialect.name})', rows)
+
+
+# ---------------------------------------------------------------------------
+# Barter suggestions (/products/suggest_barter)
+# ---------------------------------------------------------------------------
+
+def legacy_suggest(target, user_id):
+    """The previous suggest_barter loop: every product loaded and scored in Python"""
+    user_products = Product.preload_main_images(
+        Product.query.filter_by(user_id=user_id, is_available=True).all())
+    suggested = []
+    for product in user_products:
+        score = 50 if product.category_id == target.category_id else 0
+        point_diff = abs(product.total_points - target.total_points)
+        score += 30 if point_diff <= 10 else 20 if point_diff <= 20 else 10 if point_diff <= 30 else 0
+        score += 20 if product.condition == target.condition else 0
+        suggested.append((score, product.id, product.category.name, product.get_main_image()))
+    suggested.sort(key=lambda row: row[0], reverse=True)
+    return suggested[:6]
+
+
+def bench_suggest(sizes, sample=10):
+    """sizes are listings of one heavy seller, who is also the whole catalog for reverse mode"""
+    import random
+    from barter import suggest_offers, suggest_matches
+
+    rows = []
+    for size in sizes:
+        seed_points(size)
+        seller_id = User.query.filter_by(username='seller').first().id
+        buyer = User(username='buyer', email='buyer@example.com', full_name='Buyer', password_hash='x')
+        db.session.add(buyer)
+        db.session.flush()
+        rng = random.Random(size)
+        for target in Product.query.filter(Product.id.in_(rng.sample(range(1, size + 1), sample))):
+            target.user_id = buyer.id
+        db.session.commit()
+        targets = Product.query.filter_by(user_id=buyer.id).all()
+
+        def legacy():
+            for target in targets:
+                db.session.expire_all()
+                legacy_suggest(target, seller_id)
+
+        def offers():
+            for target in targets:
+                db.session.expire_all()
+                suggest_offers(target, seller_id)
+
+        def matches():
+            for target in targets:
+                db.session.expire_all()
+                suggest_matches(target)
+
+        for variant, fn in (('legacy loop', legacy), ('set-based', offers), ('reverse mode', matches)):
+            with count_queries() as counter:
+                fn()
+            ms, _ = timed(fn, repeat=3)
+            rows.append((size, variant, counter['count'] // sample, ms / sample))
+    report(f'Barter suggestions, per target ({db.engine.dialect.name})', rows)
+
+
+# ---------------------------------------------------------------------------
+# Multi-party barter cycles
+# ---------------------------------------------------------------------------
+
+def seed_barter_graph(user_count, products_per_user=2, batch_size=20000):
+    """Users with products, desired_items naming words of other listings and a few wishlists"""
+    import random
+    from sqlalchemy import insert
+    from models import Wishlist
+
+    db.drop_all()
+    db.create_all()
+    rng = random.Random(22)
+    product_count = user_count * products_per_user
+    # Setiap kata muncul di ~10 judul, jadi satu frasa cocok dengan ~10 produk
+    vocabulary = _vocabulary(rng, size=max(2000, product_count * 3 // 10))
+    category = Category(name='Elektronik')
+    db.session.add(category)
+    db.session.commit()
+
+    for start in range(0, user_count, batch_size):
+        db.session.execute(insert(User), [{
+            'username': f'user{i}', 'email': f'user{i}@example.com', 'full_name': f'User {i}', 'password_hash': 'x'
+        } for i in range(start, min(start + batch_size, user_count))])
+    user_ids = [user_id for (user_id,) in db.session.query(User.id).order_by(User.id)]
+
+    titles = [rng.sample(vocabulary, 3) for _ in range(product_count)]
+    now = datetime.utcnow()
+    for start in range(0, product_count, batch_size):
+        db.session.execute(insert(Product), [{
+            'user_id': user_ids[i // products_per_user],
+            'category_id': category.id,
+            'title': ' '.join(titles[i]).title(),
+            'description': 'Deskripsi',
+            # Mis. "Raku, atau Tomi": kata dari judul barang lain
+            'desired_items': ', atau '.join(rng.choice(rng.choice(titles)).title() for _ in range(rng.randint(1, 2))),
+            'condition': 'Good',
+            'total_points': rng.randint(10, 100),
+            'is_available': True,
+            'created_at': now - timedelta(seconds=i),
+        } for i in range(start, min(start + batch_size, product_count))])
+
+    wishlists = {(rng.choice(user_ids), rng.randint(1, product_count)) for _ in range(user_count)}
+    db.session.execute(insert(Wishlist), [{'user_id': user_id, 'product_id': product_id}
+                                          for user_id, product_id in wishlists])
+    db.session.commit()
+    return user_ids
+
+
+def legacy_wanted_by(product):
+    """Rescan every available product's desired_items for phrases matching `product`"""
+    from desires import desire_phrases, listing_tokens
+
+    tokens = set(listing_tokens(product.title, product.category.name))
+    return [product_id for product_id, desired_items in db.session.query(Product.id, Product.desired_items).filter(
+        Product.is_available == True, Product.user_id != product.user_id
+    ) if any(tokens.issuperset(phrase) for phrase in desire_phrases(desired_items))]
+
+
+def bench_desires(sizes, sample=20):
+    """sizes are user counts; "who wants this" for a new product: rescan vs incremental index"""
+    import random
+    from desires import desire_index
+
+    rows = []
+    for size in sizes:
+        user_ids = seed_barter_graph(size)
+        rng = random.Random(size)
+        desire_index.reset()
+        with count_queries() as counter:
+            start = time.perf_counter()
+            index = desire_index.ensure_fresh()
+            ms = (time.perf_counter() - start) * 1000
+        rows.append((size, f'index build ({len(index.phrases)} phrases)', counter['count'], ms))
+
+        templates = Product.query.filter(Product.id.in_(rng.sample(range(1, len(index.listings) + 1), sample))).all()
+        new_products = []
+        for template in templates:
+            product = Product(user_id=rng.choice(user_ids), category_id=template.category_id, title=template.title,
+                              description='Deskripsi', desired_items='Apa saja', condition='Good',
+                              total_points=template.total_points, is_available=True)
+            db.session.add(product)
+            new_products.append(product)
+        db.session.commit()
+
+        def incremental():
+            # Setiap produk baru di-commit sendiri-sendiri: index diperbarui per produk
+            for product in new_products:
+                desire_index.mark_dirty('product', product.id)
+                desire_index.wanted_by(product.id)
+
+        for variant, fn in (('rescan desired_items', lambda: [legacy_wanted_by(p) for p in new_products]),
+                            ('incremental index', incremental)):
+            with count_queries() as counter:
+                fn()
+            ms, _ = timed(fn, repeat=3)
+            rows.append((size, variant, counter['count'] // sample, ms / sample))
+
+        mismatches = sum(sorted(legacy_wanted_by(product)) != sorted(index.wanted_by(product.id))
+                         for product in new_products)
+        if mismatches:
+            print(f"{mismatches} products differ from the rescan (generic phrases are skipped by the index)")
+    report(f'People who want a new product, per product ({db.engine.dialect.name})', rows)
+
+
+def bench_cycles(sizes, sample=20):
+    """sizes are user counts; full graph build vs incremental update per new product"""
+    import random
+    from cycles import cycle_index
+
+    rows = []
+    for size in sizes:
+        user_ids = seed_barter_graph(size)
+        rng = random.Random(size)
+        cycle_index.reset()
+        with count_queries() as counter:
+            start = time.perf_counter()
+            graph = cycle_index.ensure_fresh(wait=True)
+            ms = (time.perf_counter() - start) * 1000
+        rows.append((size, f'full build ({len(graph.products)} products, {len(graph.cycles)} cycles)',
+                     counter['count'], ms))
+
+        # Produk baru meniru produk acak (judul dan keinginan yang sama) milik user acak
+        templates = Product.query.filter(Product.id.in_(rng.sample(range(1, len(graph.products) + 1), sample))).all()
+        total_ms, queries = 0.0, 0
+        for template in templates:
+            db.session.add(Product(
+                user_id=rng.choice(user_ids), category_id=template.category_id, title=template.title,
+                description='Deskripsi', desired_items=template.desired_items, condition='Good',
+                total_points=template.total_points, is_available=True
+            ))
+            db.session.commit()
+            with count_queries() as counter:
+                start = time.perf_counter()
+                cycle_index.ensure_fresh(wait=True)
+                total_ms += (time.perf_counter() - start) * 1000
+            queries += counter['count']
+        rows.append((size, 'incremental add', queries // sample, total_ms / sample))
+
+        lookup_users = rng.sample(user_ids, sample)
+        ms, _ = timed(lambda: [cycle_index.cycles_for_user(user_id) for user_id in lookup_users])
+        rows.append((size, 'cycles_for_user', 0, ms / sample))
+    report(f'Barter cycles up to {graph.max_length} parties ({db.engine.dialect.name})', rows)
+
+
+# ---------------------------------------------------------------------------
+# Bulk points recalculation (scoring.py)
+# ---------------------------------------------------------------------------
+
+@contextmanager
+def without_similar_hooks():
+    """Detach similar.py's session hooks, so an ORM walk measures only its own writes"""
+    from similar import _collect_changed_products, _submit_changed_products, _discard_changed_products
+
+    hooks = (('after_flush', _collect_changed_products), ('after_commit', _submit_changed_products),
+             ('after_rollback', _discard_changed_products))
+    for name, fn in hooks:
+        event.remove(db.session, name, fn)
+    try:
+        yield
+    finally:
+        for name, fn in hooks:
+            event.listen(db.session, name, fn)
+
+
+def bench_points(sizes, batch_size=10000):
+    """Recalculating every product's points: ORM walk vs set-based UPDATE per id range"""
+    from sqlalchemy import update
+    from scoring import SCORE_COLUMNS, compute_points, recalculate
+
+    rows = []
+    for size in sizes:
+        seed_points(size)
+        # Skor bervariasi per baris, versi poin dikosongkan sebelum setiap varian
+        db.session.execute(update(Product).values(**{
+            column: (Product.id * (i + 3)) % 10 + 1 for i, column in enumerate(SCORE_COLUMNS)
+        }))
+        db.session.commit()
+
+        def reset():
+            db.session.execute(update(Product).values(total_points=0, points_version=None))
+            db.session.commit()
+            db.session.expire_all()
+
+        def legacy():
+            for product in Product.query.yield_per(batch_size):
+                product.calculate_points()
+            db.session.commit()
+
+        with without_similar_hooks():
+            for variant, fn in (('ORM walk', legacy),
+                                ('bulk UPDATE', lambda: recalculate(batch_size=batch_size, refresh_dependents=False))):
+                reset()
+                with count_queries() as counter:
+                    start = time.perf_counter()
+                    fn()
+                    ms = (time.perf_counter() - start) * 1000
+                rows.append((size, f"{variant} ({size / ms * 1000:.0f} rows/s)", counter['count'], ms))
+
+        db.session.expire_all()
+        mismatches = sum(product.total_points != compute_points(product) for product in Product.query.yield_per(10000))
+        if mismatches:
+            print(f"{mismatches} products differ from calculate_points()")
+    report(f'Recalculate total_points, whole catalog ({db.engine.dialect.name})', rows)
+    return mismatches
+
+
+
+# ---------------------------------------------------------------------------
+# Polling endpoints with ETag revalidation
+# ---------------------------------------------------------------------------
+
+def bench_polling(sizes):
+    """JSON endpoints polled by the floating chat: full body vs 304 revalidation"""
+    import contextvars
+    from flask import current_app
+
+    client = current_app.test_client()
+    rows = []
+    for size in sizes:
+        user_id = seed_inbox(size, messages_per_room=20)
+        room_id = db.session.query(ChatRoom.id).filter(ChatRoom.user1_id == user_id).first()[0]
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+        for url in ('/chat/rooms', '/chat/rooms/quick_check', f'/chat/room/{room_id}/messages_direct'):
+            etag = contextvars.Context().run(client.get, url).headers['ETag']
+            for variant, headers in (('full', {}), ('304', {'If-None-Match': etag})):
+                def get():
+                    return contextvars.Context().run(client.get, url, headers=headers)
+                with count_queries() as counter:
+                    response = get()
+                ms, _ = timed(get)
+                rows.append((size, f"{url} {variant} {len(response.data)}B", counter['count'], ms))
+    report('Polling endpoints, SQL statements per request', rows)
+
+
+# ---------------------------------------------------------------------------
+# Multipart upload parsing (products.add)
+# ---------------------------------------------------------------------------
+
+def bench_uploads(sizes):
+    """sizes are image counts per request (products.add accepts up to 10)"""
+    import io
+    import tempfile
+    import tracemalloc
+    from flask import Request, request
+    from werkzeug.test import EnvironBuilder
+    from images import store_upload
+    from uploads import UploadRequest
+
+    photo = phone_photo(0)
+
+    def upload_app(request_class):
+        app = Flask(__name__)
+        app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+        app.request_class = request_class
+
+        @app.route('/upload', methods=['POST'])
+        def upload():
+            try:
+                return str(len([store_upload(file) for file in request.files.getlist('images')]))
+            except Exception as e:
+                return str(e), 415
+        return app
+
+    def post(app, body, content_type):
+        environ = {'REQUEST_METHOD': 'POST', 'PATH_INFO': '/upload', 'SERVER_NAME': 'localhost',
+                   'SERVER_PORT': '80', 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(body),
+                   'CONTENT_TYPE': content_type, 'CONTENT_LENGTH': str(len(body))}
+        status = []
+        b''.join(app.wsgi_app(environ, lambda s, h, exc_info=None: status.append(s)))
+        return status[0]
+
+    def encode(files):
+        builder = EnvironBuilder(method='POST', data={'images': files})
+        environ = builder.get_environ()
+        return environ['wsgi.input'].read(), environ['CONTENT_TYPE']
+
+    rows = []
+    for count in sizes:
+        # Isi file dibuat beda supaya tidak ter-dedup oleh storage
+        body, content_type = encode([(io.BytesIO(photo + bytes([i])), f'foto{i}.jpg') for i in range(count)])
+        bogus, bogus_type = encode([(io.BytesIO(b'MZ' + bytes(len(photo) * count)), 'bukan-gambar.jpg')])
+        for variant, request_class in (('werkzeug + copy', Request), ('streaming', UploadRequest)):
+            app = upload_app(request_class)
+            for label, data, ctype in (('', body, content_type), (' non-image', bogus, bogus_type)):
+                post(app, data, ctype)
+                tracemalloc.start()
+                ms, _ = timed(lambda: post(app, data, ctype), repeat=3)
+                peak_kb = tracemalloc.get_traced_memory()[1] // 1024
+                tracemalloc.stop()
+                rows.append((f"{count}x{len(photo) // 1024}KB", variant + label, peak_kb, ms))
+    report('Multipart image upload, peak traced memory per request', rows, count_label='peak KB')
+
+
+# ---------------------------------------------------------------------------
+# Catalog import / export (catalog.py)
+# ---------------------------------------------------------------------------
+
+def catalog_records(count, owner_count=100, category_count=8):
+    """count import records in the shape partners upload"""
+    import random
+
+    rng = random.Random(11)
+    conditions = ['New', 'Like New', 'Good', 'Fair', 'Poor']
+    for i in range(count):
+        record = {
+            'owner': f'mitra{rng.randrange(owner_count)}',
+            'category': f'Kategori {rng.randrange(category_count)}',
+            'title': f'Produk mitra {i}',
+            'description': 'Deskripsi produk dari mitra',
+            'condition': rng.choice(conditions),
+            'desired_items': 'Laptop atau sepeda',
+            'images': [f'mitra_{i}_{n}.jpg' for n in range(rng.randint(0, 3))],
+        }
+        for column in ('utility_score', 'scarcity_score', 'durability_score', 'portability_score', 'seasonal_score'):
+            record[column] = rng.randint(1, 10)
+        yield record
+
+
+def bench_catalog(sizes, legacy_limit=1000, batch_size=1000):
+    """Importing a partner catalog: per-row add + commit vs batched bulk INSERT; streaming export"""
+    import json
+    import tempfile
+    import tracemalloc
+    from types import SimpleNamespace
+    from sqlalchemy.orm import joinedload
+    from models import ProductImage
+    from catalog import import_products, export_products, iter_products, after_bulk_change
+    from scoring import compute_points
+
+    class NullWriter:
+        def write(self, text):
+            return len(text)
+
+    def seed(owner_count=100, category_count=8):
+        db.drop_all()
+        db.create_all()
+        db.session.add_all([Category(name=f'Kategori {i}') for i in range(category_count)] +
+                           [User(username=f'mitra{i}', email=f'mitra{i}@example.com', full_name=f'Mitra {i}',
+                                 password_hash='x') for i in range(owner_count)])
+        db.session.commit()
+
+    def legacy_import(records):
+        # Gaya create_dummy_data.py: satu add + commit per produk dan per gambar
+        users = {user.username: user.id for user in User.query}
+        categories = {category.name: category.id for category in Category.query}
+        for record in records:
+            images = record.pop('images')
+            product = Product(user_id=users[record.pop('owner')], category_id=categories[record.pop('category')],
+                              **record)
+            product.calculate_points()
+            db.session.add(product)
+            db.session.commit()
+            for n, filename in enumerate(images):
+                db.session.add(ProductImage(product_id=product.id, filename=filename, is_main=n == 0))
+                db.session.commit()
+
+    def legacy_export(stream):
+        # Seluruh katalog dimuat dulu (owner di-join, gambar satu query), lalu ditulis
+        images = {}
+        for image in ProductImage.query.order_by(ProductImage.id).all():
+            images.setdefault(image.product_id, []).append(image.filename)
+        for product in Product.query.options(joinedload(Product.owner)).all():
+            stream.write(json.dumps({'title': product.title, 'owner': product.owner.username,
+                                     'images': images.get(product.id, [])}) + '\n')
+
+    rows = []
+    memory_rows = []
+    for size in sizes:
+        with tempfile.NamedTemporaryFile('w+', suffix='.jsonl', encoding='utf-8') as source:
+            for record in catalog_records(size):
+                source.write(json.dumps(record) + '\n')
+            source.flush()
+
+            legacy_count = min(size, legacy_limit)
+            seed()
+            start = time.perf_counter()
+            legacy_import(catalog_records(legacy_count))
+            ms = (time.perf_counter() - start) * 1000
+            rows.append((size, f"add + commit per row, first {legacy_count} ({legacy_count / ms * 1000:.0f} rows/s)",
+                         '-', ms))
+
+            seed()
+            source.seek(0)
+            with count_queries() as counter:
+                start = time.perf_counter()
+                result = import_products(source, 'jsonl', batch_size, refresh_dependents=False)
+                ms = (time.perf_counter() - start) * 1000
+            rows.append((size, f"bulk, batch {batch_size} ({result.imported / ms * 1000:.0f} rows/s)",
+                         counter['count'], ms))
+            with count_queries() as counter:
+                start = time.perf_counter()
+                after_bulk_change(list(range(1, result.imported + 1)))
+                ms = (time.perf_counter() - start) * 1000
+            rows.append((size, '+ after_bulk_change (similar products)', counter['count'], ms))
+
+        # Poin harus sama dengan calculate_points() dan gambar harus menempel ke produknya
+        mismatches = sum(record['total_points'] != compute_points(SimpleNamespace(**record)) or
+                         any(not image.startswith(f"mitra_{record['title'].rsplit(' ', 1)[1]}_")
+                             for image in record['images'])
+                         for record in iter_products())
+        if result.imported != size or mismatches:
+            print(f"imported {result.imported}/{size}, {mismatches} products differ from their records")
+
+        for variant, fn in (('Product.query.all()', legacy_export),
+                            ('streaming', lambda stream: export_products(stream, 'jsonl', batch_size))):
+            start = time.perf_counter()
+            fn(NullWriter())
+            ms = (time.perf_counter() - start) * 1000
+            db.session.expunge_all()
+            tracemalloc.start()
+            fn(NullWriter())
+            peak_kb = tracemalloc.get_traced_memory()[1] // 1024
+            tracemalloc.stop()
+            db.session.expunge_all()
+            memory_rows.append((size, f"{variant} ({size / ms * 1000:.0f} rows/s)", peak_kb, ms))
+
+    report(f'Catalog import, JSONL with images ({db.engine.dialect.name})', rows)
+    report('Catalog export, peak traced memory', memory_rows, count_label='peak KB')
+    return mismatches
+
+
+BENCHMARKS = {
+    'inbox': (bench_inbox, [10, 100, 1000]),
+    'search': (bench_search, [1000, 10000, 100000]),
+    'pagination': (bench_pagination, [1000, 100000]),
+    'listings': (bench_listings, [3, 30]),
+    'fragments': (bench_fragments, [30]),
+    'polling': (bench_polling, [10, 200]),
+    'similar': (bench_similar, [10000, 100000]),
+    'nearest': (bench_nearest, [100000, 1000000]),
+    'suggest': (bench_suggest, [100, 1000, 10000]),
+    'cycles': (bench_cycles, [10000, 100000]),
+    'desires': (bench_desires, [10000, 100000]),
+    'points': (bench_points, [10000, 100000]),
+    'avatar': (bench_avatar, [512, 16, 8]),
+    'uploads': (bench_uploads, [1, 10]),
+    'catalog': (bench_catalog, [10000, 100000]),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='BarterHub benchmarks')
+    parser.add_argument('name', choices=sorted(BENCHMARKS))
+    parser.add_argument('--sizes', type=int, nargs='+', help='Override default dataset sizes')
+    parser.add_argument('--database-url', default='sqlite://', help='Scratch database (will be dropped!)')
+    args = parser.parse_args()
+
+    fn, default_sizes = BENCHMARKS[args.name]
+    app = create_benchmark_app(args.database_url)
+    with app.app_context():
+        failures = fn(args.sizes or default_sizes)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+"""
+Read-through cache untuk data referensi (kategori) dan fragment HTML
+
+Daftar kategori dibaca di hampir setiap halaman (index, daftar produk,
+/api/categories, setiap ProductForm/QuickProductForm) padahal hampir tidak
+pernah berubah. get_categories() mengambilnya sekali dari database lalu
+menyimpannya di cache; perubahan pada Category menghapus entry-nya setelah
+transaksi commit.
+
+cached_fragment() menyimpan HTML hasil render (produk unggulan di index,
+halaman pertama daftar produk per filter) selama FRAGMENT_TTL detik. Semua
+fragment dibuang sekaligus saat Product, ProductImage atau Category berubah:
+key-nya memuat "generation" yang diganti setiap ada perubahan.
+
+Seperti realtime.py, backend bersifat pluggable:
+- LocalCache (default): dict di memori proses dengan TTL;
+- SQLiteCache: file SQLite yang dipakai bersama semua worker di satu mesin
+  (pengganti Redis lokal), aktif bila CACHE_SQLITE_PATH di-set.
+Deployment lain bisa memberikan backend sendiri lewat
+init_cache(app, backend=...) selama mengikuti interface Cache. Nilai yang
+disimpan harus bisa di-serialize ke JSON.
+
+Dengan LocalCache dan beberapa worker, invalidasi hanya terjadi di worker
+yang menulis; worker lain memakai data lama paling lama CATEGORY_TTL
+(kategori) atau FRAGMENT_TTL (fragment) detik.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+from flask import current_app, has_app_context
+from markupsafe import Markup
+from sqlalchemy import event
+from models import db, Category, Product, ProductImage
+
+logger = logging.getLogger(__name__)
+
+CATEGORY_TTL = 300
+CATEGORIES_KEY = 'reference:categories'
+FRAGMENT_TTL = 60
+FRAGMENTS_GENERATION_KEY = 'fragments:generation'
+LOCAL_CACHE_MAX_ENTRIES = 4096
+SQLITE_PRUNE_EVERY = 500
+
+
+class Cache:
+    """Interface for cache backends"""
+
+    def get(self, key):
+        """Cached value, or None when missing or expired"""
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, *keys):
+        raise NotImplementedError
+
+    def get_or_set(self, key, factory, ttl=None):
+        value = self.get(key)
+        if value is None:
+            value = factory()
+            self.set(key, value, ttl)
+        return value
+
+
+class LocalCache(Cache):
+    """Per-process dict with optional per-entry TTL
+
+    Holds at most max_entries; the least recently used entry goes first.
+    """
+
+    def __init__(self, max_entries=LOCAL_CACHE_MAX_ENTRIES):
+        self.entries = OrderedDict()
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self.lock:
+            self.entries[key] = (value, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class SQLiteCache(Cache):
+    """Cache table in a SQLite file shared by the workers on one host"""
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.writes = 0
+        with self._connection() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS cache '
+                         '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)')
+
+    def _connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self.local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connection().execute(
+            'SELECT value FROM cache WHERE key = ? AND (expires_at IS NULL OR expires_at >= ?)',
+            (key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value, ttl=None):
+        conn = self._connection()
+        conn.execute(
+            'INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)',
+            (key, json.dumps(value), time.time() + ttl if ttl else None)
+        )
+        self.writes += 1
+        if self.writes % SQLITE_PRUNE_EVERY == 0:
+            conn.execute('DELETE FROM cache WHERE expires_at < ?', (time.time(),))
+
+    def delete(self, *keys):
+        if keys:
+            self._connection().execute(
+                f"DELETE FROM cache WHERE key IN ({', '.join('?' * len(keys))})", keys
+            )
+
+
+def init_cache(app, backend=None):
+    """Attach a cache backend and drop cached reference data after writes"""
+    if backend is None:
+        path = app.config.get('CACHE_SQLITE_PATH') or os.environ.get('CACHE_SQLITE_PATH')
+        backend = SQLiteCache(path) if path else LocalCache()
+    app.extensions['cache'] = backend
+
+    if not event.contains(db.session, 'after_flush', _collect_invalidations):
+        event.listen(db.session, 'after_flush', _collect_invalidations)
+        event.listen(db.session, 'after_commit', _apply_invalidations)
+        event.listen(db.session, 'after_rollback', _discard_invalidations)
+
+
+_fallback_cache = LocalCache()
+
+
+def get_cache():
+    """The app's cache backend (a process-wide LocalCache outside an app)"""
+    if has_app_context():
+        return current_app.extensions.get('cache', _fallback_cache)
+    return _fallback_cache
+
+
+# ---------------------------------------------------------------------------
+# Invalidation
+# ---------------------------------------------------------------------------
+
+# Model -> cache keys yang harus dihapus saat ada baris model itu yang berubah
+INVALIDATES = {
+    Category: (CATEGORIES_KEY, FRAGMENTS_GENERATION_KEY),
+    Product: (FRAGMENTS_GENERATION_KEY,),
+    ProductImage: (FRAGMENTS_GENERATION_KEY,),
+}
+
+
+def _collect_invalidations(session, flush_context):
+    keys = session.info.setdefault('cache_invalidate', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        keys.update(INVALIDATES.get(type(obj), ()))
+
+
+def _apply_invalidations(session):
+    keys = session.info.pop('cache_invalidate', None)
+    if keys:
+        try:
+            get_cache().delete(*keys)
+        except Exception as e:
+            logger.error(f"Could not invalidate cache keys {sorted(keys)}: {e}")
+
+
+def _discard_invalidations(session):
+    session.info.pop('cache_invalidate', None)
+
+
+# ---------------------------------------------------------------------------
+# Reference data
+# ---------------------------------------------------------------------------
+
+# Snapshot read-only untuk template dan form (bukan instance ORM yang terikat session)
+CategoryInfo = namedtuple('CategoryInfo', ['id', 'name', 'description'])
+
+
+def _load_categories():
+    return [[c.id, c.name, c.description]
+            for c in db.session.query(Category.id, Category.name, Category.description).order_by(Category.id)]
+
+
+def get_categories():
+    """All categories as CategoryInfo tuples, ordered by id"""
+    rows = get_cache().get_or_set(CATEGORIES_KEY, _load_categories, ttl=CATEGORY_TTL)
+    return [CategoryInfo(*row) for row in rows]
+
+
+def category_choices():
+    """(id, name) pairs for SelectField choices"""
+    return [(category.id, category.name) for category in get_categories()]
+
+
+# ---------------------------------------------------------------------------
+# HTML fragments
+# ---------------------------------------------------------------------------
+
+def cached_fragment(name, render, params=(), ttl=FRAGMENT_TTL):
+    """HTML of fragment `name` for `params`, rendering it with render() on a miss
+
+    params must hold everything the HTML depends on besides products,
+    product images and categories (filters, whether the viewer is logged
+    in, ...). Callers should only pass a bounded set of values.
+    """
+    cache = get_cache()
+    generation = cache.get_or_set(FRAGMENTS_GENERATION_KEY, lambda: uuid.uuid4().hex[:12])
+    key = ':'.join(['fragment', generation, name] + [str(param) for param in params])
+    return Markup(cache.get_or_set(key, render, ttl=ttl))
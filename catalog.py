@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""
+Import / export katalog produk secara streaming (CSV atau JSONL)
+
+Satu record = satu produk beserta gambarnya:
+    owner, category, title, description, condition, desired_items,
+    utility_score, scarcity_score, durability_score, portability_score,
+    seasonal_score, is_available, images
+owner adalah username, category nama kategori. images adalah daftar nama
+file yang sudah ada di folder upload produk (CSV: dipisah "|", JSONL: list);
+gambar pertama menjadi gambar utama. total_points selalu dihitung ulang
+dengan scoring.py, nilai di file diabaikan.
+
+Import membaca file per batch (batch_size record): record divalidasi,
+owner / kategori diresolve dengan satu query per batch untuk nama yang
+belum dikenal, poin dihitung, lalu produk dan gambarnya ditulis dengan
+bulk INSERT dan satu commit per batch. Record yang tidak valid dilewati
+dan dilaporkan per nomor baris; batch lain tetap masuk. Gambar masuk
+dengan status 'ready' tanpa varian; buat variannya dengan
+`python images.py --backfill`.
+
+Export membaca produk dengan server-side cursor (stream_results, yield_per)
+dan gambar per batch, jadi katalog sebesar apa pun tidak pernah dimuat
+sekaligus ke memori.
+
+Bulk INSERT / UPDATE tidak melewati event ORM. Setiap batch mencatat id
+produknya di index_changes (changes.record) dalam transaksi yang sama,
+jadi index di memori setiap worker web ikut diperbarui tanpa restart.
+after_bulk_change() melakukan sisa pekerjaan hook-hook itu
+(similar_products, cache fragment) dan juga dipakai scoring.py. Cache
+fragment hanya ikut dibuang di worker bila backend cache-nya dipakai
+bersama (CACHE_SQLITE_PATH); dengan LocalCache worker menampilkan fragment
+lama paling lama FRAGMENT_TTL detik. Untuk import besar, rebuild
+similar_products jauh lebih lama dari import-nya sendiri; pakai --no-refresh
+lalu jalankan `python similar.py` di luar jam sibuk.
+
+    python catalog.py import produk.csv --batch-size 5000
+    python catalog.py import mitra.jsonl --no-refresh
+    python catalog.py export katalog.jsonl
+    python catalog.py export - --format csv > katalog.csv
+"""
+
+import csv
+import io
+import json
+import logging
+import os
+import sys
+import time
+from collections import namedtuple
+from types import SimpleNamespace
+from sqlalchemy import insert, select
+import changes
+from models import db, User, Category, Product, ProductImage
+from scoring import SCORE_COLUMNS, compute_points, get_rules
+from utils import allowed_file
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+MAX_IMAGES = 10
+MAX_REPORTED_ERRORS = 100
+# Di atas jumlah ini semua daftar similar_products dihitung ulang (per batch), bukan per produk
+BULK_REFRESH_LIMIT = 1000
+
+FIELDS = ('owner', 'category', 'title', 'description', 'condition', 'desired_items') + SCORE_COLUMNS + (
+    'is_available', 'total_points', 'images')
+CONDITIONS = ('New', 'Like New', 'Good', 'Fair', 'Poor')
+IMAGE_SEPARATOR = '|'
+
+ImportReport = namedtuple('ImportReport', ['read', 'imported', 'rejected', 'images', 'seconds', 'errors'])
+
+
+class RecordError(ValueError):
+    """A record that cannot be imported"""
+
+
+def detect_format(path, fmt=None):
+    if fmt:
+        return fmt
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+
+# ---------------------------------------------------------------------------
+# Import
+# ---------------------------------------------------------------------------
+
+def read_records(stream, fmt):
+    """Yield (line number, record dict) from a CSV or JSONL text stream"""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_number, RecordError(f"JSON tidak valid: {e}")
+            continue
+        if not isinstance(record, dict):
+            yield line_number, RecordError('Setiap baris JSONL harus berupa object')
+            continue
+        yield line_number, record
+
+
+def _text(record, field, min_length=1, max_length=None):
+    value = record.get(field)
+    value = '' if value is None else str(value).strip()
+    if len(value) < min_length:
+        raise RecordError(f"{field} wajib diisi" if not value else f"{field} minimal {min_length} karakter")
+    if max_length and len(value) > max_length:
+        raise RecordError(f"{field} maksimal {max_length} karakter")
+    return value
+
+
+def _score(record, field):
+    value = record.get(field)
+    if value is None or value == '':
+        return 5
+    try:
+        score = int(value)
+    except (TypeError, ValueError):
+        raise RecordError(f"{field} harus angka 1-10")
+    if not 1 <= score <= 10:
+        raise RecordError(f"{field} harus angka 1-10")
+    return score
+
+
+def _flag(value):
+    if value is None or value == '':
+        return True
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'ya', 'y')
+
+
+def _images(value):
+    if not value:
+        return []
+    names = value if isinstance(value, list) else str(value).split(IMAGE_SEPARATOR)
+    names = [str(name).strip() for name in names if str(name).strip()]
+    if len(names) > MAX_IMAGES:
+        raise RecordError(f"Maksimal {MAX_IMAGES} gambar per produk")
+    for name in names:
+        if os.path.basename(name) != name or not allowed_file(name):
+            raise RecordError(f"Nama file gambar tidak valid: {name}")
+    return names
+
+
+def validate(record):
+    """Clean product fields and image names of one record (same rules as ProductForm)"""
+    product = {
+        'owner': _text(record, 'owner'),
+        'category': _text(record, 'category'),
+        'title': _text(record, 'title', 5, 200),
+        'description': _text(record, 'description', 10),
+        'condition': _text(record, 'condition'),
+        'desired_items': _text(record, 'desired_items', 5, 500),
+        'is_available': _flag(record.get('is_available')),
+    }
+    if product['condition'] not in CONDITIONS:
+        raise RecordError(f"condition harus salah satu dari {', '.join(CONDITIONS)}")
+    for column in SCORE_COLUMNS:
+        product[column] = _score(record, column)
+    return product, _images(record.get('images'))
+
+
+class _Lookup:
+    """name -> id for users / categories, loaded per batch for names not seen yet"""
+
+    def __init__(self, column, id_column):
+        self.column = column
+        self.id_column = id_column
+        self.ids = {}
+
+    def resolve(self, names):
+        missing = set(names) - set(self.ids)
+        if missing:
+            for name, id_ in db.session.execute(select(self.column, self.id_column).where(self.column.in_(missing))):
+                self.ids[name] = id_
+            for name in missing:
+                self.ids.setdefault(name, None)
+
+    def get(self, name):
+        return self.ids.get(name)
+
+
+def _write_batch(batch, owners, categories, rules):
+    """Insert one batch of validated records; returns (product ids, image count, errors)"""
+    owners.resolve(product['owner'] for _, product, _ in batch)
+    categories.resolve(product['category'] for _, product, _ in batch)
+
+    rows, images, errors = [], [], []
+    for line_number, product, image_names in batch:
+        user_id, category_id = owners.get(product['owner']), categories.get(product['category'])
+        if user_id is None:
+            errors.append((line_number, f"User tidak ditemukan: {product['owner']}"))
+            continue
+        if category_id is None:
+            errors.append((line_number, f"Kategori tidak ditemukan: {product['category']}"))
+            continue
+        row = {key: value for key, value in product.items() if key not in ('owner', 'category')}
+        row.update(user_id=user_id, category_id=category_id, points_version=rules.version,
+                   total_points=compute_points(SimpleNamespace(**row), rules))
+        rows.append(row)
+        images.append(image_names)
+    if not rows:
+        return [], 0, errors
+
+    table = Product.__table__
+    # SQLite tidak bisa mengurutkan RETURNING per parameter dalam satu INSERT
+    # (SQLAlchemy jatuh ke satu INSERT per baris), tapi rowid dibagikan
+    # berurutan sesuai VALUES selama write lock, jadi cukup diurutkan
+    ordered = db.engine.dialect.name != 'sqlite'
+    product_ids = db.session.execute(
+        insert(table).returning(table.c.id, sort_by_parameter_order=ordered), rows
+    ).scalars().all()
+    if not ordered:
+        product_ids.sort()
+    image_rows = [{'product_id': product_id, 'filename': filename, 'is_main': position == 0, 'status': 'ready'}
+                  for product_id, names in zip(product_ids, images)
+                  for position, filename in enumerate(names)]
+    if image_rows:
+        db.session.execute(insert(ProductImage.__table__), image_rows)
+    changes.record('product', product_ids)
+    db.session.commit()
+    return product_ids, len(image_rows), errors
+
+
+def import_products(stream, fmt='jsonl', batch_size=BATCH_SIZE, refresh_dependents=True):
+    """Stream records from `stream` into products / product_images
+
+    Returns an ImportReport; errors holds up to MAX_REPORTED_ERRORS
+    (line number, message) pairs for rejected records. With
+    refresh_dependents=False the caller runs after_bulk_change() itself,
+    e.g. once after several files.
+    """
+    rules = get_rules()
+    owners = _Lookup(User.username, User.id)
+    categories = _Lookup(Category.name, Category.id)
+    started = time.perf_counter()
+    read = rejected = image_count = 0
+    imported, errors, batch = [], [], []
+
+    def reject(line_number, message):
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append((line_number, message))
+
+    def flush():
+        nonlocal rejected, image_count
+        product_ids, images, batch_errors = _write_batch(batch, owners, categories, rules)
+        imported.extend(product_ids)
+        image_count += images
+        rejected += len(batch_errors)
+        for line_number, message in batch_errors:
+            reject(line_number, message)
+        batch.clear()
+        elapsed = time.perf_counter() - started
+        logger.info(f"Imported {len(imported)} products ({rejected} rejected), {read / elapsed:.0f} records/s")
+
+    for line_number, record in read_records(stream, fmt):
+        read += 1
+        try:
+            if isinstance(record, RecordError):
+                raise record
+            product, image_names = validate(record)
+        except RecordError as e:
+            rejected += 1
+            reject(line_number, str(e))
+            continue
+        batch.append((line_number, product, image_names))
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+
+    if imported and refresh_dependents:
+        after_bulk_change(imported)
+    return ImportReport(read, len(imported), rejected, image_count, time.perf_counter() - started, sorted(errors))
+
+
+# ---------------------------------------------------------------------------
+# Export
+# ---------------------------------------------------------------------------
+
+def iter_products(batch_size=BATCH_SIZE):
+    """Yield export records in id order, reading products with a server-side cursor"""
+    columns = [Product.id, User.username.label('owner'), Category.name.label('category'), Product.title,
+               Product.description, Product.condition, Product.desired_items] + \
+              [getattr(Product, column) for column in SCORE_COLUMNS] + [Product.is_available, Product.total_points]
+    query = select(*columns).join(User, User.id == Product.user_id).join(
+        Category, Category.id == Product.category_id
+    ).order_by(Product.id).execution_options(stream_results=True, yield_per=batch_size)
+
+    for partition in db.session.execute(query).partitions():
+        images = {}
+        for product_id, filename in db.session.execute(
+            select(ProductImage.product_id, ProductImage.filename).where(
+                ProductImage.product_id.in_([row.id for row in partition])
+            ).order_by(ProductImage.product_id, ProductImage.is_main.desc(), ProductImage.id)
+        ):
+            images.setdefault(product_id, []).append(filename)
+        for row in partition:
+            record = row._asdict()
+            record['images'] = images.get(record.pop('id'), [])
+            yield record
+
+
+def export_products(stream, fmt='jsonl', batch_size=BATCH_SIZE):
+    """Write every product to `stream`; returns the number of records written"""
+    count = 0
+    started = time.perf_counter()
+    writer = csv.DictWriter(stream, fieldnames=FIELDS) if fmt == 'csv' else None
+    if writer:
+        writer.writeheader()
+    for record in iter_products(batch_size):
+        if writer:
+            writer.writerow(dict(record, images=IMAGE_SEPARATOR.join(record['images'])))
+        else:
+            stream.write(json.dumps(record, ensure_ascii=False) + '\n')
+        count += 1
+        if count % (batch_size * 10) == 0:
+            logger.info(f"Exported {count} products, {count / (time.perf_counter() - started):.0f} records/s")
+    return count
+
+
+# ---------------------------------------------------------------------------
+# Bulk writes
+# ---------------------------------------------------------------------------
+
+def after_bulk_change(product_ids):
+    """Do what the ORM hooks do, for products written with bulk INSERT / UPDATE
+
+    The in-memory indexes of the web workers are not touched here: the
+    writer records the changed ids with changes.record() in its own
+    transaction and every worker picks them up from index_changes.
+    """
+    import similar
+    from cache import get_cache, FRAGMENTS_GENERATION_KEY
+
+    if len(product_ids) > BULK_REFRESH_LIMIT:
+        similar.rebuild()
+    else:
+        similar.refresh(product_ids)
+        db.session.commit()
+    # Hanya sampai ke worker bila cache-nya dipakai bersama (CACHE_SQLITE_PATH);
+    # dengan LocalCache fragment di worker kedaluwarsa sendiri setelah FRAGMENT_TTL
+    try:
+        get_cache().delete(FRAGMENTS_GENERATION_KEY)
+    except Exception as e:
+        logger.error(f"Could not invalidate fragment cache: {e}")
+
+
+if __name__ == '__main__':
+    import argparse
+    from app import app
+
+    parser = argparse.ArgumentParser(description='BarterHub product catalog import / export')
+    parser.add_argument('command', choices=['import', 'export'])
+    parser.add_argument('path', help="File path, or - for stdin / stdout")
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help='Default: from the file extension')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--no-refresh', action='store_true',
+                        help='Import only; rebuild similar products later with `python similar.py`')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    fmt = detect_format(args.path, args.format)
+    with app.app_context():
+        if args.command == 'import':
+            stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', newline='') if args.path == '-' else \
+                open(args.path, encoding='utf-8', newline='')
+            with stream:
+                report = import_products(stream, fmt, args.batch_size, refresh_dependents=not args.no_refresh)
+            for line_number, message in report.errors:
+                logger.warning(f"Line {line_number}: {message}")
+            logger.info(f"Read {report.read}, imported {report.imported} products and {report.images} images, "
+                        f"rejected {report.rejected} in {report.seconds:.1f}s "
+                        f"({report.read / max(report.seconds, 1e-9):.0f} records/s)")
+        else:
+            stream = sys.stdout if args.path == '-' else open(args.path, 'w', encoding='utf-8', newline='')
+            try:
+                count = export_products(stream, fmt, args.batch_size)
+            finally:
+                if stream is not sys.stdout:
+                    stream.close()
+            logger.info(f"Exported {count} products")
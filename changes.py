@@ -0,0 +1,325 @@
+"""
+Index di memori proses yang mengikuti perubahan database
+
+Index pencarian fallback (search.py), index desired_items (desires.py) dan
+graf barter (cycles.py) dibangun sekali dari database lalu diperbarui per
+objek yang berubah. Semuanya turunan LiveIndex di sini.
+
+Setiap perubahan Product / Wishlist lewat ORM dicatat dua kali:
+- di tabel index_changes (kind, object_id), di transaksi yang sama dengan
+  perubahannya, jadi rollback ikut membuangnya;
+- di memori proses yang menulis, dan baru diterapkan ke index setelah
+  commit (after_commit), tidak saat flush. Index yang di-refresh di tengah
+  transaksi tidak pernah membaca data yang belum di-commit atau yang
+  akhirnya di-rollback.
+
+Worker lain dan proses CLI (catalog.py, scoring.py) tidak berbagi memori,
+jadi sebelum dipakai setiap index membaca index_changes sejak pembacaan
+terakhir (paling sering sekali per POLL_SECONDS per proses, satu query
+ber-index). Baris yang di-commit terlambat (transaksi panjang) tetap
+terbaca karena setiap pembacaan mengulang LAG_SECONDS terakhir; baris yang
+sudah diterapkan diingat per id. Bulk INSERT / UPDATE yang tidak lewat ORM
+memanggil record() sendiri.
+
+Baris lebih tua dari RETENTION_SECONDS dihapus oleh penulis (paling sering
+sekali per PRUNE_EVERY_SECONDS). Proses yang tidak membaca feed selama itu
+membangun ulang index-nya.
+"""
+
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import event, insert, select, delete
+from models import db, Product, Wishlist, IndexChange
+
+logger = logging.getLogger(__name__)
+
+POLL_SECONDS = 2
+LAG_SECONDS = 60
+RETENTION_SECONDS = 24 * 3600
+PRUNE_EVERY_SECONDS = 600
+
+# Model -> (kind, id objek yang berubah)
+WATCHED = {
+    Product: ('product', lambda obj: obj.id),
+    Wishlist: ('wishlist', lambda obj: obj.user_id),
+}
+
+_indexes = []
+_last_prune = 0
+
+
+class LiveIndex:
+    """Process-level index built from the database and refreshed per changed object
+
+    Subclasses set kinds (the change kinds they follow) and implement
+    build() -> index and refresh(index, dirty) with dirty = {kind: ids}.
+    refresh() edits the index in place; readers use `with reading() as
+    index:` so they never see a half-applied refresh.
+
+    With background = True the first build (and any full rebuild) runs in
+    a thread; until it finishes reading() yields None, or the old
+    index during a rebuild. More than rebuild_limit pending changes (e.g.
+    after a bulk import) trigger a full rebuild instead of a refresh.
+    """
+
+    kinds = ('product',)
+    background = False
+    rebuild_limit = 10000
+
+    def __init__(self):
+        self.index = None
+        self.dirty = defaultdict(set)
+        self.building = False
+        self.build_pending = False
+        self.warmed = False
+        self.lock = threading.Lock()        # build / refresh
+        self.dirty_lock = threading.Lock()  # dirty, building; tidak pernah ditahan lama
+        _indexes.append(self)
+
+    def build(self):
+        raise NotImplementedError
+
+    def refresh(self, index, dirty):
+        raise NotImplementedError
+
+    def mark_dirty(self, kind, object_id):
+        with self.dirty_lock:
+            if self.index is not None or self.building:
+                self.dirty[kind].add(object_id)
+
+    def ensure_fresh(self, wait=None):
+        """The up-to-date index; None while a background build is running
+
+        wait=True builds inline even for background indexes (CLI,
+        benchmarks). The index is returned without the lock, so only
+        single-threaded callers may read it this way; request code reads
+        through reading().
+        """
+        with self.reading(wait) as index:
+            return index
+
+    @contextmanager
+    def reading(self, wait=None):
+        """Bring the index up to date and hold the lock while the caller reads it
+
+        refresh() edits the index in place, so a thread must not iterate
+        it while another one refreshes it. Yields None while a background
+        build is running.
+        """
+        wait = not self.background if wait is None else wait
+        feed.poll()
+        with self.lock:
+            with self.dirty_lock:
+                building = self.building
+                dirty, self.dirty = (self.dirty, defaultdict(set)) if not building else ({}, self.dirty)
+            pending = sum(len(ids) for ids in dirty.values())
+
+            if self.index is None or pending > self.rebuild_limit:
+                if wait and not building:
+                    self._build_inline()
+                elif not building:
+                    self._start_build()
+            elif pending:
+                self.refresh(self.index, dirty)
+            yield self.index
+
+    def warm_up(self):
+        """Start the first background build if nothing has started it yet"""
+        if self.index is None and not self.building and not self.warmed:
+            self.warmed = True
+            self._start_build()
+
+    def _build_inline(self):
+        with self.dirty_lock:
+            self.building = True
+            self.dirty.clear()
+        try:
+            index = self.build()
+        finally:
+            with self.dirty_lock:
+                self.building = False
+        self.index = index
+
+    def _start_build(self):
+        with self.dirty_lock:
+            self.build_pending = True
+            if self.building:
+                return
+            self.building = True
+        app = current_app._get_current_object()
+        threading.Thread(target=self._build_in_background, args=(app,), daemon=True,
+                         name=f"{type(self).__name__}-build").start()
+
+    def _build_in_background(self, app):
+        with app.app_context():
+            try:
+                while True:
+                    with self.dirty_lock:
+                        if not self.build_pending:
+                            self.building = False
+                            return
+                        self.build_pending = False
+                        # Perubahan mulai dari sini diterapkan ke index baru setelah selesai
+                        self.dirty.clear()
+                    started = time.perf_counter()
+                    index = self.build()
+                    with self.lock:
+                        self.index = index
+                    logger.info(f"Built {type(self).__name__} in {time.perf_counter() - started:.1f}s")
+            except Exception as e:
+                logger.error(f"Could not build {type(self).__name__}: {e}")
+                with self.dirty_lock:
+                    self.building = False
+            finally:
+                db.session.remove()
+
+    def invalidate(self):
+        """Rebuild on next use (in the background for background indexes, serving the old index)"""
+        if self.background and self.index is not None:
+            self._start_build()
+        else:
+            with self.lock, self.dirty_lock:
+                self.index = None
+                self.dirty.clear()
+
+    def reset(self):
+        with self.lock, self.dirty_lock:
+            self.index = None
+            self.dirty.clear()
+
+
+def mark(kind, object_ids):
+    """Apply changes to the indexes of this process (after commit)"""
+    for index in _indexes:
+        if kind in index.kinds:
+            for object_id in object_ids:
+                index.mark_dirty(kind, object_id)
+
+
+def record(kind, object_ids, connection=None):
+    """Write changes to index_changes inside the caller's transaction; returns the row ids
+
+    For bulk writes that bypass the ORM. Every process, including this
+    one, picks the rows up from the feed once they are committed.
+    """
+    global _last_prune
+    rows = [{'kind': kind, 'object_id': object_id, 'changed_at': datetime.utcnow()} for object_id in object_ids]
+    if not rows:
+        return []
+    executor = connection or db.session
+    table = IndexChange.__table__
+    row_ids = executor.execute(insert(table).returning(table.c.id), rows).scalars().all()
+    if time.monotonic() - _last_prune > PRUNE_EVERY_SECONDS:
+        _last_prune = time.monotonic()
+        executor.execute(delete(table).where(
+            table.c.changed_at < datetime.utcnow() - timedelta(seconds=RETENTION_SECONDS)
+        ))
+    return row_ids
+
+
+# ---------------------------------------------------------------------------
+# Change feed dari proses lain
+# ---------------------------------------------------------------------------
+
+class ChangeFeed:
+    """Reads index_changes written by other processes and marks the indexes dirty"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.since = None
+        self.seen = {}              # id baris index_changes -> changed_at
+        self.last_poll = 0
+
+    def remember(self, row_ids, changed_at):
+        with self.lock:
+            for row_id in row_ids:
+                self.seen[row_id] = changed_at
+
+    def poll(self, force=False):
+        """Mark what other processes changed; only reads, never commits the session"""
+        now = time.monotonic()
+        if not force and now - self.last_poll < POLL_SECONDS:
+            return
+        if not self.lock.acquire(blocking=False):
+            return  # thread lain sedang membaca
+        try:
+            self.last_poll = now
+            if not any(index.index is not None or index.building for index in _indexes):
+                self.since = None   # belum ada index: tidak ada yang perlu diperbarui
+                return
+            clock = datetime.utcnow()
+            if self.since is not None and (clock - self.since).total_seconds() > RETENTION_SECONDS - LAG_SECONDS:
+                # Baris yang belum dibaca mungkin sudah dihapus
+                for index in _indexes:
+                    index.invalidate()
+                self.seen.clear()
+            cutoff = (self.since or clock) - timedelta(seconds=LAG_SECONDS)
+            # Baris transaksi ini sendiri yang belum di-commit dilewati; diterapkan di after_commit
+            own = set(db.session.info.get('index_changes', {}).get('rows', ()))
+            table = IndexChange.__table__
+            changed = defaultdict(set)
+            for row_id, kind, object_id, changed_at in db.session.execute(
+                select(table.c.id, table.c.kind, table.c.object_id, table.c.changed_at)
+                .where(table.c.changed_at > cutoff)
+            ):
+                if row_id not in self.seen and row_id not in own:
+                    self.seen[row_id] = changed_at
+                    changed[kind].add(object_id)
+            self.seen = {row_id: at for row_id, at in self.seen.items() if at > cutoff}
+            self.since = clock
+            for kind, object_ids in changed.items():
+                mark(kind, object_ids)
+        except Exception as e:
+            logger.error(f"Could not read index changes: {e}")
+        finally:
+            self.lock.release()
+
+
+feed = ChangeFeed()
+
+
+# ---------------------------------------------------------------------------
+# Session hooks
+# ---------------------------------------------------------------------------
+
+def _collect_changes(session, flush_context):
+    changes = defaultdict(set)
+    for objects, modified_only in ((session.new, False), (session.dirty, True), (session.deleted, False)):
+        for obj in objects:
+            watched = WATCHED.get(type(obj))
+            if watched is None or (modified_only and not session.is_modified(obj, include_collections=False)):
+                continue
+            kind, object_id = watched
+            changes[kind].add(object_id(obj))
+    if not changes:
+        return
+    pending = session.info.setdefault('index_changes', {'changes': defaultdict(set), 'rows': []})
+    connection = session.connection()
+    for kind, object_ids in changes.items():
+        pending['changes'][kind] |= object_ids
+        pending['rows'] += record(kind, sorted(object_ids), connection)
+
+
+def _apply_changes(session):
+    pending = session.info.pop('index_changes', None)
+    if not pending:
+        return
+    # Baris feed milik sendiri tidak perlu diterapkan lagi saat poll
+    feed.remember(pending['rows'], datetime.utcnow())
+    for kind, object_ids in pending['changes'].items():
+        mark(kind, object_ids)
+
+
+def _discard_changes(session):
+    session.info.pop('index_changes', None)
+
+
+if not event.contains(db.session, 'after_flush', _collect_changes):
+    event.listen(db.session, 'after_flush', _collect_changes)
+    event.listen(db.session, 'after_commit', _apply_changes)
+    event.listen(db.session, 'after_rollback', _discard_changes)
@@ -0,0 +1,143 @@
+"""
+ETag / 304 Not Modified untuk endpoint JSON yang di-polling
+
+Floating chat dan halaman chat memanggil /chat/rooms, quick_check,
+messages_direct, /products/user/available dan /wishlist/check berulang kali
+walaupun biasanya tidak ada yang berubah. Decorator @conditional menghitung
+"version stamp" murah (max id pesan, watermark baca, updated_at produk, ...)
+sebelum view dijalankan. Bila ETag dari stamp itu sama dengan If-None-Match
+dari browser, response 304 langsung dikirim tanpa query dan serialisasi
+penuh. Browser mengirim If-None-Match sendiri (Cache-Control: private,
+no-cache), jadi JavaScript tidak perlu diubah.
+
+Stamp dihitung sebelum view: bila data berubah di antaranya, ETag hanya
+menjadi lebih tua dari isi response dan poll berikutnya mengirim ulang body,
+tidak pernah melewatkan perubahan.
+"""
+
+import hashlib
+import time
+from functools import wraps
+from flask import current_app, make_response, request
+from flask_login import current_user
+from sqlalchemy import case, func, or_
+from models import db, ChatMessage, ChatRoom, Product, ProductImage, Wishlist
+from inbox import RECENT_ACTIVITY_WINDOW, last_read_id_expr
+
+CACHE_CONTROL = 'private, no-cache'
+
+
+def make_etag(*parts):
+    return hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest()
+
+
+def conditional(version):
+    """Answer 304 when `version(**view_args)` still matches the client's ETag
+
+    The ETag also covers the user and the full query string, so one stamp
+    function serves every parameter combination. Only 200 responses get
+    an ETag; errors are never cached.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            user_id = current_user.get_id() if current_user.is_authenticated else None
+            etag = make_etag(request.full_path, user_id, version(**kwargs) if user_id else None)
+
+            if etag in request.if_none_match:
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = CACHE_CONTROL
+            return response
+        return wrapper
+    return decorator
+
+
+# ---------------------------------------------------------------------------
+# Version stamps
+# ---------------------------------------------------------------------------
+
+def _user_rooms(user_id):
+    return or_(ChatRoom.user1_id == user_id, ChatRoom.user2_id == user_id)
+
+
+def _chat_stats(user_id):
+    """One statement over the user's rooms: counts, watermarks and newest message"""
+    room_ids = db.session.query(ChatRoom.id).filter(_user_rooms(user_id))
+    latest_message_id = db.session.query(func.max(ChatMessage.id)).filter(
+        ChatMessage.room_id.in_(room_ids)
+    ).scalar_subquery()
+    latest_created_at = db.session.query(ChatMessage.created_at).filter(
+        ChatMessage.id == latest_message_id
+    ).scalar_subquery()
+
+    return db.session.query(
+        func.count(ChatRoom.id),
+        func.max(ChatRoom.id),
+        func.sum(last_read_id_expr(user_id)),
+        # Room hilang dari inbox saat produknya tidak tersedia lagi
+        func.sum(case((Product.is_available == True, 1), else_=0)),
+        latest_message_id,
+        latest_created_at
+    ).join(Product, Product.id == ChatRoom.product_id).filter(_user_rooms(user_id)).one()
+
+
+def chat_activity_version(user_id=None):
+    """Changes on a new room, a new message or a moved read watermark"""
+    return tuple(_chat_stats(user_id or current_user.id)[:5])
+
+
+def inbox_version(user_id=None, now=None):
+    """chat_activity_version plus the clock-dependent part of /chat/rooms
+
+    has_recent_activity depends on the time: while the newest message is
+    younger than RECENT_ACTIVITY_WINDOW the stamp also changes every minute,
+    so that flag is at most a minute stale.
+    """
+    stats = _chat_stats(user_id or current_user.id)
+    now = now or time.time()
+    latest_created_at = stats[5]
+    minute = None
+    if latest_created_at and now - latest_created_at.timestamp() < RECENT_ACTIVITY_WINDOW.total_seconds():
+        minute = int(now // 60)
+    return tuple(stats[:5]) + (minute,)
+
+
+def room_messages_version(room_id):
+    """Newest message id in the room and how many messages left 'pending'
+
+    offer_status is the only field that changes after a message is sent,
+    and only from pending to accepted/declined.
+    """
+    # Hanya room milik user; untuk room lain view yang menjawab (403)
+    return tuple(db.session.query(
+        func.max(ChatMessage.id),
+        func.sum(case((ChatMessage.offer_status != 'pending', 1), else_=0))
+    ).join(ChatRoom, ChatRoom.id == ChatMessage.room_id).filter(
+        ChatMessage.room_id == room_id, _user_rooms(current_user.id)
+    ).one())
+
+
+def available_products_version(user_id=None):
+    """Count, newest id and last edit of the user's available products and their images"""
+    user_id = user_id or current_user.id
+    products = db.session.query(Product.id).filter(Product.user_id == user_id, Product.is_available == True)
+    images = db.session.query(
+        func.count(ProductImage.id), func.max(ProductImage.id),
+        func.sum(case((ProductImage.status == 'ready', 1), else_=0))
+    ).filter(ProductImage.product_id.in_(products)).one()
+    stats = db.session.query(
+        func.count(Product.id), func.max(Product.id), func.max(Product.updated_at)
+    ).filter(Product.user_id == user_id, Product.is_available == True).one()
+    return tuple(stats) + tuple(images)
+
+
+def wishlist_version(product_id, user_id=None):
+    """The wishlist row id for this product, or None; the check is the stamp"""
+    user_id = user_id or current_user.id
+    return db.session.query(Wishlist.id).filter_by(user_id=user_id, product_id=product_id).scalar()
@@ -0,0 +1,337 @@
+"""
+Barter multi-pihak: siklus tukar 2, 3 dan 4 pihak
+
+Transaksi biasa hanya dua pihak. Di sini dibangun graf want/have di memori:
+ada edge A -> B bila pemilik produk A menginginkan produk B dan poin A dan
+B seimbang (toleransi 10% calculate_point_balance). Siklus
+A1 -> A2 -> ... -> Ak -> A1 dengan pemilik yang berbeda-beda berarti setiap
+pemilik Ai bisa menyerahkan Ai dan menerima A(i+1), dan setiap pertukaran
+seimbang.
+
+"Menginginkan" berasal dari:
+- wishlist: user menginginkan produk itu;
+- desired_items produk milik user, dicocokkan per frasa dengan judul dan
+  kategori produk lain (DesireIndex di desires.py).
+
+Seperti index pencarian fallback di search.py, graf dibangun sekali per
+proses lalu diperbarui per produk / per wishlist yang berubah setelah commit,
+termasuk perubahan dari worker lain (LiveIndex, changes.py). Membangun graf
+katalog besar butuh puluhan detik, jadi dibangun di thread background mulai
+request pertama; sampai selesai /products/barter_cycles menjawab
+ready: false. Setiap perubahan hanya mencari ulang siklus yang melewati
+produk yang terdampak (DFS sedalam MAX_CYCLE_LENGTH dari produk itu), bukan
+seluruh graf. Langkah terakhir DFS hanya mengecek produk yang bisa menutup
+siklus (in-edge produk awal), dan pencarian per produk berhenti setelah
+MAX_CYCLES_PER_PRODUCT siklus supaya produk yang sangat populer tidak
+membuat pencarian meledak.
+
+    python benchmark.py cycles
+"""
+
+from bisect import bisect_left, bisect_right
+from collections import defaultdict, namedtuple
+from changes import LiveIndex
+from models import db, Category, Product, Wishlist
+from desires import DesireIndex, desire_phrases, listing_tokens
+from utils import balanced_range
+
+MAX_CYCLE_LENGTH = 4
+MAX_CYCLES_PER_PRODUCT = 50
+MAX_CYCLES_SHOWN = 20
+
+Node = namedtuple('Node', ['owner_id', 'points'])
+
+
+def canonical(cycle):
+    """Rotate a cycle so it starts at its smallest product id"""
+    i = cycle.index(min(cycle))
+    return tuple(cycle[i:]) + tuple(cycle[:i])
+
+
+class BarterGraph:
+    """Want/have graph over available products plus the cycles found in it"""
+
+    def __init__(self, max_length=MAX_CYCLE_LENGTH, max_cycles=MAX_CYCLES_PER_PRODUCT):
+        self.max_length = max_length
+        self.max_cycles = max_cycles
+        self.products = {}                          # product id -> Node
+        self.owned = defaultdict(set)               # user id -> product ids
+        self.desires = DesireIndex(on_match=self._add_want, on_unmatch=self._remove_want)
+        self.wishlists = defaultdict(set)           # user id -> product ids
+        self.wants = defaultdict(lambda: defaultdict(int))      # user -> product -> jumlah sumber
+        self.wanted_by = defaultdict(lambda: defaultdict(int))  # product -> user -> jumlah sumber
+        self.wants_by_points = {}                   # user id -> cache _wanted_by_points()
+        self.cycles = {}                            # canonical tuple -> cycle
+        self.cycles_by_product = defaultdict(set)
+        self.changed_products = set()
+        self.changed_users = set()
+
+    # -- wants ---------------------------------------------------------------
+
+    def _add_want(self, user_id, product_id):
+        self.wants_by_points.pop(user_id, None)
+        self.wants[user_id][product_id] += 1
+        self.wanted_by[product_id][user_id] += 1
+        self.changed_users.add(user_id)
+
+    def _remove_want(self, user_id, product_id):
+        self.wants_by_points.pop(user_id, None)
+        wants = self.wants[user_id]
+        wants[product_id] -= 1
+        if wants[product_id] <= 0:
+            del wants[product_id]
+            if not wants:
+                del self.wants[user_id]
+        wanted_by = self.wanted_by[product_id]
+        wanted_by[user_id] -= 1
+        if wanted_by[user_id] <= 0:
+            del wanted_by[user_id]
+            if not wanted_by:
+                del self.wanted_by[product_id]
+        self.changed_users.add(user_id)
+
+    # -- products ------------------------------------------------------------
+
+    def add_product(self, product_id, owner_id, points, title_tokens, phrases):
+        """Add an available product; phrases come from its desired_items (desires.desire_phrases)"""
+        self._add_node(product_id, owner_id, points)
+        self.desires.add(product_id, owner_id, title_tokens, phrases)
+
+    def load(self, products):
+        """Bulk add_product() for (product id, owner id, points, title tokens, phrases)"""
+        rows = []
+        for product_id, owner_id, points, title_tokens, phrases in products:
+            self._add_node(product_id, owner_id, points)
+            rows.append((product_id, owner_id, title_tokens, phrases))
+        self.desires.load(rows)
+
+    def _add_node(self, product_id, owner_id, points):
+        self.remove_product(product_id)
+        self.products[product_id] = Node(owner_id, points or 0)
+        self._forget_wanted_points(product_id)
+        self.owned[owner_id].add(product_id)
+        self.changed_products.add(product_id)
+
+    def _forget_wanted_points(self, product_id):
+        for user_id in self.wanted_by.get(product_id, ()):
+            self.wants_by_points.pop(user_id, None)
+
+    def remove_product(self, product_id):
+        node = self.products.pop(product_id, None)
+        if node is None:
+            return
+        self._forget_wanted_points(product_id)
+        self.changed_products.add(product_id)
+        self.owned[node.owner_id].discard(product_id)
+        if not self.owned[node.owner_id]:
+            del self.owned[node.owner_id]
+        # Want dari wishlist tetap disimpan (edge hanya dibuat ke produk yang ada di graf)
+        self.desires.remove(product_id)
+
+    def set_wishlist(self, user_id, product_ids):
+        old = self.wishlists.pop(user_id, set())
+        new = set(product_ids)
+        for product_id in old - new:
+            self._remove_want(user_id, product_id)
+        for product_id in new - old:
+            self._add_want(user_id, product_id)
+        if new:
+            self.wishlists[user_id] = new
+
+    # -- edges and cycles ----------------------------------------------------
+
+    def _wanted_by_points(self, user_id):
+        """[(points, product id), ...] of the products user_id wants, sorted"""
+        wanted = self.wants_by_points.get(user_id)
+        if wanted is None:
+            wanted = sorted((self.products[product_id].points, product_id)
+                            for product_id in self.wants.get(user_id, ()) if product_id in self.products)
+            self.wants_by_points[user_id] = wanted
+        return wanted
+
+    def out_edges(self, product_id):
+        """Products the owner of product_id wants and could swap it for"""
+        node = self.products[product_id]
+        wanted = self._wanted_by_points(node.owner_id)
+        low, high = balanced_range(node.points)
+        for i in range(bisect_left(wanted, (low,)), bisect_right(wanted, (high, float('inf')))):
+            other_id = wanted[i][1]
+            if self.products[other_id].owner_id != node.owner_id:
+                yield other_id
+
+    def in_edges(self, product_id):
+        """Products whose owners want product_id and could swap them for it"""
+        node = self.products[product_id]
+        low, high = balanced_range(node.points)
+        for user_id in self.wanted_by.get(product_id, ()):
+            if user_id == node.owner_id:
+                continue
+            for offered in self.owned.get(user_id, ()):
+                if low <= self.products[offered].points <= high:
+                    yield offered
+
+    def cycles_through(self, start, smallest_first=False):
+        """Cycles containing `start`, as product id lists in trade order
+
+        Each owner of cycle[i] gives it away and receives cycle[i + 1].
+        With smallest_first only cycles whose smallest id is `start` are
+        returned, so a scan over every product finds each cycle once. The
+        search stops after max_cycles; direct 2-party swaps come first.
+        """
+        if start not in self.products:
+            return []
+        closing = set(self.in_edges(start))
+        if smallest_first:
+            closing = {product_id for product_id in closing if product_id > start}
+        if not closing:
+            return []
+
+        closing = [(product_id, self.products[product_id]) for product_id in closing]
+        found = []
+
+        def extend(path, owners):
+            """False once max_cycles are found"""
+            node = self.products[path[-1]]
+            wants = self.wants.get(node.owner_id, {})
+            low, high = balanced_range(node.points)
+            # Langkah terakhir cukup dicek ke produk penutup, tanpa menelusuri semua want
+            for product_id, other in closing:
+                if product_id in wants and other.owner_id not in owners and low <= other.points <= high:
+                    found.append(path + [product_id])
+                    if len(found) >= self.max_cycles:
+                        return False
+            if len(path) + 2 > self.max_length:
+                return True
+            for nxt in self.out_edges(path[-1]):
+                if smallest_first and nxt < start:
+                    continue
+                owner_id = self.products[nxt].owner_id
+                if owner_id not in owners and not extend(path + [nxt], owners | {owner_id}):
+                    return False
+            return True
+
+        extend([start], {self.products[start].owner_id})
+        return found
+
+    def _store(self, cycle):
+        key = canonical(cycle)
+        if key not in self.cycles:
+            self.cycles[key] = key
+            for product_id in key:
+                self.cycles_by_product[product_id].add(key)
+
+    def _drop_cycles(self, product_id):
+        for key in list(self.cycles_by_product.pop(product_id, ())):
+            self.cycles.pop(key, None)
+            for other in key:
+                if other != product_id:
+                    self.cycles_by_product[other].discard(key)
+
+    def find_all(self):
+        """Rebuild the cycle store by scanning every product"""
+        self.cycles.clear()
+        self.cycles_by_product.clear()
+        for product_id in sorted(self.products):
+            for cycle in self.cycles_through(product_id, smallest_first=True):
+                self._store(cycle)
+        self.changed_products.clear()
+        self.changed_users.clear()
+        return len(self.cycles)
+
+    def update_cycles(self):
+        """Re-search cycles through every product touched since the last call"""
+        affected = set(self.changed_products)
+        for user_id in self.changed_users:
+            affected |= self.owned.get(user_id, set())
+        self.changed_products.clear()
+        self.changed_users.clear()
+        for product_id in affected:
+            self._drop_cycles(product_id)
+        for product_id in affected:
+            for cycle in self.cycles_through(product_id):
+                self._store(cycle)
+        return len(affected)
+
+    def cycles_for_user(self, user_id):
+        keys = set()
+        for product_id in self.owned.get(user_id, ()):
+            keys |= self.cycles_by_product.get(product_id, set())
+        return sorted((self.cycles[key] for key in keys), key=lambda cycle: (len(cycle), cycle))
+
+
+# ---------------------------------------------------------------------------
+# Process-level graph
+# ---------------------------------------------------------------------------
+
+class BarterCycleIndex(LiveIndex):
+    """BarterGraph loaded from the database and refreshed per changed product / wishlist
+
+    The full build takes tens of seconds on a large catalog, so it runs in
+    a background thread (started by init_cycles on the first request);
+    cycles_for_user() returns None until it is done.
+    """
+
+    kinds = ('product', 'wishlist')
+    background = True
+
+    def _products(self, product_ids=None):
+        query = db.session.query(
+            Product.id, Product.user_id, Product.total_points, Product.title, Product.desired_items, Category.name
+        ).outerjoin(Category, Category.id == Product.category_id).filter(Product.is_available == True)
+        if product_ids is not None:
+            query = query.filter(Product.id.in_(product_ids))
+        return query.yield_per(1000)
+
+    def _wishlists(self, user_ids=None):
+        wishlists = defaultdict(set)
+        query = db.session.query(Wishlist.user_id, Wishlist.product_id)
+        if user_ids is not None:
+            query = query.filter(Wishlist.user_id.in_(user_ids))
+        for user_id, product_id in query.yield_per(1000):
+            wishlists[user_id].add(product_id)
+        return wishlists
+
+    def _node(self, row):
+        product_id, owner_id, points, title, desired_items, category_name = row
+        return product_id, owner_id, points, listing_tokens(title, category_name), desire_phrases(desired_items)
+
+    def build(self):
+        graph = BarterGraph()
+        graph.load(self._node(row) for row in self._products())
+        for user_id, product_ids in self._wishlists().items():
+            graph.set_wishlist(user_id, product_ids)
+        graph.find_all()
+        return graph
+
+    def refresh(self, graph, dirty):
+        dirty_products = dirty.get('product', set())
+        dirty_users = dirty.get('wishlist', set())
+        for product_id in dirty_products:
+            graph.remove_product(product_id)
+        if dirty_products:
+            for row in self._products(dirty_products):
+                graph.add_product(*self._node(row))
+        if dirty_users:
+            wishlists = self._wishlists(dirty_users)
+            for user_id in dirty_users:
+                graph.set_wishlist(user_id, wishlists.get(user_id, ()))
+        graph.update_cycles()
+
+    def cycles_for_user(self, user_id):
+        """Cycles involving the user's products; None while the graph is still being built"""
+        with self.reading() as graph:
+            return None if graph is None else graph.cycles_for_user(user_id)
+
+
+cycle_index = BarterCycleIndex()
+
+
+def init_cycles(app):
+    """Start building the graph on the first request of each worker
+
+    Not at startup: the CLI imports the app too, and a thread started
+    before the server forks its workers does not survive the fork.
+    """
+    @app.before_request
+    def _start_cycle_index():
+        cycle_index.warm_up()
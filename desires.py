@@ -0,0 +1,250 @@
+"""
+Index desired_items -> listing: siapa yang menginginkan produk ini
+
+desired_items adalah teks bebas ("Laptop gaming, MacBook, atau smartphone
+Android"). Teks itu dipecah per frasa (koma, titik koma, garis miring,
+"atau", "dan") dan dinormalisasi seperti index pencarian (huruf kecil, tanpa
+aksen), ditambah:
+- kata pengisi (STOPWORDS) dibuang, jadi "Apa saja" tidak menjadi frasa;
+- beberapa sinonim disamakan (SYNONYMS), mis. handphone / ponsel -> hp.
+
+Sebuah frasa cocok dengan listing bila semua katanya ada di judul atau nama
+kategori listing itu. Setiap frasa diindex di satu kata saja, kata yang
+paling jarang di judul listing saat frasa ditambahkan: listing baru cukup
+dicek ke frasa yang diindex di kata-kata judulnya, jadi mencocokkan satu
+produk baru tidak perlu membaca ulang desired_items seluruh katalog. Frasa
+yang cocok dengan lebih dari MAX_PHRASE_MATCHES listing dianggap terlalu
+umum dan diabaikan.
+
+DesireIndex juga dipakai graf barter multi-pihak (cycles.py) lewat
+callback on_match / on_unmatch. Untuk feed "yang menginginkan produk ini"
+(/products/wanted_by/<id>), index proses diperbarui per produk yang berubah,
+termasuk perubahan dari worker lain (LiveIndex, changes.py).
+
+    python benchmark.py desires
+"""
+
+import re
+from collections import defaultdict, namedtuple
+from changes import LiveIndex
+from models import db, Category, Product
+from search import tokenize
+
+MAX_PHRASE_MATCHES = 200
+FEED_LIMIT = 20
+
+_PHRASE_SPLIT_RE = re.compile(r'[,;/\n]|\batau\b|\bor\b|\bdan\b', re.IGNORECASE)
+
+STOPWORDS = frozenset([
+    'apa', 'saja', 'apapun', 'barang', 'yang', 'untuk', 'dengan', 'lain', 'lainnya', 'sejenis',
+    'bekas', 'baru', 'second', 'seken', 'ori', 'original', 'kondisi', 'bagus', 'mulus', 'masih',
+    'atau', 'dan', 'or', 'and', 'any', 'ok', 'terserah', 'nego', 'semua', 'jenis', 'merk', 'cari',
+])
+SYNONYMS = {
+    'handphone': 'hp', 'ponsel': 'hp', 'hape': 'hp', 'smartphone': 'hp',
+    'notebook': 'laptop', 'camera': 'kamera', 'book': 'buku', 'bike': 'sepeda',
+}
+
+Listing = namedtuple('Listing', ['owner_id', 'tokens'])
+Phrase = namedtuple('Phrase', ['owner_id', 'tokens', 'key_token'])
+
+
+def normalize(text):
+    """Tokens of `text` with fillers removed and synonyms mapped"""
+    return [SYNONYMS.get(token, token) for token in tokenize(text) if token not in STOPWORDS]
+
+
+def listing_tokens(title, category_name=None):
+    """Words a desired_items phrase can match: the title plus the category"""
+    return normalize(title) + normalize(category_name)
+
+
+def desire_phrases(text):
+    """Token tuples for each phrase of a desired_items text"""
+    phrases = []
+    for part in _PHRASE_SPLIT_RE.split(text or ''):
+        tokens = tuple(dict.fromkeys(normalize(part)))
+        if tokens and tokens not in phrases:
+            phrases.append(tokens)
+    return phrases
+
+
+def _ignore(owner_id, product_id):
+    pass
+
+
+class DesireIndex:
+    """Listings and desired_items phrases, matched incrementally
+
+    Phrases are keyed by (product id, position in its desired_items).
+    on_match(owner_id, product_id) / on_unmatch(...) are called whenever
+    a phrase of owner_id starts or stops matching a listing.
+    """
+
+    def __init__(self, on_match=_ignore, on_unmatch=_ignore):
+        self.on_match = on_match
+        self.on_unmatch = on_unmatch
+        self.listings = {}                          # product id -> Listing
+        self.postings = defaultdict(set)            # judul/kategori token -> product ids
+        self.phrase_counts = {}                     # product id -> jumlah frasa
+        self.phrases = {}                           # phrase key -> Phrase
+        self.phrase_postings = defaultdict(set)     # Phrase.key_token -> phrase keys
+        self.matches = {}                           # phrase key -> product ids, None bila terlalu umum
+        self.matched_by = defaultdict(set)          # product id -> phrase keys yang cocok
+
+    def add(self, product_id, owner_id, title_tokens, phrases):
+        """Add or replace a listing together with its desired_items phrases"""
+        self.remove(product_id)
+        self._add_listing(product_id, owner_id, title_tokens)
+        self._add_phrases(product_id, owner_id, phrases)
+
+    def load(self, rows):
+        """Bulk add() for (product id, owner id, title tokens, phrases) rows
+
+        Every listing is added before any phrase, so each phrase is matched
+        once against the full catalog instead of every listing being
+        checked against the phrases seen so far.
+        """
+        rows = list(rows)
+        for product_id, owner_id, title_tokens, _ in rows:
+            self.remove(product_id)
+            self._add_listing(product_id, owner_id, title_tokens)
+        for product_id, owner_id, _, phrases in rows:
+            self._add_phrases(product_id, owner_id, phrases)
+
+    def _match(self, key, product_id):
+        self.matches[key].add(product_id)
+        self.matched_by[product_id].add(key)
+        self.on_match(self.phrases[key].owner_id, product_id)
+
+    def _unmatch(self, key, product_id):
+        self.matched_by[product_id].discard(key)
+        if not self.matched_by[product_id]:
+            del self.matched_by[product_id]
+        self.on_unmatch(self.phrases[key].owner_id, product_id)
+
+    def _add_listing(self, product_id, owner_id, title_tokens):
+        tokens = frozenset(title_tokens)
+        self.listings[product_id] = Listing(owner_id, tokens)
+        for token in tokens:
+            self.postings[token].add(product_id)
+
+        # Frasa yang sudah ada dan sekarang cocok dengan listing ini
+        for key in self._candidate_phrases(tokens):
+            matches = self.matches[key]
+            if matches is None or not tokens.issuperset(self.phrases[key].tokens):
+                continue
+            if len(matches) >= MAX_PHRASE_MATCHES:
+                # Terlalu umum: frasa ini tidak dipakai lagi sampai index dibangun ulang
+                for match in matches:
+                    self._unmatch(key, match)
+                self.matches[key] = None
+            else:
+                self._match(key, product_id)
+
+    def _add_phrases(self, product_id, owner_id, phrases):
+        self.phrase_counts[product_id] = len(phrases)
+        for i, phrase_tokens in enumerate(phrases):
+            key = (product_id, i)
+            # Listing yang cocok pasti memuat semua kata frasa, jadi cukup
+            # diindex di satu kata: yang paling jarang saat ini
+            key_token = min(phrase_tokens, key=lambda token: len(self.postings.get(token, ())))
+            self.phrases[key] = Phrase(owner_id, frozenset(phrase_tokens), key_token)
+            self.phrase_postings[key_token].add(key)
+            found = self._matching_listings(phrase_tokens)
+            if len(found) > MAX_PHRASE_MATCHES:
+                self.matches[key] = None
+                continue
+            self.matches[key] = set()
+            for match in found:
+                self._match(key, match)
+
+    def _matching_listings(self, tokens):
+        postings = sorted((self.postings.get(token, set()) for token in tokens), key=len)
+        found = set(postings[0])
+        for posting in postings[1:]:
+            found &= posting
+            if not found:
+                break
+        return found
+
+    def _candidate_phrases(self, tokens):
+        """Phrase keys that may match a listing with these tokens"""
+        candidates = set()
+        for token in tokens:
+            candidates |= self.phrase_postings.get(token, set())
+        return candidates
+
+    def remove(self, product_id):
+        listing = self.listings.pop(product_id, None)
+        if listing is None:
+            return
+        for token in listing.tokens:
+            self.postings[token].discard(product_id)
+            if not self.postings[token]:
+                del self.postings[token]
+
+        for i in range(self.phrase_counts.pop(product_id)):
+            key = (product_id, i)
+            for match in self.matches[key] or ():
+                self._unmatch(key, match)
+            del self.matches[key]
+            phrase = self.phrases.pop(key)
+            self.phrase_postings[phrase.key_token].discard(key)
+            if not self.phrase_postings[phrase.key_token]:
+                del self.phrase_postings[phrase.key_token]
+
+        for key in list(self.matched_by.get(product_id, ())):
+            self.matches[key].discard(product_id)
+            self._unmatch(key, product_id)
+
+    def wanted_by(self, product_id):
+        """Products of other owners whose desired_items match `product_id`"""
+        listing = self.listings.get(product_id)
+        if listing is None:
+            return set()
+        return {key[0] for key in self.matched_by.get(product_id, ())
+                if self.phrases[key].owner_id != listing.owner_id}
+
+    def wants(self, product_id):
+        """Listings matched by the desired_items of `product_id`"""
+        found = set()
+        for i in range(self.phrase_counts.get(product_id, 0)):
+            found |= self.matches[(product_id, i)] or set()
+        return found
+
+
+def _rows(product_ids=None):
+    """(product id, owner id, title tokens, phrases) of available products"""
+    query = db.session.query(
+        Product.id, Product.user_id, Product.title, Product.desired_items, Category.name
+    ).outerjoin(Category, Category.id == Product.category_id).filter(Product.is_available == True)
+    if product_ids is not None:
+        query = query.filter(Product.id.in_(product_ids))
+    for product_id, owner_id, title, desired_items, category_name in query.yield_per(1000):
+        yield product_id, owner_id, listing_tokens(title, category_name), desire_phrases(desired_items)
+
+
+class ProductDesireIndex(LiveIndex):
+    """Process-level DesireIndex over available products, refreshed per changed product"""
+
+    def build(self):
+        index = DesireIndex()
+        index.load(_rows())
+        return index
+
+    def refresh(self, index, dirty):
+        product_ids = dirty.get('product', set())
+        for product_id in product_ids:
+            index.remove(product_id)
+        for row in _rows(product_ids):
+            index.add(*row)
+
+    def wanted_by(self, product_id, limit=FEED_LIMIT):
+        """Newest products whose owners want `product_id`"""
+        with self.reading() as index:
+            wanted = index.wanted_by(product_id)
+        return sorted(wanted, reverse=True)[:limit]
+
+
+desire_index = ProductDesireIndex()
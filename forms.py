@@ -2,7 +2,8 @@ from flask_wtf import FlaskForm
 from flask_wtf.file import FileField, FileAllowed, FileRequired
 from wtforms import StringField, TextAreaField, SelectField, IntegerField, PasswordField, SubmitField, HiddenField
 from wtforms.validators import DataRequired, Email, Length, EqualTo, NumberRange, ValidationError
-from models import User, Category
+from models import User
+from cache import category_choices
 
 class LoginForm(FlaskForm):
     username = StringField('Username', validators=[DataRequired(), Length(min=3, max=20)])
@@ -64,7 +65,7 @@ class ProductForm(FlaskForm):
 
     def __init__(self, *args, **kwargs):
         super(ProductForm, self).__init__(*args, **kwargs)
-        self.category_id.choices = [(c.id, c.name) for c in Category.query.all()]
+        self.category_id.choices = category_choices()
 
 class ChatMessageForm(FlaskForm):
     message = TextAreaField('Pesan', 
@@ -114,7 +115,7 @@ class QuickProductForm(FlaskForm):
 
     def __init__(self, *args, **kwargs):
         super(QuickProductForm, self).__init__(*args, **kwargs)
-        self.category_id.choices = [(c.id, c.name) for c in Category.query.all()]
+        self.category_id.choices = category_choices()
 
 
 
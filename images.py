@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+"""
+Pipeline gambar produk di background
+
+Request upload hanya menyimpan file mentah ke folder privat (originals/ di
+PRIVATE_UPLOAD_FOLDER, di luar static/ karena file mentah masih membawa EXIF)
+dan membuat ProductImage berstatus 'pending'. Setelah transaksi commit, id-nya
+dikirim ke ImagePipeline yang di thread pool membuat:
+
+- versi full (maks. 800px, JPEG) dengan nama `filename`, dipakai halaman
+  detail dan API JSON seperti sebelumnya;
+- varian responsive per lebar (ProductImage.WIDTHS) dalam AVIF / WebP (bila
+  Pillow mendukung) dan JPEG, disimpan content-addressed berdasarkan sha256
+  file sumber: variants/ab/abcd.../320.webp;
+
+lalu menandai gambar 'ready'. Selama belum ready, template menampilkan
+PLACEHOLDER_IMAGE. product_picture() (template global) membuat <picture>
+dengan srcset/sizes dari varian tersebut.
+
+Nama file juga sha256 isi upload (storage.py), jadi upload ulang foto yang
+sama tidak disimpan maupun di-resize lagi: ProductImage baru cukup menyalin
+metadata dari gambar ready dengan file yang sama.
+
+Seperti realtime.py, pipeline bersifat pluggable: deployment bisa memberikan
+implementasi lain (mis. job queue terpisah) lewat init_images(app, pipeline=...)
+selama punya method submit(image_id).
+
+Gambar yang tertinggal (proses mati sebelum selesai, klaim 'processing'
+lebih tua dari STALE_PROCESSING_SECONDS) atau gagal bisa diproses ulang
+dengan:
+    python images.py                # pending + failed + klaim yang mati
+    python images.py --force        # juga semua yang sedang 'processing'
+    python images.py --backfill     # buat varian untuk gambar lama yang belum punya
+"""
+
+import hashlib
+import io
+import logging
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app, has_app_context, url_for
+from markupsafe import Markup, escape
+from PIL import Image, ImageOps, features
+from sqlalchemy import and_, event, or_, update
+from models import db, Product, ProductImage, PLACEHOLDER_IMAGE
+from storage import private_folder, save_stream, upload_folder
+from uploads import IncomingUpload
+from utils import allowed_file
+
+logger = logging.getLogger(__name__)
+
+IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', 2))
+# Klaim 'processing' lebih tua dari ini milik proses yang sudah mati
+STALE_PROCESSING_SECONDS = 15 * 60
+JPEG_QUALITY = 85
+WEBP_QUALITY = 80
+AVIF_QUALITY = 60
+ORIGINALS_FOLDER = 'originals'
+
+# Format varian -> (format Pillow, opsi save, MIME type), urutan = preferensi di <picture>
+FORMATS = {
+    'avif': ('AVIF', {'quality': AVIF_QUALITY, 'speed': 8}, 'image/avif'),
+    'webp': ('WEBP', {'quality': WEBP_QUALITY, 'method': 4}, 'image/webp'),
+    'jpg': ('JPEG', {'quality': JPEG_QUALITY, 'optimize': True, 'progressive': True}, 'image/jpeg'),
+}
+
+
+def available_formats():
+    """Variant formats this Pillow build can write; JPEG is always included"""
+    return [fmt for fmt in FORMATS if fmt == 'jpg' or features.check(fmt)]
+
+
+def products_folder(app=None):
+    return os.path.join(upload_folder(app), 'products')
+
+
+def originals_folder(app=None):
+    return os.path.join(private_folder(app), ORIGINALS_FOLDER)
+
+
+def original_path(filename, app=None):
+    """Where the raw upload for a ProductImage filename is kept until processed"""
+    stem = os.path.splitext(filename)[0]
+    path = os.path.join(originals_folder(app), f"{stem}.upload")
+    legacy_path = os.path.join(products_folder(app), ORIGINALS_FOLDER, f"{stem}.upload")
+    # Upload lama yang belum diproses masih di static/uploads/products/originals
+    if not os.path.exists(path) and os.path.exists(legacy_path):
+        return legacy_path
+    return path
+
+
+def store_upload(file):
+    """Save the raw upload without decoding it; return the final .jpg filename
+
+    Only the bytes are written here so the request returns immediately.
+    Resizing happens in the pipeline once the ProductImage row is committed.
+    The filename is the sha256 of the upload, so the same photo uploaded
+    again maps to the same files (see storage.py).
+    """
+    if not (file and allowed_file(file.filename)):
+        return None
+
+    folder = originals_folder()
+    if isinstance(file.stream, IncomingUpload):
+        # Sudah di disk dan sudah di-hash saat request di-parse (uploads.py): cukup rename
+        if not file.stream.is_image:
+            return None
+        content_hash = file.stream.keep(folder, '.upload')
+    else:
+        content_hash = save_stream(file.stream, folder, '.upload')
+    return f"{content_hash}.jpg"
+
+
+# ---------------------------------------------------------------------------
+# Processing
+# ---------------------------------------------------------------------------
+
+def _to_rgb(image):
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        # Latar putih untuk gambar transparan (JPEG tidak punya alpha)
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image.convert('RGBA'), mask=image.convert('RGBA').split()[-1])
+        return background
+    return image.convert('RGB')
+
+
+def _save_atomic(image, path, fmt, options):
+    # Nama temp unik: dua job bisa merender konten yang sama bersamaan
+    tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        image.save(tmp_path, fmt, **options)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def render_variants(source_path, filename, folder):
+    """Write the full-size JPEG and the content-addressed responsive variants
+
+    Returns (content_hash, full width, full height, formats) for the
+    ProductImage row. Variants already on disk for the same content are
+    reused instead of being rendered again.
+    """
+    with open(source_path, 'rb') as f:
+        data = f.read()
+    content_hash = hashlib.sha256(data).hexdigest()
+
+    with Image.open(io.BytesIO(data)) as opened:
+        image = _to_rgb(opened)
+    size = ProductImage.FULL_SIZE
+    image.thumbnail((size, size), Image.Resampling.LANCZOS)
+
+    full_path = os.path.join(folder, filename)
+    os.makedirs(folder, exist_ok=True)
+    if os.path.abspath(full_path) != os.path.abspath(source_path):  # backfill: sumbernya file full itu sendiri
+        _save_atomic(image, full_path, *FORMATS['jpg'][:2])
+
+    formats = available_formats()
+    widths = ProductImage.widths_for(image.width)
+    targets = [(width, fmt, os.path.join(folder, ProductImage.variant_path(content_hash, width, fmt)))
+               for width in widths for fmt in formats]
+    missing = [target for target in targets if not os.path.exists(target[2])]
+    if missing:
+        os.makedirs(os.path.dirname(targets[0][2]), exist_ok=True)
+
+    # Dari lebar terbesar ke terkecil: resize berikutnya mulai dari hasil sebelumnya
+    resized = image
+    for width in sorted({width for width, _, _ in missing}, reverse=True):
+        if width != resized.width:
+            resized = resized.resize((width, max(1, round(resized.height * width / resized.width))),
+                                     Image.Resampling.LANCZOS)
+        for _, fmt, path in (target for target in missing if target[0] == width):
+            pil_format, options, _ = FORMATS[fmt]
+            _save_atomic(resized, path, pil_format, options)
+
+    return content_hash, image.width, image.height, ','.join(formats)
+
+
+def process_image(image_id, app=None):
+    """Render the variants of one ProductImage and mark it ready (or failed)
+
+    Must run inside an app context. Only a 'pending' row is processed; it
+    is claimed with a conditional UPDATE first, so the after-commit
+    pipeline and the CLI never render the same image at the same time.
+    Returns None when another process claimed it first.
+    """
+    claimed = db.session.query(ProductImage).filter_by(id=image_id, status='pending').update(
+        {'status': 'processing', 'processing_started_at': datetime.utcnow()}, synchronize_session=False
+    )
+    db.session.commit()
+    if not claimed:
+        return None
+    image = db.session.get(ProductImage, image_id)
+
+    source = original_path(image.filename, app)
+    try:
+        if not _reuse_processed(image, app):
+            image.content_hash, image.width, image.height, image.variant_formats = \
+                render_variants(source, image.filename, products_folder(app))
+    except Exception as e:
+        db.session.rollback()
+        image.status = 'failed'
+        db.session.commit()
+        logger.error(f"Error processing product image {image_id}: {e}")
+        return False
+
+    image.status = 'ready'
+    db.session.commit()
+
+    # File mentah bisa dipakai bersama upload lain yang isinya sama dan belum diproses
+    still_needed = db.session.query(ProductImage.id).filter(
+        ProductImage.filename == image.filename,
+        ProductImage.status != 'ready'
+    ).first()
+    if still_needed is None and os.path.exists(source):
+        os.remove(source)
+    return True
+
+
+def _reuse_processed(image, app=None):
+    """Copy the variant metadata of a ready image with the same content
+
+    Returns False when there is none (or its files are gone) and the image
+    has to be rendered.
+    """
+    twin = ProductImage.query.filter(
+        ProductImage.filename == image.filename,
+        ProductImage.status == 'ready',
+        ProductImage.content_hash.isnot(None),
+        ProductImage.id != image.id
+    ).first()
+    if twin is None or not os.path.exists(os.path.join(products_folder(app), twin.filename)):
+        return False
+    image.content_hash, image.width, image.height, image.variant_formats = \
+        twin.content_hash, twin.width, twin.height, twin.variant_formats
+    return True
+
+
+class ImagePipeline:
+    """Interface for image pipelines"""
+
+    def submit(self, image_id):
+        raise NotImplementedError
+
+
+class ThreadPoolImagePipeline(ImagePipeline):
+    """Process images on a small thread pool inside the web process"""
+
+    def __init__(self, app, max_workers=IMAGE_WORKERS):
+        self.app = app
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='images')
+
+    def submit(self, image_id):
+        return self.executor.submit(self._run, image_id)
+
+    def _run(self, image_id):
+        with self.app.app_context():
+            try:
+                return process_image(image_id, self.app)
+            except Exception as e:
+                logger.error(f"Image pipeline job {image_id} crashed: {e}")
+                return False
+
+
+def init_images(app, pipeline=None):
+    """Attach an image pipeline, submit new pending images after commit and
+    register the product_picture / image_srcset template globals"""
+    app.extensions['images'] = pipeline or ThreadPoolImagePipeline(app)
+    app.add_template_global(product_picture)
+    app.add_template_global(image_srcset)
+
+    if not event.contains(db.session, 'after_flush', _collect_pending_images):
+        event.listen(db.session, 'after_flush', _collect_pending_images)
+        event.listen(db.session, 'after_commit', _submit_pending_images)
+        event.listen(db.session, 'after_rollback', _discard_pending_images)
+
+
+def get_pipeline():
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('images')
+
+
+def _collect_pending_images(session, flush_context):
+    pending = [obj for obj in session.new if isinstance(obj, ProductImage) and obj.status == 'pending']
+    if pending:
+        session.info.setdefault('images_pending', []).extend(obj.id for obj in pending)
+
+
+def _submit_pending_images(session):
+    image_ids = session.info.pop('images_pending', None)
+    pipeline = get_pipeline()
+    if not image_ids or pipeline is None:
+        return
+    for image_id in image_ids:
+        try:
+            pipeline.submit(image_id)
+        except Exception as e:
+            # Row sudah tersimpan; tetap 'pending' dan bisa diproses ulang lewat CLI
+            logger.error(f"Could not submit product image {image_id}: {e}")
+
+
+def _discard_pending_images(session):
+    session.info.pop('images_pending', None)
+
+
+# ---------------------------------------------------------------------------
+# Templates
+# ---------------------------------------------------------------------------
+
+def _static_url(path):
+    return url_for('static', filename=f"uploads/products/{path}")
+
+
+def image_srcset(image, fmt='jpg'):
+    """srcset attribute value ('url 160w, url 320w, ...') or '' without variants"""
+    variants = image.get_variants().get(fmt, []) if image is not None else []
+    return ', '.join(f"{_static_url(path)} {width}w" for width, path in variants)
+
+
+def product_picture(item, sizes, alt='', css_class='', loading='lazy'):
+    """<picture> for a Product's main image or a ProductImage
+
+    One <source> per modern format plus an <img> with the JPEG srcset and
+    the full-size file as src, so browsers download only the width that
+    `sizes` asks for. Images without variants (still processing, or
+    uploaded before the pipeline) fall back to a plain <img>.
+    """
+    image = item.get_main_product_image() if isinstance(item, Product) else item
+    attrs = f'class="{escape(css_class)}" alt="{escape(alt)}" loading="{escape(loading)}" decoding="async"'
+    variants = image.get_variants() if image is not None else {}
+
+    if not variants:
+        filename = image.get_filename() if image is not None else PLACEHOLDER_IMAGE
+        return Markup(f'<img src="{escape(_static_url(filename))}" {attrs}>')
+
+    sources = [
+        f'<source type="{FORMATS[fmt][2]}" srcset="{escape(image_srcset(image, fmt))}" sizes="{escape(sizes)}">'
+        for fmt in variants if fmt != 'jpg'
+    ]
+    img = (f'<img src="{escape(_static_url(image.filename))}" srcset="{escape(image_srcset(image, "jpg"))}" '
+           f'sizes="{escape(sizes)}" width="{image.width}" height="{image.height}" {attrs}>')
+    return Markup('<picture>' + ''.join(sources) + img + '</picture>')
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def reprocess(include_failed=True, force=False):
+    """Process pending images, stale claims and (optionally) failed images
+
+    A 'processing' row is only taken back when its claim is older than
+    STALE_PROCESSING_SECONDS (the process that claimed it died), or with
+    force=True. Rows are put back to 'pending' with a conditional UPDATE
+    and then claimed by process_image() like any upload, so an image a
+    web worker is rendering right now is skipped, not rendered twice.
+    Returns the number of images processed.
+    """
+    table = ProductImage.__table__
+    reclaim = [table.c.status == 'processing']
+    if not force:
+        cutoff = datetime.utcnow() - timedelta(seconds=STALE_PROCESSING_SECONDS)
+        reclaim.append(or_(table.c.processing_started_at.is_(None), table.c.processing_started_at < cutoff))
+    retry = [and_(*reclaim)] + ([table.c.status == 'failed'] if include_failed else [])
+    image_ids = [image_id for (image_id,) in db.session.query(ProductImage.id).filter(
+        or_(ProductImage.status == 'pending', *retry)
+    ).order_by(ProductImage.id)]
+
+    count = 0
+    for image_id in image_ids:
+        db.session.execute(update(table).where(table.c.id == image_id, or_(*retry)).values(status='pending'))
+        db.session.commit()
+        ok = process_image(image_id)
+        if ok is None:
+            logger.info(f"SKIP image {image_id} (claimed by another process)")
+            continue
+        count += 1
+        logger.info(f"{'OK  ' if ok else 'FAIL'} image {image_id}")
+    return count
+
+
+def backfill():
+    """Render variants for ready images that have none yet (older uploads)
+
+    The stored full-size file is the source; it is not re-encoded.
+    """
+    folder = products_folder()
+    image_ids = [image_id for (image_id,) in db.session.query(ProductImage.id).filter(
+        ProductImage.status == 'ready', ProductImage.content_hash.is_(None)
+    )]
+    count = 0
+    for image_id in image_ids:
+        image = db.session.get(ProductImage, image_id)
+        source = os.path.join(folder, image.filename)
+        if not os.path.exists(source):
+            continue
+        try:
+            image.content_hash, image.width, image.height, image.variant_formats = \
+                render_variants(source, image.filename, folder)
+            db.session.commit()
+            count += 1
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error backfilling image {image_id}: {e}")
+    return count
+
+
+if __name__ == '__main__':
+    import argparse
+    from app import app
+
+    parser = argparse.ArgumentParser(description='BarterHub product image pipeline')
+    parser.add_argument('--backfill', action='store_true', help='Create variants for existing images')
+    parser.add_argument('--force', action='store_true',
+                        help="Also take back images claimed less than STALE_PROCESSING_SECONDS ago")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    with app.app_context():
+        if args.backfill:
+            logger.info(f"Backfilled {backfill()} images")
+        else:
+            logger.info(f"Reprocessed {reprocess(force=args.force)} images")
@@ -0,0 +1,159 @@
+"""
+Agregasi inbox chat untuk floating chat dan /chat/rooms
+
+Semua room milik user beserta unread count, aktivitas 5 menit terakhir dan
+preview pesan terakhir diambil dalam satu statement SQL (subquery GROUP BY
+room_id), bukan tiga query per room seperti sebelumnya.
+"""
+
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_, case, func
+from sqlalchemy.orm import aliased
+from models import db, User, Product, ChatRoom, ChatMessage
+
+RECENT_ACTIVITY_WINDOW = timedelta(minutes=5)
+PREVIEW_LENGTH = 50
+PRODUCT_NAME_LENGTH = 30
+
+
+def last_read_id_expr(user_id):
+    """SQL expression for the user's read watermark on ChatRoom"""
+    return case((ChatRoom.user1_id == user_id, ChatRoom.user1_last_read_id), else_=ChatRoom.user2_last_read_id)
+
+
+def unread_filter(user_id):
+    """Messages from the other participant above the user's watermark"""
+    return and_(ChatMessage.sender_id != user_id, ChatMessage.id > last_read_id_expr(user_id))
+
+
+def _room_stats_subquery(user_id, recent_since):
+    """Per-room message aggregates, restricted to the user's own rooms"""
+    from_other = ChatMessage.sender_id != user_id
+
+    return db.session.query(
+        ChatMessage.room_id.label('room_id'),
+        func.sum(case((unread_filter(user_id), 1), else_=0)).label('unread_count'),
+        func.sum(case((and_(from_other, ChatMessage.created_at >= recent_since), 1), else_=0)).label('recent_count'),
+        func.max(ChatMessage.id).label('last_message_id')
+    ).join(
+        ChatRoom, ChatRoom.id == ChatMessage.room_id
+    ).filter(
+        or_(ChatRoom.user1_id == user_id, ChatRoom.user2_id == user_id)
+    ).group_by(ChatMessage.room_id).subquery()
+
+
+def inbox_query(user_id, now=None):
+    """Build the single inbox query for a user.
+
+    Each row carries the room, the other participant, the product owner and
+    the aggregated counters plus the last message joined by its id.
+    """
+    now = now or datetime.utcnow()
+    stats = _room_stats_subquery(user_id, now - RECENT_ACTIVITY_WINDOW)
+    other_user = aliased(User)
+    last_message = aliased(ChatMessage)
+
+    return db.session.query(
+        ChatRoom.id,
+        ChatRoom.product_id,
+        Product.title,
+        Product.user_id,
+        other_user,
+        func.coalesce(stats.c.unread_count, 0),
+        func.coalesce(stats.c.recent_count, 0),
+        last_message.message,
+        last_message.created_at
+    ).join(
+        Product, Product.id == ChatRoom.product_id
+    ).join(
+        other_user,
+        other_user.id == case((ChatRoom.user1_id == user_id, ChatRoom.user2_id), else_=ChatRoom.user1_id)
+    ).outerjoin(
+        stats, stats.c.room_id == ChatRoom.id
+    ).outerjoin(
+        last_message, last_message.id == stats.c.last_message_id
+    ).filter(
+        or_(ChatRoom.user1_id == user_id, ChatRoom.user2_id == user_id),
+        Product.is_available == True
+    ).order_by(
+        # Room dengan pesan terbaru di atas, room tanpa pesan di bawah
+        case((stats.c.last_message_id.is_(None), 1), else_=0),
+        stats.c.last_message_id.desc(),
+        ChatRoom.created_at.desc()
+    )
+
+
+def _truncate(text, length):
+    return text[:length - 3] + '...' if len(text) > length else text
+
+
+def get_inbox(user_id, now=None):
+    """Return the inbox payload used by /chat/rooms.
+
+    Keys match the previous per-room implementation so floating-chat.js and
+    base.html keep working unchanged.
+    """
+    rooms_data = []
+    total_unread = 0
+    has_new_messages = False
+
+    for (room_id, product_id, product_title, product_owner_id, other_user,
+         unread_count, recent_count, last_text, last_created_at) in inbox_query(user_id, now):
+        unread_count = int(unread_count)
+        has_recent_activity = int(recent_count) > 0
+        total_unread += unread_count
+        has_new_messages = has_new_messages or has_recent_activity
+
+        is_product_owner = product_owner_id == user_id
+
+        rooms_data.append({
+            'id': room_id,
+            'product_id': product_id,
+            'product_name': product_title[:PRODUCT_NAME_LENGTH] + ('...' if len(product_title) > PRODUCT_NAME_LENGTH else ''),
+            'other_user': other_user.full_name,
+            'other_user_profile_picture': other_user.get_profile_picture(),
+            'unread_count': unread_count,
+            'last_message': _truncate(last_text, PREVIEW_LENGTH) if last_text else 'Belum ada pesan',
+            'last_message_time': last_created_at.strftime('%H:%M') if last_created_at else '',
+            'last_message_date': last_created_at.strftime('%d/%m') if last_created_at else '',
+            'status': 'active',
+            'has_recent_activity': has_recent_activity,
+            'chat_role': 'seller' if is_product_owner else 'buyer',
+            'is_product_owner': is_product_owner
+        })
+
+    return {
+        'rooms': rooms_data,
+        'total_unread': total_unread,
+        'has_new_messages': has_new_messages
+    }
+
+
+def count_unread(user_id):
+    """Total unread messages for a user across all of their rooms"""
+    return db.session.query(func.count(ChatMessage.id)).join(
+        ChatRoom, ChatRoom.id == ChatMessage.room_id
+    ).filter(
+        or_(ChatRoom.user1_id == user_id, ChatRoom.user2_id == user_id),
+        unread_filter(user_id)
+    ).scalar()
+
+
+def unread_counts_by_room(user_id):
+    """Map of room_id -> unread count, only for rooms with unread messages"""
+    rows = db.session.query(ChatMessage.room_id, func.count(ChatMessage.id)).join(
+        ChatRoom, ChatRoom.id == ChatMessage.room_id
+    ).filter(
+        or_(ChatRoom.user1_id == user_id, ChatRoom.user2_id == user_id),
+        unread_filter(user_id)
+    ).group_by(ChatMessage.room_id).all()
+    return {room_id: count for room_id, count in rows}
+
+
+def latest_message_time(user_id):
+    """Timestamp of the newest message in any of the user's rooms"""
+    return db.session.query(func.max(ChatMessage.created_at)).join(
+        ChatRoom, ChatRoom.id == ChatMessage.room_id
+    ).filter(
+        or_(ChatRoom.user1_id == user_id, ChatRoom.user2_id == user_id)
+    ).scalar()
@@ -0,0 +1,42 @@
+"""
+Eager-loading profile untuk halaman listing
+
+Setiap profile berisi loader options untuk satu view, sesuai relasi yang
+dipakai template-nya (product.owner, product.category, transaction.seller,
+dst). Tanpa ini setiap baris memicu lazy load sendiri (N+1 query).
+
+Relasi many-to-one memakai joinedload: ikut di query listing yang sama dan
+tidak menggandakan baris, jadi LIMIT / keyset pagination tetap benar.
+Gambar utama produk tetap lewat Product.preload_main_images karena
+Product.images adalah relasi dynamic.
+
+Jumlah statement per halaman dicek oleh `python benchmark.py listings`.
+"""
+
+from sqlalchemy.orm import configure_mappers, contains_eager, joinedload
+from models import Product, Transaction, Wishlist
+
+# Product.owner, Transaction.seller, dll. adalah backref: baru ada setelah mapper dikonfigurasi
+configure_mappers()
+
+# Kartu produk: index.html, products/list.html, admin/products.html, detail related
+PRODUCT_CARD = (
+    joinedload(Product.owner),
+    joinedload(Product.category),
+)
+
+# Baris transaksi: profile.html, transactions/list.html, admin/transactions.html
+TRANSACTION_ROW = (
+    joinedload(Transaction.product).joinedload(Product.category),
+    joinedload(Transaction.seller),
+    joinedload(Transaction.buyer),
+)
+
+# wishlist.html: kartu produk lewat wishlist_item.product. Query wishlist
+# sudah JOIN products untuk filter is_available, jadi join itu yang dipakai.
+WISHLIST_ROW = (
+    contains_eager(Wishlist.product).options(
+        joinedload(Product.owner),
+        joinedload(Product.category),
+    ),
+)
@@ -1,6 +1,4 @@
-import os
 from datetime import datetime
-from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -8,6 +6,9 @@ from werkzeug.security import generate_password_hash, check_password_hash
 # Create a db instance that will be initialized later
 db = SQLAlchemy()
 
+# Ditampilkan untuk produk tanpa foto dan foto yang belum selesai diproses
+PLACEHOLDER_IMAGE = 'default-product.jpg'
+
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
 
@@ -32,12 +33,15 @@ class User(UserMixin, db.Model):
 
     # Relationships
     products = db.relationship('Product', backref='owner', lazy='dynamic', foreign_keys='Product.user_id')
-    sent_messages = db.relationship('ChatMessage', foreign_keys='ChatMessage.sender_id', lazy='dynamic')
+    sent_messages = db.relationship('ChatMessage', foreign_keys='ChatMessage.sender_id', back_populates='sender', lazy='dynamic')
     transactions_as_seller = db.relationship('Transaction', foreign_keys='Transaction.seller_id', backref='seller', lazy='dynamic')
     transactions_as_buyer = db.relationship('Transaction', foreign_keys='Transaction.buyer_id', backref='buyer', lazy='dynamic')
     reports_made = db.relationship('Report', foreign_keys='Report.reporter_id', backref='reporter', lazy='dynamic')
     reports_received = db.relationship('Report', foreign_keys='Report.reported_user_id', backref='reported_user', lazy='dynamic')
 
+    # Keyset pagination admin (created_at, id)
+    __table_args__ = (db.Index('idx_users_created_at_id', 'created_at', 'id'),)
+
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
 
@@ -106,12 +110,8 @@ class User(UserMixin, db.Model):
 
     def set_profile_picture(self, filename):
         """Set profile picture filename"""
-        # Delete old profile picture if exists
-        if self.profile_picture:
-            old_path = os.path.join(current_app.static_folder, 'uploads', 'profiles', self.profile_picture)
-            if os.path.exists(old_path):
-                os.remove(old_path)
-
+        # File lama tidak dihapus di sini: bisa dipakai user lain (content-addressed),
+        # file tanpa referensi dibersihkan oleh storage.collect_garbage()
         self.profile_picture = filename
 
 
@@ -146,6 +146,7 @@ class Product(db.Model):
 
     # Calculated points
     total_points = db.Column(db.Integer, default=0)
+    points_version = db.Column(db.Integer)  # Versi scoring.RULES yang menghitung total_points
 
     is_available = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -155,42 +156,125 @@ class Product(db.Model):
     images = db.relationship('ProductImage', backref='product', lazy='dynamic', cascade='all, delete-orphan')
     offers_received = db.relationship('TransactionOffer', backref='product', lazy='dynamic')
 
+    # Listing terbaru, keyset pagination admin dan pencarian produk sekategori berdasarkan poin
+    __table_args__ = (
+        db.Index('idx_products_is_available_created_at', 'is_available', 'created_at'),
+        db.Index('idx_products_created_at_id', 'created_at', 'id'),
+        db.Index('idx_products_category_id_total_points', 'category_id', 'total_points'),
+    )
+
     def calculate_points(self):
-        """Calculate total points based on various factors"""
-        # Base calculation
-        base_score = (self.utility_score + self.scarcity_score + self.durability_score + 
-                     self.portability_score + self.seasonal_score) / 5
-
-        # Condition multiplier
-        condition_multipliers = {
-            'New': 1.0,
-            'Like New': 0.9,
-            'Good': 0.8,
-            'Fair': 0.6,
-            'Poor': 0.4
-        }
-
-        condition_multiplier = condition_multipliers.get(self.condition, 0.8)
-        self.total_points = int(base_score * condition_multiplier * 10)  # Scale to reasonable range
+        """Calculate total points based on various factors (scoring.RULES, latest version)"""
+        from scoring import compute_points, get_rules
 
+        rules = get_rules()
+        self.total_points = compute_points(self, rules)
+        self.points_version = rules.version
         return self.total_points
 
+    def get_main_product_image(self):
+        """Main ProductImage row or None (memoized per instance)"""
+        if '_main_product_image' not in self.__dict__:
+            image = self.images.filter_by(is_main=True).first()
+            if not image:
+                image = self.images.order_by(ProductImage.id).first()
+            self._main_product_image = image
+        return self._main_product_image
+
     def get_main_image(self):
-        """Get the main product image"""
-        image = self.images.filter_by(is_main=True).first()
-        if not image:
-            image = self.images.first()
-        return image.filename if image else 'default-product.jpg'
+        """Get the main product image filename"""
+        image = self.get_main_product_image()
+        return image.get_filename() if image else PLACEHOLDER_IMAGE
+
+    @classmethod
+    def preload_main_images(cls, products):
+        """Resolve get_main_product_image() for a whole page of products with one query
+
+        Main image first, otherwise the oldest image, same as get_main_product_image().
+        Returns the products so it can wrap a query result inline.
+        """
+        pending = {p.id: p for p in products if p is not None and '_main_product_image' not in p.__dict__}
+        if pending:
+            images = ProductImage.query.filter(
+                ProductImage.product_id.in_(pending)
+            ).order_by(
+                ProductImage.product_id,
+                db.case((ProductImage.is_main == True, 0), else_=1),
+                ProductImage.id
+            ).all()
+
+            main_images = {}
+            for image in images:
+                main_images.setdefault(image.product_id, image)
+
+            for product_id, product in pending.items():
+                product._main_product_image = main_images.get(product_id)
+        return products
 
 class ProductImage(db.Model):
     __tablename__ = 'product_images'
+    # filename = sha256 isi upload: cari gambar lain dengan file yang sama (images.py)
+    __table_args__ = (db.Index('idx_product_images_filename', 'filename'),)
 
     id = db.Column(db.Integer, primary_key=True)
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
     filename = db.Column(db.String(255), nullable=False)
     is_main = db.Column(db.Boolean, default=False)
+    # pending -> processing -> ready / failed, diproses di background oleh images.py
+    status = db.Column(db.String(20), nullable=False, default='ready', server_default='ready')
+    # Kapan status menjadi 'processing': klaim yang sudah lama dianggap mati (images.reprocess)
+    processing_started_at = db.Column(db.DateTime)
+    # Diisi pipeline: sha256 sumber, ukuran versi full dan format varian yang dibuat
+    content_hash = db.Column(db.String(64))
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    variant_formats = db.Column(db.String(50))  # mis. 'avif,webp,jpg'
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # Versi full (filename) dibatasi FULL_SIZE x FULL_SIZE; varian responsive per lebar
+    FULL_SIZE = 800
+    WIDTHS = (160, 320, 480, 640, 800)
+    VARIANTS_FOLDER = 'variants'
+
+    @classmethod
+    def variant_path(cls, content_hash, width, fmt):
+        """Content-addressed path under uploads/products: variants/ab/abcd.../320.webp"""
+        return f"{cls.VARIANTS_FOLDER}/{content_hash[:2]}/{content_hash}/{width}.{fmt}"
+
+    @classmethod
+    def widths_for(cls, full_width):
+        """Variant widths rendered for an image whose full version is full_width wide"""
+        return [w for w in cls.WIDTHS if w < full_width] + [full_width]
+
+    def is_ready(self):
+        return self.status == 'ready'
+
+    def get_filename(self):
+        """Full-size filename, or the placeholder while the image is still processing"""
+        if not self.is_ready():
+            return PLACEHOLDER_IMAGE
+        return self.filename
+
+    def get_variants(self):
+        """{fmt: [(width, path), ...]} for ready images with responsive variants"""
+        if not (self.is_ready() and self.content_hash and self.width and self.variant_formats):
+            return {}
+        widths = self.widths_for(self.width)
+        return {fmt: [(w, self.variant_path(self.content_hash, w, fmt)) for w in widths]
+                for fmt in self.variant_formats.split(',')}
+
+class SimilarProduct(db.Model):
+    """Precomputed related products of one product, best match first (similar.py)"""
+    __tablename__ = 'similar_products'
+
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True)
+    # Tanpa foreign key: daftar yang memuat produk yang dihapus masih bisa dicari lalu dihitung ulang
+    similar_id = db.Column(db.Integer, nullable=False)
+
+    # Daftar mana saja yang memuat produk tertentu (refresh saat produk itu berubah)
+    __table_args__ = (db.Index('idx_similar_products_similar_id', 'similar_id'),)
+
 class ChatRoom(db.Model):
     __tablename__ = 'chat_rooms'
 
@@ -201,12 +285,40 @@ class ChatRoom(db.Model):
     status = db.Column(db.String(20), default='active')  # active, closed, negotiating
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # Read watermark per participant: semua pesan dengan id <= nilai ini sudah dibaca
+    user1_last_read_id = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    user2_last_read_id = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
     # Relationships
     user1 = db.relationship('User', foreign_keys=[user1_id])
     user2 = db.relationship('User', foreign_keys=[user2_id])
     product = db.relationship('Product')
     messages = db.relationship('ChatMessage', backref='room', lazy='dynamic', cascade='all, delete-orphan')
 
+    # Inbox lookups filter on either participant
+    __table_args__ = (
+        db.Index('idx_chat_rooms_user1_id', 'user1_id'),
+        db.Index('idx_chat_rooms_user2_id', 'user2_id'),
+    )
+
+    def last_read_id(self, user_id):
+        """Get the read watermark of a participant"""
+        return self.user1_last_read_id if user_id == self.user1_id else self.user2_last_read_id
+
+    def mark_read(self, user_id, message_id):
+        """Raise the read watermark of a participant with a single UPDATE
+
+        The watermark only moves forward, so paging back through history never
+        marks newer messages as unread again. Returns True if it moved.
+        """
+        column = ChatRoom.user1_last_read_id if user_id == self.user1_id else ChatRoom.user2_last_read_id
+        result = db.session.execute(
+            db.update(ChatRoom)
+            .where(ChatRoom.id == self.id, column < message_id)
+            .values({column: message_id})
+        )
+        return result.rowcount > 0
+
 class ChatMessage(db.Model):
     __tablename__ = 'chat_messages'
 
@@ -244,11 +356,14 @@ class ChatMessage(db.Model):
         return []
 
     # Relationship to User
-    sender = db.relationship('User', foreign_keys=[sender_id])
+    sender = db.relationship('User', foreign_keys=[sender_id], back_populates='sent_messages')
 
     def __repr__(self):
         return f'<ChatMessage {self.id}: {self.message[:50]}>'
 
+    # Cursor pagination per room (messages_direct since_id / before_id)
+    __table_args__ = (db.Index('idx_chat_messages_room_id_id', 'room_id', 'id'),)
+
 class Transaction(db.Model):
     __tablename__ = 'transactions'
 
@@ -294,6 +409,13 @@ class Transaction(db.Model):
     product = db.relationship('Product')
     offers = db.relationship('TransactionOffer', backref='transaction', lazy='dynamic', cascade='all, delete-orphan')
 
+    # Daftar transaksi per penjual / pembeli dan keyset pagination admin
+    __table_args__ = (
+        db.Index('idx_transactions_seller_id', 'seller_id'),
+        db.Index('idx_transactions_buyer_id_created_at', 'buyer_id', 'created_at'),
+        db.Index('idx_transactions_created_at_id', 'created_at', 'id'),
+    )
+
     def can_proceed_to_shipping(self):
         """Check if both parties agreed in chat and have complete addresses"""
         return (self.chat_agreement_seller and 
@@ -374,6 +496,9 @@ class Report(db.Model):
     transaction = db.relationship('Transaction', backref='reports')
     resolver = db.relationship('User', foreign_keys=[resolved_by], backref='resolved_reports')
 
+    # Keyset pagination admin (created_at, id)
+    __table_args__ = (db.Index('idx_reports_created_at_id', 'created_at', 'id'),)
+
 class Review(db.Model):
     __tablename__ = 'reviews'
 
@@ -410,4 +535,21 @@ class Wishlist(db.Model):
     product = db.relationship('Product', backref='wishlisted_by')
 
     # Unique constraint to prevent duplicate wishlist items
-    __table_args__ = (db.UniqueConstraint('user_id', 'product_id', name='unique_user_product_wishlist'),)
\ No newline at end of file
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'product_id', name='unique_user_product_wishlist'),
+        db.Index('idx_wishlists_user_id', 'user_id'),
+        db.Index('idx_wishlists_user_id_created_at', 'user_id', 'created_at'),
+        db.Index('idx_wishlists_product_id', 'product_id'),
+    )
+
+class IndexChange(db.Model):
+    """Change feed for the in-process indexes (changes.py): one row per changed object"""
+    __tablename__ = 'index_changes'
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # product (id produk), wishlist (id pemilik wishlist)
+    object_id = db.Column(db.Integer, nullable=False)
+    changed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    # Worker membaca perubahan sejak waktu tertentu
+    __table_args__ = (db.Index('idx_index_changes_changed_at', 'changed_at'),)
@@ -0,0 +1,50 @@
+"""
+Lookup produk dengan total_points terdekat ke suatu nilai
+
+Query lama mengurutkan seluruh kategori dengan ORDER BY
+abs(total_points - x); ekspresi itu tidak bisa memakai index, jadi setiap
+baris kategori dibaca dan diurutkan. nearest() memakai index
+idx_products_category_id_total_points dari titik x ke dua arah: satu range
+scan ke atas (total_points >= x, naik) dan satu ke bawah (total_points < x,
+turun), masing-masing berhenti setelah `limit` baris. Hasil kedua sisi
+digabung berdasarkan selisih poin, jadi yang dibaca paling banyak
+2 x limit baris berapapun ukuran tabelnya. Urutan hasilnya sama dengan
+ORDER BY abs(total_points - x), created_at DESC.
+
+Baris dengan poin sama diurutkan created_at DESC di dalam tiap level poin;
+PostgreSQL (incremental sort) dan SQLite (temp b-tree untuk sisi kanan
+ORDER BY) melakukannya per level, tetap berhenti begitu limit tercapai.
+
+Dipakai oleh similar.py (produk terkait). Tidak dipakai di:
+- calculate_point_balance (utils.py): hanya membandingkan dua angka yang
+  sudah dimuat, tidak ada lookup; graf barter (cycles.py) mencari rentang
+  toleransinya lewat balanced_range() di index memori;
+- suggest_matches (barter.py): setiap level skor sudah berupa range
+  (category_id, total_points) yang memakai index yang sama dan berhenti di
+  SUGGESTION_LIMIT. Urutannya per skor lalu id, bukan per selisih poin, jadi
+  nearest() akan mengubah saran yang muncul.
+
+    python benchmark.py nearest
+"""
+
+from datetime import datetime
+from models import Product
+
+
+def nearest(query, points, limit):
+    """Up to `limit` rows of `query` closest to `points`, newest first on ties
+
+    `query` should select Product columns (or Product) filtered on
+    category_id so both scans can use the (category_id, total_points)
+    index. Rows come back as returned by the query, best match first.
+    """
+    above = query.filter(Product.total_points >= points).order_by(
+        Product.total_points.asc(), Product.created_at.desc()
+    ).limit(limit).all()
+    below = query.filter(Product.total_points < points).order_by(
+        Product.total_points.desc(), Product.created_at.desc()
+    ).limit(limit).all()
+    rows = sorted(above + below, key=lambda row: row.created_at or datetime.min, reverse=True)
+    rows.sort(key=lambda row: abs(row.total_points - points))
+    return rows[:limit]
+
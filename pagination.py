@@ -0,0 +1,139 @@
+"""
+Keyset (cursor) pagination untuk daftar yang diurutkan dari yang terbaru
+
+.paginate() menjalankan COUNT(*) dan OFFSET scan, keduanya makin mahal di
+halaman yang makin dalam. Di sini halaman berikutnya/sebelumnya dicari lewat
+WHERE (created_at, id) < (cursor) dengan urutan (created_at DESC, id DESC),
+jadi setiap halaman cukup membaca per_page + 1 baris dari index.
+
+Cursor dikirim lewat query string ?after=<token> atau ?before=<token>.
+Token tidak rahasia (base64 dari JSON), nilai yang rusak dianggap halaman
+pertama.
+"""
+
+import base64
+import binascii
+import json
+from datetime import datetime
+from flask import request
+from sqlalchemy import tuple_
+
+CURSOR_ARGS = ('after', 'before')
+
+
+def encode_cursor(created_at, row_id):
+    raw = json.dumps([created_at.isoformat() if created_at else None, row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Return (created_at, id) or None when the token is missing or invalid"""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        created_at, row_id = json.loads(raw)
+        if created_at is None or not isinstance(row_id, int):
+            return None
+        return datetime.fromisoformat(created_at), row_id
+    except (ValueError, TypeError, binascii.Error):
+        return None
+
+
+def approximate_count(query):
+    """Row estimate from the PostgreSQL planner, exact COUNT(*) elsewhere"""
+    session = query.session
+    bind = session.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return query.order_by(None).count()
+
+    statement = query.order_by(None).enable_eagerloads(False).statement
+    compiled = statement.compile(dialect=bind.dialect)
+    plan = session.connection().exec_driver_sql(
+        f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params
+    ).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class KeysetPagination:
+    """Page of rows plus next/prev cursor tokens
+
+    Mirrors the parts of Flask-SQLAlchemy's Pagination the templates use
+    (items, has_next, has_prev, total, per_page). total is None unless the
+    view asked for a count; total_is_approximate tells templates to show
+    it as an estimate.
+    """
+
+    def __init__(self, items, per_page, next_cursor, prev_cursor, total=None, total_is_approximate=False):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+        self.total_is_approximate = total_is_approximate
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def keyset_paginate(query, model, per_page, after=None, before=None, count=None):
+    """Paginate `query` newest first by (model.created_at, model.id)
+
+    after/before are cursor tokens taken from the request; `count` is None
+    (no total), 'approximate' or 'exact'. Any ORDER BY already on the query
+    is replaced.
+    """
+    key = tuple_(model.created_at, model.id)
+    base = query.order_by(None)
+    after_key = decode_cursor(after)
+    before_key = decode_cursor(before) if after_key is None else None
+
+    if before_key is not None:
+        # Mundur: ambil baris yang lebih baru dari cursor, lalu balik urutannya
+        rows = base.filter(key > tuple_(*before_key)).order_by(
+            model.created_at.asc(), model.id.asc()
+        ).limit(per_page + 1).all()
+        more_before = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        has_prev, has_next = more_before, True
+    else:
+        filtered = base.filter(key < tuple_(*after_key)) if after_key is not None else base
+        rows = filtered.order_by(model.created_at.desc(), model.id.desc()).limit(per_page + 1).all()
+        items = rows[:per_page]
+        has_prev, has_next = after_key is not None, len(rows) > per_page
+
+    if not items:
+        has_next = False
+        has_prev = after_key is not None or before_key is not None
+
+    def cursor_of(row):
+        return encode_cursor(row.created_at, row.id)
+
+    next_cursor = cursor_of(items[-1]) if has_next and items else None
+    prev_cursor = cursor_of(items[0]) if has_prev and items else None
+    if not items and has_prev:
+        # Cursor di luar data (mis. semua baris dihapus): tawarkan kembali ke awal
+        prev_cursor = ''
+
+    total = None
+    total_is_approximate = False
+    if count == 'exact':
+        total = base.count()
+    elif count == 'approximate':
+        total = approximate_count(base)
+        total_is_approximate = base.session.get_bind().dialect.name == 'postgresql'
+
+    return KeysetPagination(items, per_page, next_cursor, prev_cursor,
+                            total=total, total_is_approximate=total_is_approximate)
+
+
+def cursor_args():
+    """The after/before tokens from the current request"""
+    return {name: request.args.get(name) for name in CURSOR_ARGS}
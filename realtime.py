@@ -0,0 +1,238 @@
+"""
+Realtime push untuk chat (Server-Sent Events)
+
+Pesan chat baru, perubahan status penawaran dan jumlah pesan belum dibaca
+dikirim ke participant yang sedang terhubung lewat /chat/stream, sehingga
+floating chat tidak perlu polling tiap beberapa detik.
+
+Broker bersifat pluggable. Default-nya InProcessBroker (antrian per koneksi
+di memori proses), cukup untuk satu proses / development dan bisa dites tanpa
+service luar. Deployment multi-worker bisa memberikan broker lain lewat
+init_realtime(app, broker=...) selama mengikuti interface Broker.
+
+Event yang di-publish di satu worker hanya sampai ke stream yang dipegang
+worker itu bila brokernya tidak shared. Event 'ready' memberi tahu client
+hal itu, dan client tetap polling pelan (lihat floating-chat.js) selama
+brokernya tidak shared, jadi pesan dari worker lain paling lambat tertunda,
+tidak hilang.
+
+Catatan deployment: setiap koneksi SSE menahan satu worker/thread selama
+terbuka, jadi jalankan gunicorn dengan worker gthread atau gevent.
+"""
+
+import json
+import logging
+import queue
+import threading
+from collections import defaultdict
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect
+from models import db, User, ChatRoom, ChatMessage
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_SECONDS = 20
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class Broker:
+    """Interface for realtime brokers
+
+    shared is True when an event published in any worker reaches the
+    subscriptions of every worker (e.g. Redis pub/sub).
+    """
+
+    shared = False
+
+    def subscribe(self, user_id):
+        """Return a subscription with get(timeout) and close()"""
+        raise NotImplementedError
+
+    def publish(self, user_id, event_name, data):
+        """Deliver an event to every subscription of user_id"""
+        raise NotImplementedError
+
+
+class InProcessSubscription:
+    def __init__(self, broker, user_id):
+        self.broker = broker
+        self.user_id = user_id
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def get(self, timeout=None):
+        """Next (event_name, data) tuple, or None when the timeout expires"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker(Broker):
+    """Fan-out to subscriber queues held in this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+
+    def subscribe(self, user_id):
+        subscription = InProcessSubscription(self, user_id)
+        with self._lock:
+            self._subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def publish(self, user_id, event_name, data):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.queue.put_nowait((event_name, data))
+            except queue.Full:
+                # Client terlalu lambat, minta resync penuh daripada menumpuk event
+                logger.warning(f"Realtime queue full for user {user_id}, dropping event {event_name}")
+                self._request_resync(subscription)
+
+    def subscriber_count(self, user_id=None):
+        with self._lock:
+            if user_id is not None:
+                return len(self._subscriptions.get(user_id, ()))
+            return sum(len(subs) for subs in self._subscriptions.values())
+
+    def _request_resync(self, subscription):
+        try:
+            while True:
+                subscription.queue.get_nowait()
+        except queue.Empty:
+            pass
+        subscription.queue.put_nowait(('resync', {}))
+
+
+def init_realtime(app, broker=None):
+    """Attach a broker to the app and hook chat writes into it"""
+    app.extensions['realtime'] = broker or InProcessBroker()
+
+    if not event.contains(db.session, 'after_flush', _collect_chat_events):
+        event.listen(db.session, 'after_flush', _collect_chat_events)
+        event.listen(db.session, 'after_commit', _publish_pending_events)
+        event.listen(db.session, 'after_rollback', _discard_pending_events)
+
+
+def get_broker():
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('realtime')
+
+
+def publish(user_ids, event_name, data):
+    """Publish immediately (outside of any transaction) to several users"""
+    broker = get_broker()
+    if broker is None:
+        return
+    for user_id in set(user_ids):
+        broker.publish(user_id, event_name, data)
+
+
+def format_sse(event_name, data):
+    return f"event: {event_name}\ndata: {json.dumps(data)}\n\n"
+
+
+def stream_events(subscription, heartbeat=HEARTBEAT_SECONDS, shared=False):
+    """SSE body generator; never touches the database"""
+    try:
+        yield "retry: 5000\n\n"
+        # shared=False: client harus tetap polling pelan untuk event dari worker lain
+        yield format_sse('ready', {'user_id': subscription.user_id, 'shared': shared})
+        while True:
+            item = subscription.get(timeout=heartbeat)
+            if item is None:
+                yield ": keepalive\n\n"
+                continue
+            yield format_sse(*item)
+    finally:
+        subscription.close()
+
+
+def message_payload(message, sender_name):
+    """Same shape as the messages_direct API rows"""
+    return {
+        'id': message.id,
+        'room_id': message.room_id,
+        'sender_id': message.sender_id,
+        'sender_name': sender_name or 'Pengguna',
+        'message': message.message if message.message and message.message.strip() else 'Pesan tidak dapat ditampilkan',
+        'message_type': message.message_type or 'text',
+        'offer_status': message.offer_status,
+        'created_at': message.created_at.isoformat() if message.created_at else None
+    }
+
+
+def _pending(session):
+    return session.info.setdefault('realtime_pending', {'events': [], 'unread': {}})
+
+
+def _collect_chat_events(session, flush_context):
+    """after_flush: turn new messages / offer status changes into events
+
+    Events are only published after the transaction commits, so a rollback
+    never leaks a message that was not stored.
+    """
+    if get_broker() is None:
+        return
+
+    from inbox import count_unread
+
+    pending = _pending(session)
+    unread_users = set()
+
+    for obj in session.new:
+        if not isinstance(obj, ChatMessage):
+            continue
+        room = session.get(ChatRoom, obj.room_id)
+        if room is None:
+            continue
+        sender = session.get(User, obj.sender_id)
+        participants = (room.user1_id, room.user2_id)
+        pending['events'].append((participants, 'chat_message', {
+            'room_id': room.id,
+            'product_id': room.product_id,
+            'message': message_payload(obj, sender.full_name if sender else None)
+        }))
+        unread_users.update(user_id for user_id in participants if user_id != obj.sender_id)
+
+    for obj in session.dirty:
+        if not isinstance(obj, ChatMessage) or not inspect(obj).attrs.offer_status.history.has_changes():
+            continue
+        room = session.get(ChatRoom, obj.room_id)
+        if room is not None:
+            pending['events'].append(((room.user1_id, room.user2_id), 'offer_status', {
+                'room_id': room.id,
+                'message_id': obj.id,
+                'offer_status': obj.offer_status
+            }))
+
+    for user_id in unread_users:
+        pending['unread'][user_id] = count_unread(user_id)
+
+
+def _publish_pending_events(session):
+    pending = session.info.pop('realtime_pending', None)
+    if not pending:
+        return
+    for user_ids, event_name, data in pending['events']:
+        publish(user_ids, event_name, data)
+    for user_id, total_unread in pending['unread'].items():
+        publish([user_id], 'unread', {'total_unread': total_unread})
+
+
+def _discard_pending_events(session):
+    session.info.pop('realtime_pending', None)
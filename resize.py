@@ -0,0 +1,256 @@
+"""
+Resize gambar on-demand: /img/<source>/<filename>?w=&h=&fit=&fmt=
+
+Foto produk (uploads/products) dan foto profil (uploads/profiles) diperkecil
+saat pertama kali diminta. Hasilnya disimpan di cache disk
+(IMAGE_CACHE_FOLDER, default instance/image-cache) yang dibatasi
+IMAGE_CACHE_MAX_BYTES; entry yang paling lama tidak dipakai dihapus lebih
+dulu (LRU). Request berikutnya cukup mengirim file dari cache, dan browser
+yang sudah punya salinan mendapat 304 lewat ETag tanpa file dibuka.
+
+Dengan ini thumbnail kecil (tabel admin, riwayat transaksi, avatar) tidak
+butuh varian yang dibuat lebih dulu, termasuk untuk upload lama.
+
+Parameter:
+    w, h   batas lebar/tinggi, dibulatkan ke atas ke kelipatan SIZE_STEP dan
+           maksimal MAX_SIZE supaya jumlah varian per gambar tetap terbatas.
+           Gambar tidak pernah diperbesar.
+    fit    'contain' (default, muat di dalam w x h) atau 'cover' (crop tengah
+           ke rasio w:h, untuk thumbnail persegi).
+    fmt    'auto' (default, AVIF/WebP bila ada di header Accept), 'avif',
+           'webp' atau 'jpg'.
+
+Di template: {{ img_url(product.get_main_image(), w=100, h=100, fit='cover') }}
+"""
+
+import hashlib
+import io
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from flask import Blueprint, abort, current_app, request, send_file, url_for
+from PIL import Image, ImageOps
+from werkzeug.security import safe_join
+from images import FORMATS, available_formats, _to_rgb
+from models import ProductImage
+from storage import upload_folder
+
+logger = logging.getLogger(__name__)
+
+SOURCES = ('products', 'profiles')
+FITS = ('contain', 'cover')
+MAX_SIZE = 1600
+SIZE_STEP = 20
+CACHE_MAX_BYTES = int(os.environ.get('IMAGE_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+# Nama file upload adalah sha256 isinya (storage.py) dan varian disimpan per hash, jadi
+# isi di balik satu URL tidak pernah berubah (upload lama: nama uuid yang juga tidak ditimpa)
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Yang boleh dikirim: file di folder sumber itu sendiri atau varian (variants/...) bergambar;
+# file lain di bawahnya (mis. originals/*.upload lama yang masih membawa EXIF) tidak
+SERVED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.avif')
+
+img = Blueprint('img', __name__)
+
+
+class DiskLRUCache:
+    """Size-bounded directory of files, evicting the least recently used first
+
+    The in-memory index is rebuilt from the directory (oldest mtime first)
+    on first use, and hits bump the file's mtime so the order survives a
+    restart. Each process keeps its own index; a file evicted by another
+    worker is simply rendered again.
+    """
+
+    def __init__(self, folder, max_bytes=CACHE_MAX_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = None
+        self.total = 0
+
+    def _load(self):
+        found = []
+        for root, _, names in os.walk(self.folder):
+            for name in names:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    info = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                found.append((info.st_mtime, path, info.st_size))
+        found.sort()
+        self.entries = OrderedDict((path, size) for _, path, size in found)
+        self.total = sum(self.entries.values())
+
+    def path_for(self, key, ext):
+        return os.path.join(self.folder, key[:2], f"{key}.{ext}")
+
+    def get(self, path):
+        """True if `path` is cached; marks it as most recently used"""
+        with self.lock:
+            if self.entries is None:
+                self._load()
+            if path not in self.entries:
+                # Bisa saja ditulis oleh worker lain
+                try:
+                    size = os.path.getsize(path)
+                except FileNotFoundError:
+                    return False
+                self.entries[path] = size
+                self.total += size
+            self.entries.move_to_end(path)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            with self.lock:
+                self.total -= self.entries.pop(path, 0)
+            return False
+        return True
+
+    def put(self, path, data):
+        """Store `data` at `path`, then evict old entries beyond max_bytes"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        evicted = []
+        with self.lock:
+            if self.entries is None:
+                self._load()
+            self.total += len(data) - self.entries.pop(path, 0)
+            self.entries[path] = len(data)
+            while self.total > self.max_bytes and len(self.entries) > 1:
+                old_path, size = self.entries.popitem(last=False)
+                self.total -= size
+                evicted.append(old_path)
+        for old_path in evicted:
+            try:
+                os.remove(old_path)
+            except FileNotFoundError:
+                pass
+        return path
+
+
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    with _cache_lock:
+        cache = current_app.extensions.get('image_cache')
+        if cache is None:
+            folder = current_app.config.get('IMAGE_CACHE_FOLDER') or \
+                os.path.join(current_app.instance_path, 'image-cache')
+            cache = DiskLRUCache(os.path.abspath(folder),
+                                 current_app.config.get('IMAGE_CACHE_MAX_BYTES', CACHE_MAX_BYTES))
+            current_app.extensions['image_cache'] = cache
+        return cache
+
+
+def render(path, width=None, height=None, fit='contain', fmt='jpg'):
+    """Encode the image at `path` scaled down to width x height"""
+    with Image.open(path) as opened:
+        if width or height:
+            # Decode JPEG langsung di skala 1/2, 1/4, 1/8 bila cukup; persegi supaya aman untuk rotasi EXIF
+            side = max(width or 0, height or 0)
+            opened.draft('RGB', (side, side))
+        image = _to_rgb(opened)
+
+    if fit == 'cover' and width and height:
+        shrink = min(1.0, image.width / width, image.height / height)
+        size = (max(1, round(width * shrink)), max(1, round(height * shrink)))
+        image = ImageOps.fit(image, size, Image.Resampling.LANCZOS)
+    else:
+        image.thumbnail((width or MAX_SIZE, height or MAX_SIZE), Image.Resampling.LANCZOS)
+
+    pil_format, options, _ = FORMATS[fmt]
+    output = io.BytesIO()
+    image.save(output, pil_format, **options)
+    return output.getvalue()
+
+
+def _dimension(name):
+    raw = request.args.get(name)
+    if raw is None or raw == '':
+        return None
+    try:
+        value = int(raw)
+    except ValueError:
+        abort(400)
+    if value <= 0:
+        abort(400)
+    return min(MAX_SIZE, -(-value // SIZE_STEP) * SIZE_STEP)
+
+
+def _output_format():
+    """(format, negotiated) from ?fmt= and the Accept header"""
+    fmt = request.args.get('fmt', 'auto')
+    formats = available_formats()
+    if fmt != 'auto':
+        if fmt not in formats:
+            abort(400)
+        return fmt, False
+    accepted = {value for value, quality in request.accept_mimetypes if quality > 0}
+    for candidate in formats:
+        if FORMATS[candidate][2] in accepted:
+            return candidate, True
+    return 'jpg', True
+
+
+def _served(filename):
+    """Top-level files and variants/... with an image extension"""
+    folder, _, name = filename.rpartition('/')
+    if folder and folder.split('/', 1)[0] != ProductImage.VARIANTS_FOLDER:
+        return False
+    return name.lower().endswith(SERVED_EXTENSIONS)
+
+
+@img.route('/img/<source>/<path:filename>')
+def resize(source, filename):
+    if source not in SOURCES or not _served(filename):
+        abort(404)
+    path = safe_join(os.path.join(upload_folder(), source), filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    width, height = _dimension('w'), _dimension('h')
+    fit = request.args.get('fit', 'contain')
+    if fit not in FITS:
+        abort(400)
+    fmt, negotiated = _output_format()
+
+    # Tanpa mtime: upload ulang file yang sama hanya menyentuh mtime-nya (dedup)
+    key = hashlib.sha256(
+        f"{source}/{filename}:{os.path.getsize(path)}:{width}x{height}:{fit}:{fmt}".encode()
+    ).hexdigest()[:40]
+
+    if key in request.if_none_match:
+        response = current_app.response_class(status=304)
+    else:
+        cache = get_cache()
+        cached = cache.path_for(key, fmt)
+        if not cache.get(cached):
+            try:
+                data = render(path, width, height, fit, fmt)
+            except (OSError, Image.DecompressionBombError) as e:
+                logger.error(f"Error resizing {source}/{filename}: {e}")
+                abort(404)
+            cache.put(cached, data)
+        response = send_file(cached, mimetype=FORMATS[fmt][2], conditional=False, etag=False)
+
+    response.set_etag(key)
+    response.headers['Cache-Control'] = CACHE_CONTROL
+    if negotiated:
+        response.vary.add('Accept')
+    return response
+
+
+@img.app_template_global()
+def img_url(filename, w=None, h=None, source='products', fit=None, fmt=None):
+    """URL of `filename` resized by the /img endpoint"""
+    return url_for('img.resize', source=source, filename=filename, w=w, h=h, fit=fit, fmt=fmt)
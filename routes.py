@@ -1,32 +1,55 @@
 import os
 import json
 from datetime import datetime, timedelta
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app
+from flask import Blueprint, Response, render_template, request, redirect, url_for, flash, jsonify, current_app
+from markupsafe import Markup
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.utils import secure_filename
 from sqlalchemy import or_, and_
 from models import db
 from models import User, Product, Category, ProductImage, ChatRoom, ChatMessage, Transaction, TransactionOffer, Review
 from forms import LoginForm, RegisterForm, ProductForm, ChatMessageForm, OfferForm, TrackingForm
-from utils import save_uploaded_file, calculate_point_balance, get_transaction_status_text, get_condition_text
+from utils import calculate_point_balance, get_transaction_status_text, get_condition_text, CONDITION_LABELS
+from inbox import get_inbox, count_unread, unread_counts_by_room, latest_message_time
+from realtime import get_broker, publish, stream_events, message_payload
+from search import apply_search
+from pagination import keyset_paginate, cursor_args
+from loaders import PRODUCT_CARD, TRANSACTION_ROW, WISHLIST_ROW
+from images import store_upload
+from cache import get_categories, cached_fragment
+from similar import get_similar_products, DETAIL_LIMIT
+from barter import suggest_offers, suggest_matches, GOOD_MATCH_SCORE
+from cycles import cycle_index, MAX_CYCLES_SHOWN
+from desires import desire_index
+from conditional import (conditional, inbox_version, chat_activity_version, room_messages_version,
+                         available_products_version, wishlist_version)
 
 # Main blueprint
 main = Blueprint('main', __name__)
 
 @main.route('/')
 def index():
-    # Get featured products
-    featured_products = Product.query.filter_by(is_available=True).order_by(Product.created_at.desc()).limit(8).all()
-    categories = Category.query.all()
-    return render_template('index.html', products=featured_products, categories=categories)
+    def render_featured():
+        # Get featured products
+        featured_products = Product.query.options(*PRODUCT_CARD).filter_by(is_available=True)\
+            .order_by(Product.created_at.desc()).limit(8).all()
+        Product.preload_main_images(featured_products)
+        return render_template('products/_featured.html', products=featured_products)
+
+    # Isi fragment hanya bergantung pada status login (tombol wishlist)
+    featured = cached_fragment('index:featured', render_featured,
+                               params=('user' if current_user.is_authenticated else 'anon',))
+    categories = get_categories()
+    return render_template('index.html', featured=featured, categories=categories)
 
 @main.route('/profile')
 @login_required
 def profile():
     user_products = current_user.products.filter_by(is_available=True).all()
-    user_transactions = Transaction.query.filter(
+    user_transactions = Transaction.query.options(*TRANSACTION_ROW).filter(
         or_(Transaction.seller_id == current_user.id, Transaction.buyer_id == current_user.id)
     ).order_by(Transaction.created_at.desc()).limit(10).all()
+    Product.preload_main_images(user_products + [t.product for t in user_transactions])
     return render_template('profile.html', products=user_products, transactions=user_transactions)
 
 # Authentication blueprint
@@ -118,7 +141,7 @@ def logout():
 def api_categories():
     """API endpoint untuk mendapatkan daftar kategori"""
     try:
-        categories = Category.query.all()
+        categories = get_categories()
         categories_data = [{
             'id': category.id,
             'name': category.name
@@ -144,32 +167,46 @@ def list_products():
     search = request.args.get('search', '')
     condition = request.args.get('condition', '')
 
-    query = Product.query.filter_by(is_available=True)
+    def render_grid():
+        query = Product.query.options(*PRODUCT_CARD).filter_by(is_available=True)
 
-    if category_id:
-        query = query.filter_by(category_id=category_id)
+        if category_id:
+            query = query.filter_by(category_id=category_id)
 
-    if search:
-        query = query.filter(
-            or_(Product.title.ilike(f'%{search}%'), 
-                Product.description.ilike(f'%{search}%'))
-        )
-
-    if condition:
-        query = query.filter_by(condition=condition)
-
-    products_pagination = query.order_by(Product.created_at.desc()).paginate(
-        page=page, per_page=12, error_out=False
-    )
+        if condition:
+            query = query.filter_by(condition=condition)
 
-    categories = Category.query.all()
-    conditions = ['New', 'Like New', 'Good', 'Fair', 'Poor']
+        if search:
+            # Full-text search, diurutkan berdasarkan relevansi (tetap pakai nomor halaman)
+            products_pagination = apply_search(query, search).paginate(
+                page=page, per_page=12, error_out=False
+            )
+        else:
+            products_pagination = keyset_paginate(query, Product, per_page=12, **cursor_args())
+        Product.preload_main_images(products_pagination.items)
+
+        return render_template('products/_grid.html',
+                               products=products_pagination.items,
+                               pagination=products_pagination,
+                               current_category=category_id,
+                               current_search=search,
+                               current_condition=condition)
+
+    # Halaman pertama per filter untuk pengunjung anonim di-cache; tombol chat di
+    # kartu bergantung pada user, dan search/cursor terlalu banyak variasinya
+    categories = get_categories()
+    cacheable = (not current_user.is_authenticated and not search and not any(cursor_args().values())
+                 and (condition == '' or condition in CONDITION_LABELS)
+                 and (category_id is None or any(c.id == category_id for c in categories)))
+    if cacheable:
+        grid = cached_fragment('products:list', render_grid, params=(category_id, condition))
+    else:
+        grid = Markup(render_grid())
 
     return render_template('products/list.html', 
-                         products=products_pagination.items,
-                         pagination=products_pagination,
+                         grid=grid,
                          categories=categories,
-                         conditions=conditions,
+                         conditions=list(CONDITION_LABELS),
                          current_category=category_id,
                          current_search=search,
                          current_condition=condition)
@@ -178,16 +215,8 @@ def list_products():
 def detail(id):
     product = Product.query.get_or_404(id)
 
-    # Get related products with better matching algorithm
-    similar_products = Product.query.filter(
-        and_(Product.category_id == product.category_id,
-             Product.id != product.id,
-             Product.is_available == True)
-    ).order_by(
-        # Sort by point difference (closer points = more similar)
-        db.func.abs(Product.total_points - product.total_points).asc(),
-        Product.created_at.desc()
-    ).limit(8).all()
+    similar_products = get_similar_products(product, limit=DETAIL_LIMIT, same_category=True)
+    Product.preload_main_images([product])
 
     return render_template('products/detail.html', product=product, similar_products=similar_products)
 
@@ -197,27 +226,7 @@ def get_related_products(product_id):
     try:
         product = Product.query.get_or_404(product_id)
 
-        # Advanced related products algorithm
-        related_products = Product.query.filter(
-            and_(
-                Product.id != product_id,
-                Product.is_available == True,
-                or_(
-                    Product.category_id == product.category_id,  # Same category
-                    Product.total_points.between(product.total_points - 20, product.total_points + 20),  # Similar points
-                    Product.condition == product.condition  # Same condition
-                )
-            )
-        ).order_by(
-            # Prioritize by multiple factors
-            db.case(
-                (Product.category_id == product.category_id, 1),
-                (Product.condition == product.condition, 2),
-                else_=3
-            ).asc(),
-            db.func.abs(Product.total_points - product.total_points).asc(),
-            Product.created_at.desc()
-        ).limit(12).all()
+        related_products = get_similar_products(product)
 
         products_data = []
         for related_product in related_products:
@@ -280,12 +289,13 @@ def add():
             files = request.files.getlist('images')
             for i, file in enumerate(files[:10]):  # Max 10 images
                 if file and file.filename:
-                    filename = save_uploaded_file(file, 'products')
+                    filename = store_upload(file)
                     if filename:
                         image = ProductImage(
                             product_id=product.id,
                             filename=filename,
-                            is_main=(i == 0)  # First image is main
+                            is_main=(i == 0),  # First image is main
+                            status='pending'  # Diproses di background setelah commit
                         )
                         db.session.add(image)
 
@@ -314,12 +324,13 @@ def edit(id):
             files = request.files.getlist('images')
             for file in files[:10]:  # Max 10 images
                 if file and file.filename:
-                    filename = save_uploaded_file(file, 'products')
+                    filename = store_upload(file)
                     if filename:
                         image = ProductImage(
                             product_id=product.id,
                             filename=filename,
-                            is_main=False
+                            is_main=False,
+                            status='pending'
                         )
                         db.session.add(image)
 
@@ -332,7 +343,11 @@ def edit(id):
 # Chat blueprint
 chat = Blueprint('chat', __name__)
 
+MESSAGES_PAGE_SIZE = 50
+MESSAGES_PAGE_SIZE_MAX = 100
+
 @chat.route('/rooms')
+@conditional(lambda: inbox_version())
 def get_rooms():
     """API endpoint untuk mendapatkan daftar chat rooms dengan notifikasi"""
     # Always return JSON for floating chat compatibility
@@ -346,11 +361,7 @@ def get_rooms():
         }), 401
 
     try:
-        # Enhanced query dengan proper error handling
-        rooms = ChatRoom.query.filter(
-            or_(ChatRoom.user1_id == current_user.id, ChatRoom.user2_id == current_user.id)
-        ).join(Product).filter(Product.is_available == True).order_by(ChatRoom.created_at.desc()).all()
-
+        inbox = get_inbox(current_user.id)
     except Exception as e:
         # If database error occurs, return empty rooms but maintain success=True for stability
         print(f"Database error in get_rooms: {e}")
@@ -362,97 +373,31 @@ def get_rooms():
             'error': f'Database error: {str(e)}'
         }), 500
 
-    rooms_data = []
-    total_unread = 0
-    has_new_messages = False
-
-    for room in rooms:
-        # Validasi bahwa current user adalah participant dari room ini
-        if room.user1_id != current_user.id and room.user2_id != current_user.id:
-            continue  # Skip room ini jika user bukan participant
-            
-        # Tentukan siapa lawan chat dan role pengguna saat ini
-        if room.user1_id == current_user.id:
-            other_user = room.user2.full_name if room.user2 else 'Pengguna Tidak Dikenal'
-            other_user_profile = room.user2.get_profile_picture() if room.user2 else '/static/img/default-avatar.png'
-            current_user_role = 'user1'  # Buyer biasanya
-        else:
-            other_user = room.user1.full_name if room.user1 else 'Pengguna Tidak Dikenal'
-            other_user_profile = room.user1.get_profile_picture() if room.user1 else '/static/img/default-avatar.png'
-            current_user_role = 'user2'  # Seller biasanya
-
-        # Tentukan role dalam konteks produk
-        is_product_owner = room.product.user_id == current_user.id
-        chat_role = 'seller' if is_product_owner else 'buyer'
-        
-        # Pastikan ada pembeli dan penjual yang valid
-        if not room.user1 or not room.user2 or not room.product:
-            continue  # Skip room yang datanya tidak lengkap
-
-        # Hitung pesan yang belum dibaca
-        unread_count = ChatMessage.query.filter(
-            and_(
-                ChatMessage.room_id == room.id,
-                ChatMessage.sender_id != current_user.id,
-                ChatMessage.is_read == False
-            )
-        ).count()
-
-        total_unread += unread_count
-
-        # Check for new messages in last 5 minutes
-        from datetime import datetime, timedelta
-        recent_messages = ChatMessage.query.filter(
-            and_(
-                ChatMessage.room_id == room.id,
-                ChatMessage.sender_id != current_user.id,
-                ChatMessage.created_at >= datetime.utcnow() - timedelta(minutes=5)
-            )
-        ).count()
-
-        if recent_messages > 0:
-            has_new_messages = True
-
-        # Pesan terakhir
-        last_message = ChatMessage.query.filter_by(room_id=room.id).order_by(ChatMessage.created_at.desc()).first()
-
-        # Truncate long messages for preview and handle undefined
-        if last_message and last_message.message:
-            last_msg_preview = last_message.message
-            if len(last_msg_preview) > 50:
-                last_msg_preview = last_msg_preview[:47] + '...'
-        else:
-            last_msg_preview = 'Belum ada pesan'
-
-
-        rooms_data.append({
-            'id': room.id,
-            'product_id': room.product_id,
-            'product_name': room.product.title[:30] + ('...' if len(room.product.title) > 30 else ''),
-            'other_user': other_user,
-            'other_user_profile_picture': other_user_profile,
-            'unread_count': unread_count,
-            'last_message': last_msg_preview,
-            'last_message_time': last_message.created_at.strftime('%H:%M') if last_message else '',
-            'last_message_date': last_message.created_at.strftime('%d/%m') if last_message else '',
-            'status': 'active',
-            'has_recent_activity': recent_messages > 0,
-            'chat_role': chat_role,  # Tambahan untuk membedakan role
-            'is_product_owner': is_product_owner  # Tambahan info role
-        })
-
-    # Sort by last message time (most recent first)
-    rooms_data.sort(key=lambda x: x['last_message_time'], reverse=True)
+    total_unread = inbox['total_unread']
 
     return jsonify({
         'success': True,
-        'rooms': rooms_data,
+        'rooms': inbox['rooms'],
         'total_unread': total_unread,
-        'has_new_messages': has_new_messages,
+        'has_new_messages': inbox['has_new_messages'],
         'notification_title': f'BarterHub - {total_unread} pesan baru' if total_unread > 0 else 'BarterHub',
         'notification_message': f'Anda memiliki {total_unread} pesan baru' if total_unread > 0 else 'Tidak ada pesan baru'
     }), 200, {'Content-Type': 'application/json'}
 
+@chat.route('/stream')
+@login_required
+def stream():
+    """Server-Sent Events stream for new messages, offer updates and unread counts"""
+    broker = get_broker()
+    if broker is None:
+        return jsonify({'success': False, 'error': 'Realtime tidak aktif'}), 503
+
+    subscription = broker.subscribe(current_user.id)
+    return Response(stream_events(subscription, shared=broker.shared), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 @chat.route('/room/<int:product_id>', methods=['GET', 'POST'])
 @login_required
 def room(product_id):
@@ -926,8 +871,16 @@ def get_messages(product_id):
 
 @chat.route('/room/<int:room_id>/messages_direct')
 @login_required
+@conditional(room_messages_version)
 def get_messages_direct(room_id):
-    """API endpoint to get messages directly by room ID"""
+    """API endpoint to get messages directly by room ID
+
+    Cursor parameters (all optional):
+    - since_id: only messages newer than this id (incremental polling)
+    - before_id: only messages older than this id (paging back)
+    - limit: page size, default 50, max 100
+    Without a cursor the latest `limit` messages are returned.
+    """
     chat_room = ChatRoom.query.get_or_404(room_id)
 
     # Check access
@@ -935,30 +888,36 @@ def get_messages_direct(room_id):
         chat_room.user2_id != current_user.id):
         return jsonify({'error': 'Access denied'}), 403
 
-    messages = chat_room.messages.order_by(ChatMessage.created_at.asc()).all()
-
-    # Mark messages as read for current user
-    unread_messages = ChatMessage.query.filter(
-        and_(
-            ChatMessage.room_id == room_id,
-            ChatMessage.sender_id != current_user.id,
-            ChatMessage.is_read == False
-        )
-    ).all()
+    since_id = request.args.get('since_id', type=int)
+    before_id = request.args.get('before_id', type=int)
+    limit = min(max(request.args.get('limit', MESSAGES_PAGE_SIZE, type=int), 1), MESSAGES_PAGE_SIZE_MAX)
 
-    for msg in unread_messages:
-        msg.is_read = True
+    # Index (room_id, id) membuat setiap halaman berbiaya konstan
+    query = db.session.query(ChatMessage, User.full_name).outerjoin(
+        User, User.id == ChatMessage.sender_id
+    ).filter(ChatMessage.room_id == room_id)
 
-    db.session.commit()
+    if since_id is not None:
+        rows = query.filter(ChatMessage.id > since_id).order_by(ChatMessage.id.asc()).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+    else:
+        if before_id is not None:
+            query = query.filter(ChatMessage.id < before_id)
+        rows = query.order_by(ChatMessage.id.desc()).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = list(reversed(rows[:limit]))
+
+    # Mark messages as read for current user: satu UPDATE pada watermark room
+    if rows and chat_room.mark_read(current_user.id, rows[-1][0].id):
+        db.session.commit()
+        publish([current_user.id], 'unread', {'total_unread': count_unread(current_user.id)})
 
     return jsonify({
-        'messages': [{
-            'id': msg.id,
-            'sender_name': msg.sender.full_name if msg.sender and msg.sender.full_name else 'Pengguna',
-            'message': msg.message if msg.message and msg.message.strip() else 'Pesan tidak dapat ditampilkan',
-            'message_type': msg.message_type or 'text',
-            'created_at': msg.created_at.isoformat()
-        } for msg in messages]
+        'messages': [message_payload(msg, sender_name) for msg, sender_name in rows],
+        'has_more': has_more,
+        'oldest_id': rows[0][0].id if rows else before_id,
+        'latest_id': rows[-1][0].id if rows else since_id
     })
 
 @chat.route('/room/<int:room_id>/send_message', methods=['POST'])
@@ -1003,48 +962,25 @@ def send_message_direct(room_id):
 
 @chat.route('/rooms/quick_check')
 @login_required
+@conditional(lambda: chat_activity_version())
 def quick_check_chat_activity():
     """Quick endpoint to check for new chat activity without full data load"""
     try:
-        # Get user's chat rooms
-        user_rooms = ChatRoom.query.filter(
-            or_(ChatRoom.user1_id == current_user.id, ChatRoom.user2_id == current_user.id)
-        ).all()
-
-        if not user_rooms:
-            return jsonify({
-                'success': True,
-                'has_updates': False,
-                'last_update': 0,
-                'active_room_updates': {}
-            })
-
         # Get the latest message timestamp across all rooms
-        room_ids = [room.id for room in user_rooms]
-        latest_message = ChatMessage.query.filter(
-            ChatMessage.room_id.in_(room_ids)
-        ).order_by(ChatMessage.created_at.desc()).first()
+        latest_created_at = latest_message_time(current_user.id)
 
         last_update_timestamp = 0
-        if latest_message:
-            last_update_timestamp = int(latest_message.created_at.timestamp() * 1000)
-
-        # Check for unread messages in each room
-        active_room_updates = {}
-        for room in user_rooms:
-            unread_count = ChatMessage.query.filter(
-                and_(
-                    ChatMessage.room_id == room.id,
-                    ChatMessage.sender_id != current_user.id,
-                    ChatMessage.is_read == False
-                )
-            ).count()
-            
-            if unread_count > 0:
-                active_room_updates[room.id] = {
-                    'unread_count': unread_count,
-                    'has_new_messages': True
-                }
+        if latest_created_at:
+            last_update_timestamp = int(latest_created_at.timestamp() * 1000)
+
+        # Unread per room dari watermark, satu query GROUP BY
+        active_room_updates = {
+            room_id: {
+                'unread_count': unread_count,
+                'has_new_messages': True
+            }
+            for room_id, unread_count in unread_counts_by_room(current_user.id).items()
+        }
 
         # Check if there are any updates
         has_updates = len(active_room_updates) > 0
@@ -1078,10 +1014,13 @@ def notify_chat_activity(room_id):
             chat_room.user2_id != current_user.id):
             return jsonify({'success': False, 'error': 'Access denied'}), 403
 
-        # For now, just acknowledge the activity
-        # In a real production app, you might use WebSockets or Server-Sent Events
-        # to push updates to connected clients
-        
+        # Teruskan aktivitas ke participant lain lewat stream realtime
+        other_user_id = chat_room.user2_id if chat_room.user1_id == current_user.id else chat_room.user1_id
+        publish([other_user_id], 'activity', {
+            'room_id': chat_room.id,
+            'user_id': current_user.id
+        })
+
         return jsonify({
             'success': True,
             'message': 'Activity noted',
@@ -1122,10 +1061,11 @@ def get_room_info(room_id):
 
 @products.route('/user/available')
 @login_required
+@conditional(lambda: available_products_version())
 def user_available():
     """API endpoint to get user's available products"""
     try:
-        user_products = current_user.products.filter_by(is_available=True).all()
+        user_products = Product.preload_main_images(current_user.products.filter_by(is_available=True).all())
 
         products_data = [{
             'id': product.id,
@@ -1152,41 +1092,35 @@ def user_available():
 @products.route('/suggest_barter/<int:target_product_id>')
 @login_required
 def suggest_barter(target_product_id):
-    """API endpoint untuk menyarankan produk user yang cocok untuk barter"""
+    """API endpoint untuk menyarankan produk user yang cocok untuk barter
+
+    ?mode=reverse membalik arah: produk user lain yang paling cocok dengan
+    produk milik user sendiri.
+    """
     try:
         target_product = Product.query.get_or_404(target_product_id)
+        reverse = request.args.get('mode') == 'reverse'
 
-        if target_product.user_id == current_user.id:
+        if reverse and target_product.user_id != current_user.id:
+            return jsonify({
+                'success': False,
+                'error': 'Mode reverse hanya untuk produk sendiri'
+            }), 403
+        if not reverse and target_product.user_id == current_user.id:
             return jsonify({
                 'success': False,
                 'error': 'Tidak dapat barter dengan produk sendiri'
             }), 400
 
-        # Get user's products that might be good for barter
-        user_products = current_user.products.filter_by(is_available=True).all()
+        # Skor dihitung di database; hanya produk teratas yang dimuat
+        if reverse:
+            suggestions = suggest_matches(target_product)
+            total_available = None
+        else:
+            suggestions, total_available = suggest_offers(target_product, current_user.id)
 
-        # Score products based on similarity and point difference
         suggested_products = []
-        for product in user_products:
-            score = 0
-
-            # Same category gets higher score
-            if product.category_id == target_product.category_id:
-                score += 50
-
-            # Similar points get higher score
-            point_diff = abs(product.total_points - target_product.total_points)
-            if point_diff <= 10:
-                score += 30
-            elif point_diff <= 20:
-                score += 20
-            elif point_diff <= 30:
-                score += 10
-
-            # Same condition gets bonus
-            if product.condition == target_product.condition:
-                score += 20
-
+        for product, score in suggestions:
             suggested_products.append({
                 'id': product.id,
                 'title': product.title,
@@ -1196,16 +1130,15 @@ def suggest_barter(target_product_id):
                 'description': product.description[:100] + ('...' if len(product.description) > 100 else ''),
                 'main_image': product.get_main_image(),
                 'created_at': product.created_at.strftime('%d %b %Y'),
+                'owner_name': product.owner.full_name,
                 'match_score': score,
-                'point_difference': point_diff,
-                'is_good_match': score >= 50
+                'point_difference': abs(product.total_points - target_product.total_points),
+                'is_good_match': score >= GOOD_MATCH_SCORE
             })
 
-        # Sort by match score
-        suggested_products.sort(key=lambda x: x['match_score'], reverse=True)
-
-        return jsonify({
+        response = {
             'success': True,
+            'mode': 'reverse' if reverse else 'offer',
             'target_product': {
                 'id': target_product.id,
                 'title': target_product.title,
@@ -1214,8 +1147,98 @@ def suggest_barter(target_product_id):
                 'category': target_product.category.name,
                 'owner_name': target_product.owner.full_name
             },
-            'suggested_products': suggested_products[:6],  # Top 6 suggestions
-            'total_available': len(user_products)
+            'suggested_products': suggested_products
+        }
+        if total_available is not None:
+            response['total_available'] = total_available
+        return jsonify(response)
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@products.route('/barter_cycles')
+@login_required
+def barter_cycles():
+    """API endpoint untuk siklus barter 2-4 pihak yang melibatkan produk user"""
+    try:
+        cycles = cycle_index.cycles_for_user(current_user.id)
+        if cycles is None:
+            # Graf masih dibangun di background
+            return jsonify({
+                'success': True,
+                'ready': False,
+                'cycles': []
+            })
+        cycles = cycles[:MAX_CYCLES_SHOWN]
+        product_ids = {product_id for cycle in cycles for product_id in cycle}
+        products_by_id = {product.id: product for product in Product.preload_main_images(
+            Product.query.options(*PRODUCT_CARD).filter(Product.id.in_(product_ids)).all()
+        )} if product_ids else {}
+
+        result = []
+        for cycle in cycles:
+            # Pemilik cycle[i] menyerahkan cycle[i] dan menerima cycle[i + 1]
+            steps = []
+            for i, product_id in enumerate(cycle):
+                product = products_by_id.get(product_id)
+                receives = products_by_id.get(cycle[(i + 1) % len(cycle)])
+                if product is None or receives is None:
+                    break
+                steps.append({
+                    'owner_name': product.owner.full_name,
+                    'is_mine': product.user_id == current_user.id,
+                    'gives': {
+                        'id': product.id,
+                        'title': product.title,
+                        'total_points': product.total_points,
+                        'main_image': product.get_main_image()
+                    },
+                    'receives_id': receives.id
+                })
+            else:
+                result.append({'size': len(cycle), 'steps': steps})
+
+        return jsonify({
+            'success': True,
+            'ready': True,
+            'cycles': result
+        })
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@products.route('/wanted_by/<int:product_id>')
+@login_required
+def wanted_by(product_id):
+    """API endpoint untuk produk user lain yang desired_items-nya cocok dengan produk ini"""
+    try:
+        product = Product.query.get_or_404(product_id)
+        ids = desire_index.wanted_by(product.id)
+        matches = Product.preload_main_images(
+            Product.query.options(*PRODUCT_CARD).filter(
+                Product.id.in_(ids), Product.is_available == True
+            ).order_by(Product.id.desc()).all()
+        ) if ids else []
+
+        return jsonify({
+            'success': True,
+            'product_id': product.id,
+            'wanted_by': [{
+                'id': match.id,
+                'title': match.title,
+                'desired_items': match.desired_items,
+                'total_points': match.total_points,
+                'category': match.category.name,
+                'main_image': match.get_main_image(),
+                'owner_name': match.owner.full_name,
+                'is_balanced': calculate_point_balance(match.total_points, product.total_points)
+            } for match in matches]
         })
 
     except Exception as e:
@@ -1266,12 +1289,13 @@ def quick_add():
         if 'images' in request.files:
             file = request.files['images']
             if file and file.filename:
-                filename = save_uploaded_file(file, 'products')
+                filename = store_upload(file)
                 if filename:
                     image = ProductImage(
                         product_id=product.id,
                         filename=filename,
-                        is_main=True
+                        is_main=True,
+                        status='pending'
                     )
                     db.session.add(image)
 
@@ -1296,13 +1320,10 @@ transactions = Blueprint('transactions', __name__)
 @transactions.route('/')
 @login_required
 def list_transactions():
-    page = request.args.get('page', 1, type=int)
-
-    user_transactions = Transaction.query.filter(
+    user_transactions = keyset_paginate(Transaction.query.options(*TRANSACTION_ROW).filter(
         or_(Transaction.seller_id == current_user.id, Transaction.buyer_id == current_user.id)
-    ).order_by(Transaction.created_at.desc()).paginate(
-        page=page, per_page=10, error_out=False
-    )
+    ), Transaction, per_page=10, **cursor_args())
+    Product.preload_main_images([t.product for t in user_transactions.items])
 
     return render_template('transactions/list.html', 
                          transactions=user_transactions.items,
@@ -1892,7 +1913,7 @@ def create_offer(product_id):
         return redirect(url_for('products.detail', id=product_id))
 
     # Get user's products for offering
-    user_products = current_user.products.filter_by(is_available=True).all()
+    user_products = Product.preload_main_images(current_user.products.filter_by(is_available=True).all())
 
     # Check if there's a suggested product from query params
     suggested_product_id = request.args.get('suggested', type=int)
@@ -1991,10 +2012,7 @@ def dashboard():
 
 @admin.route('/users')
 def users():
-    page = request.args.get('page', 1, type=int)
-    users_pagination = User.query.order_by(User.created_at.desc()).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    users_pagination = keyset_paginate(User.query, User, per_page=20, count='approximate', **cursor_args())
     return render_template('admin/users.html', 
                          users=users_pagination.items,
                          pagination=users_pagination)
@@ -2039,7 +2057,6 @@ def unban_user(id):
 @admin.route('/reports')
 def reports():
     from models import Report
-    page = request.args.get('page', 1, type=int)
     status_filter = request.args.get('status', '')
     type_filter = request.args.get('type', '')
 
@@ -2049,9 +2066,7 @@ def reports():
     if type_filter:
         query = query.filter_by(report_type=type_filter)
 
-    reports_pagination = query.order_by(Report.created_at.desc()).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    reports_pagination = keyset_paginate(query, Report, per_page=20, count='approximate', **cursor_args())
 
     return render_template('admin/reports.html', 
                          reports=reports_pagination.items,
@@ -2087,26 +2102,23 @@ def resolve_report(id):
 
 @admin.route('/products')
 def admin_products():
-    page = request.args.get('page', 1, type=int)
-    products_pagination = Product.query.order_by(Product.created_at.desc()).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    products_pagination = keyset_paginate(Product.query.options(*PRODUCT_CARD), Product, per_page=20,
+                                          count='approximate', **cursor_args())
+    Product.preload_main_images(products_pagination.items)
     return render_template('admin/products.html', 
                          products=products_pagination.items,
                          pagination=products_pagination)
 
 @admin.route('/transactions')
 def admin_transactions():
-    page = request.args.get('page', 1, type=int)
     status_filter = request.args.get('status', '')
 
-    query = Transaction.query
+    query = Transaction.query.options(*TRANSACTION_ROW)
     if status_filter:
         query = query.filter_by(status=status_filter)
 
-    transactions_pagination = query.order_by(Transaction.created_at.desc()).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    transactions_pagination = keyset_paginate(query, Transaction, per_page=20, count='approximate', **cursor_args())
+    Product.preload_main_images([t.product for t in transactions_pagination.items])
 
     return render_template('admin/transactions.html', 
                          transactions=transactions_pagination.items,
@@ -2117,14 +2129,14 @@ def admin_transactions():
 @main.route('/wishlist')
 @login_required
 def wishlist():
-    page = request.args.get('page', 1, type=int)
-
     # Get user's wishlist items with pagination
     from models import Wishlist
-    wishlist_items = db.session.query(Wishlist).filter_by(user_id=current_user.id)\
-        .join(Product).filter(Product.is_available == True)\
-        .order_by(Wishlist.created_at.desc())\
-        .paginate(page=page, per_page=12, error_out=False)
+    wishlist_items = keyset_paginate(
+        db.session.query(Wishlist).filter_by(user_id=current_user.id)
+        .join(Product).filter(Product.is_available == True).options(*WISHLIST_ROW),
+        Wishlist, per_page=12, **cursor_args()
+    )
+    Product.preload_main_images([item.product for item in wishlist_items.items])
 
     return render_template('wishlist.html', 
                          wishlist_items=wishlist_items.items,
@@ -2165,6 +2177,7 @@ def remove_from_wishlist(product_id):
 
 @main.route('/wishlist/check/<int:product_id>')
 @login_required
+@conditional(wishlist_version)
 def check_wishlist(product_id):
     is_in_wishlist = current_user.is_in_wishlist(product_id)
     return jsonify({'in_wishlist': is_in_wishlist})
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Aturan skor poin produk yang berversi dan hitung ulang massal
+
+total_points = (jumlah skor faktor x bobot) / pembagi x pengali kondisi x skala,
+dibulatkan ke bawah. Setiap perubahan bobot / pengali / skala ditambahkan
+sebagai versi baru di RULES (versi lama jangan diubah), dan setiap produk
+menyimpan versi yang menghitung poinnya (products.points_version).
+
+Product.calculate_points() (add, edit, quick_add) memakai CURRENT_VERSION.
+Produk lama dihitung ulang tanpa memuat baris ke Python: rumus yang sama
+dijadikan satu ekspresi SQL dan dijalankan sebagai UPDATE per rentang id
+(batch_size baris per transaksi), hanya untuk baris dengan versi lain.
+Aritmetikanya double precision dengan urutan operasi yang sama, jadi
+hasilnya sama persis dengan calculate_points().
+
+Bulk UPDATE tidak melewati event ORM. Id produk yang poinnya berubah
+dicatat di index_changes dalam transaksi batch-nya, jadi index di memori
+setiap worker web ikut diperbarui; setelah selesai
+catalog.after_bulk_change() memperbarui similar_products dan cache fragment
+(lihat catalog.py untuk batas cache fragment dengan LocalCache).
+
+    python scoring.py                      # hitung ulang ke CURRENT_VERSION
+    python scoring.py --version 1 --batch-size 20000
+    python scoring.py --status             # jumlah produk per versi
+"""
+
+import logging
+import time
+from collections import namedtuple
+from sqlalchemy import Float, Integer, case, cast, func, literal, or_, update
+import changes
+from models import db, Product
+
+logger = logging.getLogger(__name__)
+
+SCORE_COLUMNS = ('utility_score', 'scarcity_score', 'durability_score', 'portability_score', 'seasonal_score')
+# Default kolom skor; baris lama dengan skor NULL dihitung dengan nilai ini
+DEFAULT_SCORE = 5
+
+ScoringRules = namedtuple('ScoringRules', [
+    'version', 'weights', 'divisor', 'condition_multipliers', 'default_multiplier', 'scale'
+])
+
+RULES = {
+    1: ScoringRules(
+        version=1,
+        weights={column: 1 for column in SCORE_COLUMNS},
+        divisor=5,
+        condition_multipliers={'New': 1.0, 'Like New': 0.9, 'Good': 0.8, 'Fair': 0.6, 'Poor': 0.4},
+        default_multiplier=0.8,
+        scale=10,
+    ),
+}
+CURRENT_VERSION = max(RULES)
+
+RECALCULATE_BATCH_SIZE = 10000
+
+
+def get_rules(version=None):
+    return RULES[CURRENT_VERSION if version is None else version]
+
+
+def compute_points(product, rules=None):
+    """total_points of `product` under `rules` (the current version by default)"""
+    rules = rules or get_rules()
+    weighted = sum(weight * _score(getattr(product, column)) for column, weight in rules.weights.items())
+    base_score = weighted / rules.divisor
+    multiplier = rules.condition_multipliers.get(product.condition, rules.default_multiplier)
+    return int(base_score * multiplier * rules.scale)
+
+
+def _score(value):
+    return DEFAULT_SCORE if value is None else value
+
+
+def points_expression(rules, table=None, dialect_name=None):
+    """compute_points() as a SQL expression over the products table"""
+    table = Product.__table__ if table is None else table
+    dialect_name = dialect_name or db.engine.dialect.name
+    weighted = sum(literal(weight) * func.coalesce(table.c[column], DEFAULT_SCORE)
+                   for column, weight in rules.weights.items())
+    multiplier = case(
+        *[(table.c.condition == condition, literal(value, Float))
+          for condition, value in rules.condition_multipliers.items()],
+        else_=literal(rules.default_multiplier, Float)
+    )
+    points = cast(weighted, Float) / literal(rules.divisor, Float) * multiplier * literal(rules.scale, Float)
+    # int() membulatkan ke arah nol; skor tidak pernah negatif, jadi sama dengan floor.
+    # CAST ke integer di SQLite memotong, di PostgreSQL membulatkan.
+    if dialect_name == 'sqlite':
+        return cast(points, Integer)
+    return cast(func.floor(points), Integer)
+
+
+def recalculate(version=None, batch_size=RECALCULATE_BATCH_SIZE, refresh_dependents=True):
+    """Recompute total_points for every product not yet on `version`
+
+    One UPDATE per id range; rows whose points change also get a new
+    updated_at (conditional.py uses it as a version stamp). With
+    refresh_dependents=False the caller refreshes similar_products and
+    the caches itself; the in-memory indexes are always signalled through
+    index_changes. Returns the ids whose points changed.
+    """
+    rules = get_rules(version)
+    table = Product.__table__
+    points = points_expression(rules, table)
+    low, high = db.session.query(func.min(Product.id), func.max(Product.id)).one()
+    if low is None:
+        return []
+
+    changed = []
+    done = 0
+    started = time.perf_counter()
+    for start in range(low, high + 1, batch_size):
+        in_batch = [table.c.id >= start, table.c.id < start + batch_size,
+                    or_(table.c.points_version.is_(None), table.c.points_version != rules.version)]
+        batch_changed = db.session.execute(
+            update(table).where(*in_batch, table.c.total_points.is_distinct_from(points))
+            .values(total_points=points, points_version=rules.version).returning(table.c.id)
+        ).scalars().all()
+        # Index di memori setiap worker membaca perubahan ini dari index_changes
+        changes.record('product', batch_changed)
+        changed += batch_changed
+        # Poin tidak berubah: hanya versinya, updated_at dibiarkan
+        done += db.session.execute(
+            update(table).where(*in_batch).values(points_version=rules.version, updated_at=table.c.updated_at)
+        ).rowcount
+        db.session.commit()
+        elapsed = time.perf_counter() - started
+        logger.info(f"Recalculated ids < {start + batch_size}: {len(changed)} changed, "
+                    f"{(len(changed) + done) / max(elapsed, 1e-9):.0f} rows/s")
+
+    if changed and refresh_dependents:
+        _after_bulk_change(changed)
+    return changed
+
+
+def _after_bulk_change(product_ids):
+    """What the ORM hooks would have done for a bulk points change"""
+    from catalog import after_bulk_change
+    after_bulk_change(product_ids)
+
+
+def version_counts():
+    """{points_version: product count}; None means never recalculated"""
+    return dict(db.session.query(Product.points_version, func.count()).group_by(Product.points_version).all())
+
+
+if __name__ == '__main__':
+    import argparse
+    from app import app
+
+    parser = argparse.ArgumentParser(description='Recalculate product points')
+    parser.add_argument('--version', type=int, choices=sorted(RULES), help='Scoring rules version (default: latest)')
+    parser.add_argument('--batch-size', type=int, default=RECALCULATE_BATCH_SIZE)
+    parser.add_argument('--status', action='store_true', help='Show product counts per rules version')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    with app.app_context():
+        if args.status:
+            for version, count in sorted(version_counts().items(), key=lambda item: (item[0] is None, item[0])):
+                print(f"{'none' if version is None else version:>6}  {count}")
+        else:
+            changed = recalculate(args.version, args.batch_size)
+            logger.info(f"Recalculated points: {len(changed)} products changed")
@@ -0,0 +1,212 @@
+"""
+Pencarian produk full-text
+
+PostgreSQL: tsvector berbobot (judul A, barang yang diinginkan B, deskripsi C)
+dengan GIN index expression `idx_products_search` (migrate_db.py versi 6) dan
+ranking ts_rank. Konfigurasi 'simple' dipakai karena PostgreSQL tidak punya
+stemmer Bahasa Indonesia bawaan.
+
+Database lain (SQLite untuk development/test): inverted index murni Python di
+memori proses, dibangun saat pencarian pertama dan diperbarui per produk yang
+berubah setelah commit, termasuk perubahan dari worker lain (LiveIndex,
+changes.py), tanpa rescan tabel.
+
+Semantik kedua backend sama: setiap kata di query harus cocok dengan awalan
+sebuah kata di produk (cocok untuk auto-submit saat user mengetik).
+"""
+
+import heapq
+import math
+import re
+import unicodedata
+from bisect import bisect_left
+from collections import defaultdict
+from sqlalchemy import literal_column
+from changes import LiveIndex
+from models import db, Product
+
+MAX_QUERY_TOKENS = 8
+MAX_CANDIDATES = 1000
+FIELD_WEIGHTS = {'title': 3.0, 'desired_items': 1.5, 'description': 1.0}
+
+_TOKEN_RE = re.compile(r'[0-9a-z]+')
+
+
+def tokenize(text):
+    """Lowercase, strip accents and split into alphanumeric tokens"""
+    if not text:
+        return []
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii').lower()
+    return _TOKEN_RE.findall(text)
+
+
+def _query_tokens(text):
+    tokens = []
+    for token in tokenize(text):
+        if token not in tokens:
+            tokens.append(token)
+    return tokens[:MAX_QUERY_TOKENS]
+
+
+# ---------------------------------------------------------------------------
+# PostgreSQL
+# ---------------------------------------------------------------------------
+
+def _weighted_vector(column, weight):
+    return db.func.setweight(db.func.to_tsvector(literal_column("'simple'::regconfig"), column),
+                             literal_column(f"'{weight}'::\"char\""))
+
+
+def search_vector():
+    """Must stay identical to the idx_products_search expression in migrate_db.py"""
+    return (_weighted_vector(Product.title, 'A')
+            .op('||')(_weighted_vector(Product.desired_items, 'B'))
+            .op('||')(_weighted_vector(Product.description, 'C')))
+
+
+def _postgres_search(query, tokens):
+    tsquery = db.func.to_tsquery(literal_column("'simple'::regconfig"), ' & '.join(f'{t}:*' for t in tokens))
+    vector = search_vector()
+    return query.filter(vector.op('@@')(tsquery)).order_by(
+        db.func.ts_rank(vector, tsquery).desc(),
+        Product.created_at.desc()
+    )
+
+
+# ---------------------------------------------------------------------------
+# Pure-Python fallback
+# ---------------------------------------------------------------------------
+
+class InvertedIndex:
+    """In-memory token -> {product_id: weighted term frequency} index"""
+
+    def __init__(self):
+        self.postings = defaultdict(dict)
+        self.doc_tokens = {}
+        self._sorted_tokens = None
+
+    def __len__(self):
+        return len(self.doc_tokens)
+
+    def add(self, product_id, title, description, desired_items):
+        self.remove(product_id)
+        weights = defaultdict(float)
+        for field, text in (('title', title), ('description', description), ('desired_items', desired_items)):
+            for token in tokenize(text):
+                weights[token] += FIELD_WEIGHTS[field]
+        for token, weight in weights.items():
+            self.postings[token][product_id] = weight
+        self.doc_tokens[product_id] = set(weights)
+        self._sorted_tokens = None
+
+    def remove(self, product_id):
+        for token in self.doc_tokens.pop(product_id, ()):
+            postings = self.postings.get(token)
+            if postings is not None:
+                postings.pop(product_id, None)
+                if not postings:
+                    del self.postings[token]
+        self._sorted_tokens = None
+
+    def _expand_prefix(self, prefix):
+        if self._sorted_tokens is None:
+            self._sorted_tokens = sorted(self.postings)
+        tokens = self._sorted_tokens
+        i = bisect_left(tokens, prefix)
+        while i < len(tokens) and tokens[i].startswith(prefix):
+            yield tokens[i]
+            i += 1
+
+    def search(self, text, limit=MAX_CANDIDATES):
+        """Product ids matching every query token by prefix, best first"""
+        tokens = _query_tokens(text)
+        if not tokens:
+            return []
+
+        total_docs = max(len(self.doc_tokens), 1)
+        expanded = []
+        for query_token in tokens:
+            postings = [self.postings[token] for token in self._expand_prefix(query_token)]
+            if not postings:
+                return []
+            expanded.append(postings)
+
+        # Mulai dari kata paling selektif supaya kandidat cepat mengecil
+        expanded.sort(key=lambda postings: sum(len(p) for p in postings))
+
+        scores = None
+        for postings_list in expanded:
+            if scores is None:
+                scores = defaultdict(float)
+                for postings in postings_list:
+                    idf = math.log(1 + total_docs / len(postings))
+                    for product_id, weight in postings.items():
+                        scores[product_id] += weight * idf
+                continue
+
+            matched = {}
+            for postings in postings_list:
+                idf = math.log(1 + total_docs / len(postings))
+                for product_id in scores:
+                    weight = postings.get(product_id)
+                    if weight is not None:
+                        matched[product_id] = matched.get(product_id, scores[product_id]) + weight * idf
+            scores = matched
+            if not scores:
+                return []
+
+        ranked = heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], -item[0]))
+        return [product_id for product_id, _ in ranked]
+
+
+class ProductSearchIndex(LiveIndex):
+    """Process-level InvertedIndex over products, refreshed per changed product"""
+
+    def _load(self, product_ids=None):
+        query = db.session.query(Product.id, Product.title, Product.description,
+                                 Product.desired_items, Product.is_available)
+        if product_ids is not None:
+            query = query.filter(Product.id.in_(product_ids))
+        return query.yield_per(1000)
+
+    def build(self):
+        index = InvertedIndex()
+        for product_id, title, description, desired_items, is_available in self._load():
+            if is_available:
+                index.add(product_id, title, description, desired_items)
+        return index
+
+    def refresh(self, index, dirty):
+        product_ids = dirty.get('product', set())
+        for product_id in product_ids:
+            index.remove(product_id)
+        for product_id, title, description, desired_items, is_available in self._load(product_ids):
+            if is_available:
+                index.add(product_id, title, description, desired_items)
+
+    def search(self, text, limit=MAX_CANDIDATES):
+        with self.reading() as index:
+            return index.search(text, limit)
+
+
+product_index = ProductSearchIndex()
+
+
+def _fallback_search(query, text):
+    ids = product_index.search(text)
+    if not ids:
+        return query.filter(db.false())
+    rank = db.case({product_id: position for position, product_id in enumerate(ids)}, value=Product.id)
+    return query.filter(Product.id.in_(ids)).order_by(rank)
+
+
+# ---------------------------------------------------------------------------
+
+def apply_search(query, text):
+    """Filter a Product query by search text and order it by relevance"""
+    tokens = _query_tokens(text)
+    if not tokens:
+        return query.filter(db.false())
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return _postgres_search(query, tokens)
+    return _fallback_search(query, text)
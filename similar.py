@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+Produk serupa yang dihitung lebih dulu (tabel similar_products)
+
+Halaman detail produk dan /products/related dulu mengurutkan seluruh
+kategori dengan ORDER BY abs(total_points - x) (ditambah CASE atas tiga
+predikat OR untuk related) di setiap view; tidak ada index yang bisa
+dipakai. Sekarang setiap produk punya daftar RELATED_LIMIT produk serupa
+yang tersimpan berurutan, jadi kedua halaman cukup satu lookup ber-index.
+
+Urutannya sama dengan query lama di get_related_products: produk tersedia
+sekategori dengan poin terdekat, lalu (hanya bila kategorinya kecil) produk
+dengan kondisi sama, lalu produk dengan selisih poin maks. POINTS_BAND.
+Halaman detail memakai bagian sekategori dari daftar yang sama.
+
+Daftar diperbarui setelah transaksi yang mengubah produk commit, di thread
+background (SimilarRefresher, seperti pipeline gambar di images.py), jadi
+request yang menyimpan produk tidak menunggu. Hanya daftar produk yang bisa
+berubah yang dihitung ulang:
+- produk yang berubah itu sendiri;
+- produk yang daftarnya memuat produk itu (idx_similar_products_similar_id);
+- produk sekategori yang bisa mendapatkannya sebagai tetangga baru. Poin
+  hanya satu dimensi, jadi produk itu hanya bisa masuk daftar produk yang
+  terpisah kurang dari RELATED_LIMIT produk darinya bila diurutkan per poin
+  (lihat _window);
+- produk di kategori kecil (daftarnya memuat produk kategori lain).
+
+Sampai job-nya jalan, produk baru belum punya daftar; get_similar_products()
+menghitung daftar produk seperti itu langsung dari tabel products, begitu
+juga untuk semua produk selama similar_products belum diisi setelah
+migrasi 11.
+
+Perubahan lewat bulk UPDATE/INSERT tidak melewati event ORM; panggil
+refresh() sendiri atau bangun ulang semua daftar:
+    python similar.py
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app, has_app_context
+from sqlalchemy import case, delete, event, func, insert, inspect, or_
+from models import db, Product, SimilarProduct
+from loaders import PRODUCT_CARD
+from nearest import nearest
+
+logger = logging.getLogger(__name__)
+
+RELATED_LIMIT = 12
+DETAIL_LIMIT = 8
+POINTS_BAND = 20
+# Kolom yang menentukan posisi produk di daftar produk lain
+REFRESH_COLUMNS = ('category_id', 'condition', 'total_points', 'is_available')
+REBUILD_BATCH_SIZE = 500
+
+
+def _available():
+    return db.session.query(Product.id, Product.total_points, Product.created_at).filter(
+        Product.is_available == True
+    )
+
+
+def compute_related(product, memo=None):
+    """Ids of the RELATED_LIMIT products most similar to `product`, best first
+
+    Products in the same category with the same points share their
+    neighbours (minus themselves); pass the same `memo` dict when
+    computing many lists to look those up once.
+    """
+    memo = {} if memo is None else memo
+    points = product.total_points or 0
+    key = (product.category_id, points)
+    if key not in memo:
+        # Satu lebih banyak: produk itu sendiri bisa ada di hasilnya
+        memo[key] = [row.id for row in nearest(
+            _available().filter(Product.category_id == product.category_id), points, RELATED_LIMIT + 1
+        )]
+    related = [product_id for product_id in memo[key] if product_id != product.id][:RELATED_LIMIT]
+
+    if len(related) < RELATED_LIMIT:
+        # Kategori kecil: lengkapi dengan kondisi sama, lalu poin yang mirip
+        related += [row.id for row in _available().filter(
+            Product.id != product.id,
+            Product.category_id != product.category_id,
+            or_(Product.condition == product.condition,
+                Product.total_points.between(points - POINTS_BAND, points + POINTS_BAND))
+        ).order_by(
+            case((Product.condition == product.condition, 0), else_=1),
+            func.abs(Product.total_points - points),
+            Product.created_at.desc()
+        ).limit(RELATED_LIMIT - len(related))]
+    return related
+
+
+def _sparse_categories():
+    """Categories with too few available products to fill a list on their own"""
+    # +1: produk itu sendiri tidak masuk daftarnya. Kategori tanpa produk
+    # tersedia tidak perlu ikut: tidak ada daftar di sana yang bisa berubah
+    return [category_id for (category_id,) in db.session.query(Product.category_id).filter(
+        Product.is_available == True
+    ).group_by(Product.category_id).having(func.count() <= RELATED_LIMIT + 1)]
+
+
+def _window(product):
+    """Products in the category whose list `product` could enter
+
+    For a product X above `product` by points, every available product
+    with points in (product, X] is closer to X, and so is every product at
+    the same points as `product` but newer. Once RELATED_LIMIT of those
+    exist, `product` cannot make X's list; the same holds below.
+    """
+    points = product.total_points or 0
+    in_category = db.session.query(Product.total_points).filter(
+        Product.category_id == product.category_id, Product.is_available == True, Product.id != product.id
+    )
+    newer = in_category.filter(
+        Product.total_points == points, Product.created_at > product.created_at
+    ).limit(RELATED_LIMIT + 1).count()
+    if newer > RELATED_LIMIT:
+        return set()
+
+    # Poin produk ke-(RELATED_LIMIT - newer + 1) di tiap sisi: batas (eksklusif) jendela
+    skip = RELATED_LIMIT - newer
+    high = in_category.filter(Product.total_points > points).order_by(
+        Product.total_points.asc()).offset(skip).limit(1).scalar()
+    low = in_category.filter(Product.total_points < points).order_by(
+        Product.total_points.desc()).offset(skip).limit(1).scalar()
+
+    query = db.session.query(Product.id).filter(Product.category_id == product.category_id)
+    if high is not None:
+        query = query.filter(Product.total_points < high)
+    if low is not None:
+        query = query.filter(Product.total_points > low)
+    return {product_id for (product_id,) in query}
+
+
+def affected_products(product_ids):
+    """product_ids plus every product whose list they can appear in or leave"""
+    product_ids = set(product_ids)
+    affected = set(product_ids)
+    affected.update(product_id for (product_id,) in db.session.query(SimilarProduct.product_id).filter(
+        SimilarProduct.similar_id.in_(product_ids)
+    ))
+
+    changed = db.session.query(Product).filter(Product.id.in_(product_ids), Product.is_available == True).all()
+    sparse = _sparse_categories() if changed else []
+    for product in changed:
+        affected.update(_window(product))
+        others = [category_id for category_id in sparse if category_id != product.category_id]
+        if others:
+            points = product.total_points or 0
+            affected.update(product_id for (product_id,) in db.session.query(Product.id).filter(
+                Product.category_id.in_(others),
+                or_(Product.condition == product.condition,
+                    Product.total_points.between(points - POINTS_BAND, points + POINTS_BAND))
+            ))
+    return affected
+
+
+def _lists(products):
+    memo = {}
+    return {product.id: compute_related(product, memo) for product in products}
+
+
+def _insert(lists):
+    rows = [{'product_id': product_id, 'rank': rank, 'similar_id': similar_id}
+            for product_id, related in lists.items()
+            for rank, similar_id in enumerate(related)]
+    if rows:
+        db.session.execute(insert(SimilarProduct.__table__), rows)
+
+
+def _list_keys():
+    return db.session.query(Product.id, Product.category_id, Product.condition, Product.total_points)
+
+
+def refresh(product_ids):
+    """Recompute the lists that changes to product_ids can affect
+
+    Runs in the caller's transaction. Only lists whose content actually
+    changed are rewritten; returns how many.
+    """
+    affected = affected_products(product_ids)
+    if not affected:
+        return 0
+
+    current = {}
+    for product_id, similar_id in db.session.query(SimilarProduct.product_id, SimilarProduct.similar_id).filter(
+        SimilarProduct.product_id.in_(affected)
+    ).order_by(SimilarProduct.product_id, SimilarProduct.rank):
+        current.setdefault(product_id, []).append(similar_id)
+
+    lists = _lists(_list_keys().filter(Product.id.in_(affected)))
+    changed = {product_id: related for product_id, related in lists.items()
+               if current.get(product_id, []) != related}
+    # Daftar milik produk yang sudah dihapus ikut dibuang
+    stale = set(changed) | (set(current) - set(lists))
+    if stale:
+        db.session.execute(delete(SimilarProduct).where(SimilarProduct.product_id.in_(stale)))
+    _insert(changed)
+    return len(changed)
+
+
+def rebuild(batch_size=REBUILD_BATCH_SIZE):
+    """Recompute every list, replacing them batch by batch
+
+    The table is never emptied: until its batch is reached a product keeps
+    its old list, so detail pages never fall back to the live query while
+    a rebuild runs.
+    """
+    done = 0
+    last_id = 0
+    while True:
+        batch = _list_keys().filter(Product.id > last_id).order_by(Product.id).limit(batch_size).all()
+        if not batch:
+            break
+        lists = _lists(batch)
+        db.session.execute(delete(SimilarProduct).where(SimilarProduct.product_id.in_(list(lists))))
+        _insert(lists)
+        db.session.commit()
+        done += len(batch)
+        last_id = batch[-1].id
+        logger.info(f"Rebuilt similar products for {done} products")
+    # Daftar milik produk yang sudah tidak ada
+    db.session.execute(delete(SimilarProduct).where(
+        SimilarProduct.product_id.not_in(db.session.query(Product.id).scalar_subquery())
+    ))
+    db.session.commit()
+    return done
+
+
+def get_similar_products(product, limit=RELATED_LIMIT, same_category=False):
+    """Precomputed similar products of `product` with owner and category loaded
+
+    Products without a list yet (table not backfilled, or a new product
+    whose refresh job has not run) get one computed on the fly.
+    """
+    query = Product.query.options(*PRODUCT_CARD).filter(Product.is_available == True)
+    precomputed = query.join(
+        SimilarProduct, SimilarProduct.similar_id == Product.id
+    ).filter(SimilarProduct.product_id == product.id)
+    if same_category:
+        precomputed = precomputed.filter(Product.category_id == product.category_id)
+    products = precomputed.order_by(SimilarProduct.rank).limit(limit).all()
+    if not products and SimilarProduct.query.filter_by(product_id=product.id).first() is None:
+        related = compute_related(product)
+        if related:
+            fallback = query.filter(Product.id.in_(related))
+            if same_category:
+                fallback = fallback.filter(Product.category_id == product.category_id)
+            by_id = {other.id: other for other in fallback}
+            products = [by_id[product_id] for product_id in related if product_id in by_id][:limit]
+    return Product.preload_main_images(products)
+
+
+# ---------------------------------------------------------------------------
+# Refresh setelah commit
+# ---------------------------------------------------------------------------
+
+class SimilarRefresher:
+    """Interface for running refresh() after a transaction that changed products commits"""
+
+    def submit(self, product_ids):
+        raise NotImplementedError
+
+
+class ThreadPoolSimilarRefresher(SimilarRefresher):
+    """Refresh on one background thread inside the web process
+
+    One thread, so jobs of this process never rewrite the same list at
+    the same time.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='similar')
+
+    def submit(self, product_ids):
+        return self.executor.submit(self._run, product_ids)
+
+    def _run(self, product_ids):
+        with self.app.app_context():
+            try:
+                count = refresh(product_ids)
+                db.session.commit()
+                return count
+            except Exception as e:
+                db.session.rollback()
+                # Daftar lama tetap dipakai; bisa dibangun ulang lewat CLI
+                logger.error(f"Could not refresh similar products for {sorted(product_ids)}: {e}")
+                return None
+
+
+def init_similar(app, refresher=None):
+    """Refresh similar_products in the background after every transaction that changes products"""
+    app.extensions['similar'] = refresher or ThreadPoolSimilarRefresher(app)
+    if not event.contains(db.session, 'after_flush', _collect_changed_products):
+        event.listen(db.session, 'after_flush', _collect_changed_products)
+        event.listen(db.session, 'after_commit', _submit_changed_products)
+        event.listen(db.session, 'after_rollback', _discard_changed_products)
+
+
+def get_refresher():
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('similar')
+
+
+def _collect_changed_products(session, flush_context):
+    changed = session.info.setdefault('similar_changed', set())
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, Product):
+            changed.add(obj.id)
+    for obj in session.dirty:
+        if isinstance(obj, Product) and any(
+            inspect(obj).attrs[column].history.has_changes() for column in REFRESH_COLUMNS
+        ):
+            changed.add(obj.id)
+
+
+def _submit_changed_products(session):
+    changed = session.info.pop('similar_changed', None)
+    refresher = get_refresher()
+    if not changed or refresher is None:
+        return
+    try:
+        refresher.submit(changed)
+    except Exception as e:
+        # Perubahan produknya tetap disimpan; daftar bisa dibangun ulang lewat CLI
+        logger.error(f"Could not submit similar products refresh for {sorted(changed)}: {e}")
+
+
+def _discard_changed_products(session):
+    session.info.pop('similar_changed', None)
+
+
+if __name__ == '__main__':
+    from app import app
+
+    logging.basicConfig(level=logging.INFO)
+    with app.app_context():
+        logger.info(f"Rebuilt similar products for {rebuild()} products")
@@ -12,6 +12,12 @@ class FloatingChat {
         this.lastUnreadCount = 0;
         this.chatWindow = null;
         this.chatToggle = null;
+        this.eventSource = null;
+        this.streamConnected = false;
+        // False while the server's broker only fans out within one worker
+        this.streamShared = false;
+        this.roomsReloadTimer = null;
+        this.messageCache = {};
 
         this.init();
     }
@@ -30,6 +36,7 @@ class FloatingChat {
         const userAuthMeta = document.querySelector('meta[name="user-authenticated"]');
         if (userAuthMeta && userAuthMeta.content === 'true') {
             this.loadChatRooms();
+            this.connectStream();
         } else {
             // Hide chat for unauthenticated users
             this.updateChatRoomsList([]);
@@ -104,10 +111,96 @@ class FloatingChat {
         });
     }
 
+    connectStream() {
+        // Server push (SSE); polling below is only a fallback while disconnected
+        if (!('EventSource' in window)) return;
+
+        this.eventSource = new EventSource('/chat/stream');
+
+        this.eventSource.addEventListener('ready', (e) => {
+            const wasDisconnected = !this.streamConnected;
+            this.streamConnected = true;
+            this.streamShared = !!JSON.parse(e.data).shared;
+            if (wasDisconnected) {
+                // Catch up on anything missed while reconnecting
+                this.scheduleRoomsReload();
+            }
+        });
+
+        this.eventSource.addEventListener('chat_message', (e) => {
+            const data = JSON.parse(e.data);
+            if (this.activeChatRoomId === data.room_id) {
+                this.loadChatMessages(data.room_id);
+            }
+            this.scheduleRoomsReload();
+            this.dispatchChatEvent('chat_message', data);
+        });
+
+        this.eventSource.addEventListener('offer_status', (e) => {
+            const data = JSON.parse(e.data);
+            // An existing message changed, so the cached copy is stale
+            delete this.messageCache[data.room_id];
+            if (this.activeChatRoomId === data.room_id) {
+                this.loadChatMessages(data.room_id);
+            }
+            this.dispatchChatEvent('offer_status', data);
+        });
+
+        this.eventSource.addEventListener('unread', (e) => {
+            const data = JSON.parse(e.data);
+            this.updateChatBadge(data.total_unread || 0);
+            if (data.total_unread > this.lastUnreadCount) {
+                this.scheduleRoomsReload();
+            }
+            this.lastUnreadCount = data.total_unread || 0;
+        });
+
+        this.eventSource.addEventListener('activity', (e) => {
+            this.dispatchChatEvent('activity', JSON.parse(e.data));
+        });
+
+        this.eventSource.addEventListener('resync', () => {
+            this.messageCache = {};
+            this.scheduleRoomsReload();
+            if (this.activeChatRoomId) {
+                this.loadChatMessages(this.activeChatRoomId);
+            }
+        });
+
+        this.eventSource.onerror = () => {
+            // EventSource reconnects by itself; poll until 'ready' arrives again
+            this.streamConnected = false;
+        };
+    }
+
+    isPushComplete() {
+        // Every event reaches this tab only with a connected stream on a shared broker
+        return this.streamConnected && this.streamShared;
+    }
+
+    scheduleRoomsReload() {
+        // Coalesce bursts of events into a single /chat/rooms request
+        if (this.roomsReloadTimer) return;
+        this.roomsReloadTimer = setTimeout(() => {
+            this.roomsReloadTimer = null;
+            this.loadChatRooms();
+        }, 300);
+    }
+
+    dispatchChatEvent(type, detail) {
+        // Let page scripts (e.g. chat/room.html) react without their own polling
+        document.dispatchEvent(new CustomEvent('barterhub:chat', { detail: { type, ...detail } }));
+    }
+
     startAutoRefresh() {
-        // Refresh every 15 seconds
+        // Fallback refresh every 15 seconds while the push stream is down, and every
+        // 30 seconds while it is connected to a per-worker broker: events published
+        // by other workers never reach this stream
+        let ticks = 0;
         setInterval(() => {
-            if (document.visibilityState === 'visible') {
+            ticks += 1;
+            const due = !this.streamConnected || (!this.streamShared && ticks % 2 === 0);
+            if (due && document.visibilityState === 'visible') {
                 // Only load chat rooms if user is authenticated
                 const userAuthMeta = document.querySelector('meta[name="user-authenticated"]');
                 if (userAuthMeta && userAuthMeta.content === 'true') {
@@ -317,10 +410,10 @@ class FloatingChat {
         }
 
         this.refreshInterval = setInterval(() => {
-            if (this.activeChatRoomId === roomId && document.visibilityState === 'visible') {
+            if (!this.streamConnected && this.activeChatRoomId === roomId && document.visibilityState === 'visible') {
                 this.loadChatMessages(roomId);
             }
-        }, 3000); // Refresh every 3 seconds for active chat
+        }, 3000); // Fallback refresh every 3 seconds for active chat when push is unavailable
     }
 
     async loadChatMessages(roomId) {
@@ -334,14 +427,25 @@ class FloatingChat {
 
             if (!roomData.success) throw new Error(roomData.error || 'Failed to get room info');
 
-            // Get messages using room ID directly instead of product ID
-            const messagesResponse = await fetch(`/chat/room/${roomId}/messages_direct`, {
+            // Fetch only messages newer than what we already have for this room
+            const cached = this.messageCache[roomId];
+            const params = cached ? `since_id=${cached.latestId}` : 'limit=50';
+            const messagesResponse = await fetch(`/chat/room/${roomId}/messages_direct?${params}`, {
                 headers: { 'X-Requested-With': 'XMLHttpRequest' }
             });
             if (!messagesResponse.ok) throw new Error('Failed to fetch messages');
             const messagesData = await messagesResponse.json();
 
-            this.updateChatMessages(messagesData.messages || []);
+            const newMessages = messagesData.messages || [];
+            if (cached && newMessages.length === 0) return;
+
+            const messages = (cached ? cached.messages : []).concat(newMessages);
+            this.messageCache[roomId] = {
+                messages: messages.slice(-50),
+                latestId: messagesData.latest_id || (cached ? cached.latestId : 0)
+            };
+
+            this.updateChatMessages(this.messageCache[roomId].messages);
 
         } catch (error) {
             console.error('Error loading messages:', error);
@@ -233,13 +233,7 @@ function initializeChatAutoRefresh() {
         if (messagesContainer) {
             messagesContainer.scrollTop = messagesContainer.scrollHeight;
         }
-        
-        // Auto-refresh every 30 seconds
-        setInterval(function() {
-            if (document.visibilityState === 'visible') {
-                location.reload();
-            }
-        }, 30000);
+        // Updates arrive via the floating chat push stream (see chat/room.html)
     }
 }
 
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Penyimpanan upload content-addressed dan garbage collector
+
+File upload diberi nama dari sha256 isinya, jadi foto yang sama (mis. penjual
+yang relist barang) hanya disimpan dan diproses sekali:
+
+- produk: originals/<sha256>.upload di folder privat (private_folder(), di
+  luar static/) -> uploads/products/<sha256>.jpg plus variants/<hh>/<sha256>/
+  (lihat images.py). Beberapa ProductImage boleh menunjuk ke file yang sama;
+- foto profil: uploads/profiles/<sha256 file sumber>.jpg, dipakai bersama
+  oleh User.profile_picture yang isinya sama.
+
+Karena file bisa dipakai bersama, file tidak lagi dihapus saat gambar atau
+avatar diganti. Referensinya dihitung ulang dari tabel product_images dan
+users oleh collect_garbage(), yang menghapus file tanpa referensi, termasuk
+file dengan nama lama (name_<hex>.jpg, profile_<id>_<hex>.ext) yang sudah
+tidak dipakai. File yang lebih baru dari GRACE_SECONDS dibiarkan supaya
+upload yang barisnya belum di-commit tidak ikut terhapus.
+
+    python storage.py              # hapus file tanpa referensi
+    python storage.py --dry-run    # hanya tampilkan
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import time
+import uuid
+from flask import current_app
+from models import db, ProductImage, User, PLACEHOLDER_IMAGE
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+GRACE_SECONDS = 3600
+# File statis yang ikut tinggal di folder upload
+KEEP_FILES = {PLACEHOLDER_IMAGE}
+
+
+def private_folder(app=None):
+    """Uploads that must not be served from static/ (raw originals, partial uploads)"""
+    app = app or current_app
+    return app.config.get('PRIVATE_UPLOAD_FOLDER') or os.path.join(app.instance_path, 'uploads')
+
+
+def upload_folder(app=None):
+    """UPLOAD_FOLDER (served from static/); a relative path is resolved against the app, not the cwd"""
+    app = app or current_app
+    return os.path.join(app.root_path, app.config['UPLOAD_FOLDER'])
+
+
+def profiles_folder(app=None):
+    return os.path.join(upload_folder(app), 'profiles')
+
+
+def save_stream(stream, folder, suffix):
+    """Copy `stream` into `folder` as <sha256><suffix>; return the hash
+
+    The bytes go through a temp file in chunks while being hashed. When a
+    file with the same content already exists the copy is dropped and the
+    existing file's mtime is refreshed so the collector's grace period
+    starts over.
+    """
+    os.makedirs(folder, exist_ok=True)
+    tmp_path = os.path.join(folder, f".{uuid.uuid4().hex}.tmp")
+    digest = hashlib.sha256()
+    try:
+        with open(tmp_path, 'wb') as f:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                f.write(chunk)
+        content_hash = digest.hexdigest()
+        path = os.path.join(folder, f"{content_hash}{suffix}")
+        if os.path.exists(path):
+            os.utime(path)
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return content_hash
+
+
+def write_blob(data, folder, name):
+    """Atomically write `data` to folder/name unless it is already there"""
+    path = os.path.join(folder, name)
+    if os.path.exists(path):
+        os.utime(path)
+        return path
+    os.makedirs(folder, exist_ok=True)
+    tmp_path = os.path.join(folder, f".{uuid.uuid4().hex}.tmp")
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return path
+
+
+# ---------------------------------------------------------------------------
+# Garbage collection
+# ---------------------------------------------------------------------------
+
+class _Sweep:
+    def __init__(self, cutoff, dry_run):
+        self.cutoff = cutoff
+        self.dry_run = dry_run
+        self.files = 0
+        self.bytes = 0
+
+    def _is_old(self, path):
+        try:
+            return os.path.getmtime(path) < self.cutoff
+        except FileNotFoundError:
+            return False
+
+    def remove_file(self, path):
+        if not self._is_old(path):
+            return
+        size = os.path.getsize(path)
+        logger.info(f"{'Would remove' if self.dry_run else 'Removing'} {path}")
+        if not self.dry_run:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                return
+        self.files += 1
+        self.bytes += size
+
+    def remove_tree(self, path):
+        if not self._is_old(path):
+            return
+        sizes = [os.path.getsize(os.path.join(root, name))
+                 for root, _, names in os.walk(path) for name in names]
+        logger.info(f"{'Would remove' if self.dry_run else 'Removing'} {path}/ ({len(sizes)} files)")
+        if not self.dry_run:
+            shutil.rmtree(path, ignore_errors=True)
+        self.files += len(sizes)
+        self.bytes += sum(sizes)
+
+
+def _files(folder):
+    if not os.path.isdir(folder):
+        return []
+    return [entry for entry in os.scandir(folder) if entry.is_file()]
+
+
+def collect_garbage(dry_run=False, grace=GRACE_SECONDS):
+    """Remove upload files no ProductImage or User refers to
+
+    Returns (files removed, bytes freed). Must run inside an app context.
+    """
+    from images import ORIGINALS_FOLDER, originals_folder, products_folder
+    from uploads import INCOMING_FOLDER
+
+    sweep = _Sweep(time.time() - grace, dry_run)
+
+    # Referensi dihitung dari database, bukan counter tersimpan, jadi tidak bisa melenceng
+    referenced = set()
+    unprocessed = set()
+    hashes = set()
+    for filename, status, content_hash in db.session.query(
+        ProductImage.filename, ProductImage.status, ProductImage.content_hash
+    ):
+        referenced.add(filename)
+        if status != 'ready':
+            unprocessed.add(os.path.splitext(filename)[0])
+        if content_hash:
+            hashes.add(content_hash)
+
+    folder = products_folder()
+    for entry in _files(folder):
+        if entry.name not in referenced and entry.name not in KEEP_FILES:
+            sweep.remove_file(entry.path)
+
+    # File mentah hanya perlu selama gambarnya belum 'ready' (termasuk sisa di lokasi lama di static/)
+    for originals in (originals_folder(), os.path.join(folder, ORIGINALS_FOLDER)):
+        for entry in _files(originals):
+            if os.path.splitext(entry.name)[0] not in unprocessed:
+                sweep.remove_file(entry.path)
+
+    variants = os.path.join(folder, ProductImage.VARIANTS_FOLDER)
+    if os.path.isdir(variants):
+        for prefix in os.scandir(variants):
+            if not prefix.is_dir():
+                continue
+            for entry in os.scandir(prefix.path):
+                if entry.is_dir() and entry.name not in hashes:
+                    sweep.remove_tree(entry.path)
+            if not dry_run and not os.listdir(prefix.path):
+                os.rmdir(prefix.path)
+
+    # Sisa upload dari proses yang mati di tengah request
+    for incoming in (private_folder(), upload_folder()):
+        for entry in _files(os.path.join(incoming, INCOMING_FOLDER)):
+            sweep.remove_file(entry.path)
+
+    avatars = {name for (name,) in db.session.query(User.profile_picture).filter(
+        User.profile_picture.isnot(None)
+    ).distinct()}
+    for entry in _files(profiles_folder()):
+        if entry.name not in avatars:
+            sweep.remove_file(entry.path)
+
+    return sweep.files, sweep.bytes
+
+
+if __name__ == '__main__':
+    import argparse
+    from app import app
+
+    parser = argparse.ArgumentParser(description='Remove unreferenced BarterHub uploads')
+    parser.add_argument('--dry-run', action='store_true', help='Only list what would be removed')
+    parser.add_argument('--grace', type=int, default=GRACE_SECONDS,
+                        help='Keep files modified within this many seconds (default: %(default)s)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    with app.app_context():
+        files, size = collect_garbage(dry_run=args.dry_run, grace=args.grace)
+        logger.info(f"{'Would free' if args.dry_run else 'Freed'} {size / 1024 / 1024:.1f}MB in {files} files")
@@ -0,0 +1,63 @@
+"""
+Fixture bersama: app dengan database SQLite di memori
+
+Memakai create_benchmark_app() dari benchmark.py (blueprint terdaftar,
+tanpa init_db), jadi yang diuji adalah route yang sama dengan benchmark.
+"""
+
+import contextvars
+import pytest
+from sqlalchemy import event
+import changes
+from benchmark import create_benchmark_app
+from models import db
+
+
+@pytest.fixture
+def app():
+    app = create_benchmark_app('sqlite://')
+    # Index di memori bersifat per proses: mulai dari kosong untuk setiap database baru
+    for index in changes._indexes:
+        index.reset()
+    changes.feed.seen.clear()
+    changes.feed.since = None
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def login(client, user_id):
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+
+
+def count_statements(client, url):
+    """(response, SQL statements executed) for one GET request
+
+    The request runs in an empty context so it gets its own app context
+    and session, as on the server, instead of the test's. The change feed
+    is not polled during the request: it queries only once POLL_SECONDS
+    have passed, which would make the count depend on timing.
+    """
+    counter = {'count': 0}
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        counter['count'] += 1
+
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    changes.feed.poll = lambda force=False: None
+    try:
+        response = contextvars.Context().run(client.get, url)
+    finally:
+        del changes.feed.poll
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+    return response, counter['count']
@@ -0,0 +1,62 @@
+import sys
+import threading
+import time
+import changes
+from search import ProductSearchIndex
+
+PRODUCTS = 5000
+
+
+class ListSearchIndex(ProductSearchIndex):
+    """ProductSearchIndex over rows in a list instead of the products table"""
+
+    def __init__(self, rows):
+        super().__init__()
+        self.rows = rows
+
+    def _load(self, product_ids=None):
+        return [row for row in self.rows if product_ids is None or row[0] in product_ids]
+
+
+def test_search_while_another_thread_refreshes(monkeypatch):
+    monkeypatch.setattr(changes, '_indexes', [])
+    monkeypatch.setattr(changes.feed, 'poll', lambda force=False: None)
+    # Ganti thread sesering mungkin supaya balapan muncul dalam waktu singkat
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    rows = [(product_id, f'Barang nomor {product_id}', 'deskripsi', 'apa saja', True)
+            for product_id in range(1, PRODUCTS + 1)]
+    index = ListSearchIndex(rows)
+    index.ensure_fresh()
+
+    errors, results = [], []
+    stop = threading.Event()
+
+    def refresh():
+        # Setiap putaran menghapus lalu menambah ulang separuh produk
+        while not stop.is_set():
+            for product_id in range(1, PRODUCTS + 1, 2):
+                index.mark_dirty('product', product_id)
+            index.ensure_fresh()
+
+    def search():
+        try:
+            while not stop.is_set():
+                results.append(len(index.search('barang', limit=PRODUCTS)))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=refresh)] + [threading.Thread(target=search) for _ in range(3)]
+    try:
+        for thread in threads:
+            thread.start()
+        time.sleep(1.5)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        sys.setswitchinterval(switch_interval)
+
+    assert errors == []
+    # Refresh yang setengah jalan akan terlihat sebagai hasil yang kurang
+    assert results and set(results) == {PRODUCTS}
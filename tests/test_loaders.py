@@ -0,0 +1,40 @@
+"""Statements per request must not grow with the number of rows (lazy load per row)"""
+
+import pytest
+from benchmark import listing_urls, seed_inbox, seed_listings
+from cache import get_cache, FRAGMENTS_GENERATION_KEY
+from conftest import count_statements, login
+
+SIZES = (3, 12)
+
+
+def statements(client, url):
+    # Fragment cache dibuang supaya yang dihitung tetap query render-nya
+    get_cache().delete(FRAGMENTS_GENERATION_KEY)
+    response, count = count_statements(client, url)
+    assert response.status_code == 200, url
+    return count
+
+
+@pytest.mark.parametrize('url', listing_urls('<id>'))
+def test_listing_statements_do_not_grow(app, client, url):
+    counts = []
+    for size in SIZES:
+        user_id, product_id = seed_listings(size)
+        # Daftar produk serupa biasanya diisi job background setelah commit
+        app.extensions['similar'].run()
+        login(client, user_id)
+        page = url.replace('<id>', str(product_id))
+        statements(client, page)  # warm-up: index pencarian, cache kategori
+        counts.append(statements(client, page))
+    assert counts[0] == counts[-1], counts
+
+
+def test_inbox_statements_do_not_grow(app, client):
+    counts = []
+    for size in SIZES:
+        user_id = seed_inbox(size)
+        login(client, user_id)
+        statements(client, '/chat/rooms')
+        counts.append(statements(client, '/chat/rooms'))
+    assert counts[0] == counts[-1], counts
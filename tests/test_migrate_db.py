@@ -0,0 +1,12 @@
+from migrate_db import check_indexes
+from models import db
+
+
+def test_hot_queries_use_indexes(app):
+    assert check_indexes(db.engine) == []
+
+
+def test_check_indexes_reports_table_scans(app):
+    db.session.execute(db.text('DROP INDEX idx_chat_rooms_user1_id'))
+    db.session.commit()
+    assert check_indexes(db.engine) == ['chat_rooms_by_user1']
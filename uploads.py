@@ -0,0 +1,113 @@
+"""
+Upload gambar yang di-stream langsung ke disk
+
+Tanpa ini Werkzeug menampung setiap file upload di BytesIO (request < 500KB)
+atau TemporaryFile, lalu store_upload menyalin dan membaca ulang file itu.
+UploadRequest menulis setiap bagian file langsung ke
+incoming/<uuid>.part di folder upload privat (storage.private_folder) per
+chunk sambil:
+
+- menghitung sha256, jadi storage cukup me-rename file ke nama
+  content-addressed-nya tanpa menyalin atau membaca ulang;
+- mengecek header file (JPEG/PNG/GIF/WebP) di chunk pertama dan ukuran per
+  file (UPLOAD_MAX_FILE_BYTES), sehingga file yang bukan gambar atau terlalu
+  besar ditolak (415 / 413) sebelum sisa body dibaca.
+
+Memori per request tetap kecil (satu chunk parser) berapapun jumlah dan
+ukuran file yang di-upload bersamaan. File .part yang tidak dipakai dihapus
+saat request selesai; sisa proses yang mati dibersihkan storage.py.
+"""
+
+import hashlib
+import io
+import os
+import uuid
+from flask import Request, current_app
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+from storage import private_folder
+
+INCOMING_FOLDER = 'incoming'
+UPLOAD_MAX_FILE_BYTES = 10 * 1024 * 1024
+HEADER_BYTES = 12
+
+IMAGE_SIGNATURES = (
+    b'\xff\xd8\xff',            # JPEG
+    b'\x89PNG\r\n\x1a\n',       # PNG
+    b'GIF87a', b'GIF89a',       # GIF
+)
+
+
+def sniff_image(head):
+    """True if the first bytes of a file look like a supported image"""
+    return head.startswith(IMAGE_SIGNATURES) or (head[:4] == b'RIFF' and head[8:12] == b'WEBP')
+
+
+class IncomingUpload(io.FileIO):
+    """Temp file for one multipart file part, validated and hashed as it is written"""
+
+    def __init__(self, folder, max_bytes=UPLOAD_MAX_FILE_BYTES):
+        os.makedirs(folder, exist_ok=True)
+        self.path = os.path.join(folder, f"{uuid.uuid4().hex}.part")
+        super().__init__(self.path, 'w+b')
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.head = b''
+        self.digest = hashlib.sha256()
+        self.kept = False
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            self.close()
+            raise RequestEntityTooLarge(f"File lebih dari {self.max_bytes // (1024 * 1024)}MB.")
+        if len(self.head) < HEADER_BYTES:
+            self.head += bytes(data[:HEADER_BYTES - len(self.head)])
+            if len(self.head) >= HEADER_BYTES and not sniff_image(self.head):
+                self.close()
+                raise UnsupportedMediaType('Hanya file gambar (JPG, PNG, GIF, WebP) yang diperbolehkan.')
+        self.digest.update(data)
+        return super().write(data)
+
+    @property
+    def is_image(self):
+        return sniff_image(self.head)
+
+    @property
+    def content_hash(self):
+        return self.digest.hexdigest()
+
+    def keep(self, folder, suffix):
+        """Move the file to folder/<sha256><suffix> and return the hash
+
+        When that file already exists (same content uploaded before) the
+        temp file is discarded on close instead.
+        """
+        path = os.path.join(folder, f"{self.content_hash}{suffix}")
+        os.makedirs(folder, exist_ok=True)
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            os.replace(self.path, path)
+            self.kept = True
+        return self.content_hash
+
+    def close(self):
+        super().close()
+        if not self.kept:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+
+class UploadRequest(Request):
+    """Request whose file parts stream straight into IncomingUpload temp files"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # Di folder privat yang sama dengan originals/, jadi keep() cukup rename
+        folder = os.path.join(private_folder(), INCOMING_FOLDER)
+        return IncomingUpload(folder, current_app.config.get('UPLOAD_MAX_FILE_BYTES', UPLOAD_MAX_FILE_BYTES))
+
+
+def init_uploads(app):
+    app.request_class = UploadRequest
@@ -1,60 +1,138 @@
 
+import hashlib
+import io
 import os
+import threading
+from collections import OrderedDict
 from PIL import Image
-from werkzeug.utils import secure_filename
-from flask import current_app
-import secrets
+from storage import profiles_folder, write_blob
+from uploads import IncomingUpload
+
+PROFILE_PICTURE_SIZE = (400, 400)
+PROFILE_PICTURE_MAX_BYTES = 512 * 1024  # 512KB
+# Quality yang dicoba: 85, 80, ..., 20 (sama dengan langkah loop lama)
+JPEG_QUALITIES = list(range(85, 19, -5))
+
+# (resolusi sumber, target bytes) -> quality terakhir yang dipilih
+_jpeg_quality_cache = OrderedDict()
+_jpeg_quality_lock = threading.Lock()
+JPEG_QUALITY_CACHE_SIZE = 256
+
+
+def encode_jpeg_under(image, max_bytes, cache_key=None, qualities=JPEG_QUALITIES):
+    """Encode to JPEG in memory at the highest quality that fits max_bytes
+
+    Picks the same quality as stepping down `qualities` one by one, but by
+    bisection: at most 5 encodes for 85..20 instead of 14, usually 1-2 when
+    a quality is cached for the same source resolution. When nothing fits,
+    the lowest quality is used. Returns (jpeg bytes, quality).
+    """
+    encoded = {}
+
+    def fits(index):
+        quality = qualities[index]
+        if quality not in encoded:
+            buffer = io.BytesIO()
+            image.save(buffer, 'JPEG', quality=quality, optimize=True)
+            encoded[quality] = buffer.getvalue()
+        return len(encoded[quality]) <= max_bytes
+
+    # Cari index pertama yang muat di [low, high]; high = quality terendah (fallback)
+    low, high = 0, len(qualities) - 1
+    cache_key = (cache_key, max_bytes) if cache_key is not None else None
+    with _jpeg_quality_lock:
+        hint = _jpeg_quality_cache.get(cache_key)
+
+    if hint in qualities:
+        index = qualities.index(hint)
+        if fits(index):
+            high = index
+            if index > 0 and fits(index - 1):
+                high = index - 1
+            else:
+                low = index
+        else:
+            low = min(index + 1, high)
+    elif fits(0):
+        high = 0
+    else:
+        low = 1
+
+    while low < high:
+        middle = (low + high) // 2
+        if fits(middle):
+            high = middle
+        else:
+            low = middle + 1
+
+    quality = qualities[low]
+    fits(low)  # pastikan sudah di-encode (fallback quality terendah)
+    if cache_key is not None:
+        with _jpeg_quality_lock:
+            _jpeg_quality_cache[cache_key] = quality
+            _jpeg_quality_cache.move_to_end(cache_key)
+            while len(_jpeg_quality_cache) > JPEG_QUALITY_CACHE_SIZE:
+                _jpeg_quality_cache.popitem(last=False)
+    return encoded[quality], quality
+
+
+def encode_profile_picture(stream, max_bytes=PROFILE_PICTURE_MAX_BYTES):
+    """Decode, resize to PROFILE_PICTURE_SIZE and JPEG-encode an avatar in memory"""
+    image = Image.open(stream)
+    source_size = image.size
+
+    # JPEG bisa di-decode langsung di skala 1/2, 1/4, 1/8 (DCT scaling):
+    # foto HP 12MP tidak perlu di-decode penuh hanya untuk jadi 400px
+    if image.format == 'JPEG':
+        image.draft('RGB', PROFILE_PICTURE_SIZE)
+
+    # Convert to RGB if necessary
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGB')
+
+    # Resize to max 400x400 while maintaining aspect ratio
+    image.thumbnail(PROFILE_PICTURE_SIZE, Image.Resampling.LANCZOS)
+
+    data, _ = encode_jpeg_under(image, max_bytes, cache_key=source_size)
+    return data
+
 
 def save_profile_picture(file, user_id):
-    """Save and compress profile picture"""
+    """Save and compress profile picture
+
+    The file is named after the sha256 of the upload, so the same photo is
+    encoded and stored once and shared by every user who uploads it. Old
+    avatars are left for storage.collect_garbage().
+    """
     try:
-        # Generate secure filename
-        filename = secure_filename(file.filename)
-        name, ext = os.path.splitext(filename)
-        random_hex = secrets.token_hex(8)
-        filename = f"profile_{user_id}_{random_hex}{ext}"
-        
-        # Create directory if not exists
-        upload_path = os.path.join(current_app.static_folder, 'uploads', 'profiles')
-        os.makedirs(upload_path, exist_ok=True)
-        
-        file_path = os.path.join(upload_path, filename)
-        
-        # Open and compress image
-        image = Image.open(file.stream)
-        
-        # Convert to RGB if necessary
-        if image.mode in ('RGBA', 'LA', 'P'):
-            image = image.convert('RGB')
-        
-        # Resize to max 400x400 while maintaining aspect ratio
-        image.thumbnail((400, 400), Image.Resampling.LANCZOS)
-        
-        # Save with optimized quality to achieve ~512KB target
-        quality = 85
-        image.save(file_path, 'JPEG', quality=quality, optimize=True)
-        
-        # Check file size and adjust quality if needed
-        file_size = os.path.getsize(file_path)
-        max_size = 512 * 1024  # 512KB
-        
-        while file_size > max_size and quality > 20:
-            quality -= 5
-            image.save(file_path, 'JPEG', quality=quality, optimize=True)
-            file_size = os.path.getsize(file_path)
-        
+        if isinstance(file.stream, IncomingUpload):
+            # Hash sudah dihitung saat upload di-stream (uploads.py)
+            content_hash = file.stream.content_hash
+        else:
+            digest = hashlib.sha256()
+            for chunk in iter(lambda: file.stream.read(64 * 1024), b''):
+                digest.update(chunk)
+            file.stream.seek(0)
+            content_hash = digest.hexdigest()
+        filename = f"{content_hash}.jpg"
+
+        upload_path = profiles_folder()
+        if os.path.exists(os.path.join(upload_path, filename)):
+            os.utime(os.path.join(upload_path, filename))
+            return filename
+
+        # Compress in memory (~512KB target), write to disk once
+        data = encode_profile_picture(file.stream)
+        write_blob(data, upload_path, filename)
+
         return filename
         
     except Exception as e:
         print(f"Error saving profile picture: {e}")
         return None
 
-
 import os
-import uuid
 from PIL import Image
-from werkzeug.utils import secure_filename
-from flask import current_app
 
 def allowed_file(filename):
     """Check if file extension is allowed"""
@@ -62,59 +140,39 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def save_uploaded_file(file, subfolder='products'):
-    """Save uploaded file and return filename"""
-    if file and allowed_file(file.filename):
-        # Generate unique filename
-        filename = secure_filename(file.filename)
-        name, ext = os.path.splitext(filename)
-        unique_filename = f"{name}_{uuid.uuid4().hex[:8]}{ext}"
-        
-        # Create directory if it doesn't exist
-        upload_path = os.path.join(current_app.config['UPLOAD_FOLDER'], subfolder)
-        os.makedirs(upload_path, exist_ok=True)
-        
-        # Save file
-        file_path = os.path.join(upload_path, unique_filename)
-        file.save(file_path)
-        
-        # Resize image if it's too large
-        try:
-            with Image.open(file_path) as img:
-                if img.width > 800 or img.height > 800:
-                    img.thumbnail((800, 800), Image.Resampling.LANCZOS)
-                    img.save(file_path, optimize=True, quality=85)
-        except Exception as e:
-            print(f"Error resizing image: {e}")
-        
-        return unique_filename
-    return None
-
 def calculate_point_balance(seller_points, buyer_points):
     """Calculate if the point exchange is balanced"""
     difference = abs(seller_points - buyer_points)
     tolerance = max(seller_points, buyer_points) * 0.1  # 10% tolerance
     return difference <= tolerance
 
+def balanced_range(points):
+    """(low, high): every integer y in that range satisfies calculate_point_balance(points, y)"""
+    # y <= x: x - y <= 0.1x  ->  y >= 0.9x;  y > x: y - x <= 0.1y  ->  y <= x / 0.9
+    return (9 * points + 9) // 10, (10 * points) // 9
+
+# Label Bahasa Indonesia, dibuat sekali saat import (bukan per panggilan)
+TRANSACTION_STATUS_LABELS = {
+    'pending': 'Menunggu Persetujuan',
+    'agreed': 'Disepakati',
+    'shipped': 'Dalam Pengiriman',
+    'completed': 'Selesai',
+    'cancelled': 'Dibatalkan',
+    'dispute': 'Sengketa'
+}
+
+CONDITION_LABELS = {
+    'New': 'Baru',
+    'Like New': 'Seperti Baru',
+    'Good': 'Baik',
+    'Fair': 'Cukup',
+    'Poor': 'Buruk'
+}
+
 def get_transaction_status_text(status):
     """Get Indonesian translation for transaction status"""
-    status_map = {
-        'pending': 'Menunggu Persetujuan',
-        'agreed': 'Disepakati',
-        'shipped': 'Dalam Pengiriman',
-        'completed': 'Selesai',
-        'cancelled': 'Dibatalkan',
-        'dispute': 'Sengketa'
-    }
-    return status_map.get(status, status)
+    return TRANSACTION_STATUS_LABELS.get(status, status)
 
 def get_condition_text(condition):
     """Get Indonesian translation for product condition"""
-    condition_map = {
-        'New': 'Baru',
-        'Like New': 'Seperti Baru',
-        'Good': 'Baik',
-        'Fair': 'Cukup',
-        'Poor': 'Buruk'
-    }
-    return condition_map.get(condition, condition)
+    return CONDITION_LABELS.get(condition, condition)